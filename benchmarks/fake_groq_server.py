@@ -0,0 +1,147 @@
+# benchmarks/fake_groq_server.py
+"""
+Servidor local que imita la API de chat de Groq (compatible con OpenAI), para
+probar sin red el gateway del LLM: límites de peticiones y tokens por minuto con
+429 y Retry-After, latencia configurable, streaming y llamadas a herramientas.
+Responde como los LLM falsos de benchmarks/fakes.py: JSON de metadatos para los
+prompts de metadatos y, para el agente, retrieve_context seguido de un extracto.
+
+Uso:
+    python -m benchmarks.fake_groq_server --port 8100 --rpm 30 --tpm 6000 --latency 0.3
+    GROQ_API_BASE=http://127.0.0.1:8100 GROQ_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.fakes import _WORD_RE
+
+
+class _WindowLimiter:
+    """Peticiones y tokens de los últimos 60 s, como los límites por minuto del proveedor."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def admit(self, tokens):
+        """Registra la petición y devuelve 0, o los segundos que faltan si supera algún límite."""
+        now = time.monotonic()
+        with self._lock:
+            while self._events and now - self._events[0][0] >= 60:
+                self._events.popleft()
+            used = sum(t for _, t in self._events)
+            if (self.rpm and len(self._events) + 1 > self.rpm) or (self.tpm and used + tokens > self.tpm):
+                return max(0.1, 60 - (now - self._events[0][0])) if self._events else 1.0
+            self._events.append((now, tokens))
+            return 0
+
+
+def _text(content):
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def _reply(body):
+    """(content, tool_calls) para una petición de chat."""
+    messages = body.get("messages") or []
+    last = messages[-1] if messages else {}
+    if last.get("role") == "tool":
+        return f"Según los documentos: {_text(last.get('content'))[:200]}", None
+    if body.get("tools"):
+        query = _text(last.get("content"))
+        call_id = hashlib.blake2b(query.encode("utf-8"), digest_size=6).hexdigest()
+        return "", [{"id": f"call_{call_id}", "type": "function",
+                     "function": {"name": "retrieve_context", "arguments": json.dumps({"query": query})}}]
+    words = _WORD_RE.findall(_text(last.get("content")))
+    return json.dumps({
+        "title": " ".join(words[:6]),
+        "summary": " ".join(words[:40]),
+        "topics": [w for w, _ in Counter(w.lower() for w in words if len(w) > 5).most_common(5)],
+        "entities": sorted({w for w in words if w[:1].isupper() and len(w) > 3})[:8],
+    }), None
+
+
+def create_app(rpm=30, tpm=6000, latency=0.0):
+    app = FastAPI()
+    limiter = _WindowLimiter(rpm, tpm)
+    stats = Counter()
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt_tokens = sum(len(_text(m.get("content"))) for m in body.get("messages") or []) // 4 + 1
+        content, tool_calls = _reply(body)
+        completion_tokens = len(content) // 4 + 1
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        retry_after = limiter.admit(usage["total_tokens"])
+        if retry_after:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status_code=429, headers={"retry-after": f"{retry_after:.2f}"},
+            )
+        stats["completed"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+
+        completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), body.get("model")
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        if not body.get("stream"):
+            return {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage}
+
+        def event(delta, finish=None, **extra):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        async def events():
+            yield event({"role": "assistant", "content": ""})
+            if tool_calls:
+                yield event({"tool_calls": [{"index": 0, **call} for call in tool_calls]})
+            for start in range(0, len(content), 16):
+                yield event({"content": content[start:start + 16]})
+            yield event({}, finish_reason, x_groq={"usage": usage})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de Groq.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--rpm", type=int, default=30, help="Peticiones por minuto (0 = sin límite).")
+    parser.add_argument("--tpm", type=int, default=6000, help="Tokens por minuto (0 = sin límite).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos por respuesta.")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.rpm, args.tpm, args.latency), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
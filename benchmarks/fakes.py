@@ -0,0 +1,112 @@
+# benchmarks/fakes.py
+"""
+Sustitutos locales y deterministas del LLM y del modelo de embeddings, para medir
+el pipeline sin red ni GPU. Las latencias simuladas son configurables.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import Counter
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddings(Embeddings):
+    """Bolsa de palabras con hashing a `size` dimensiones, normalizada (coseno = producto escalar)."""
+
+    def __init__(self, size=384):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in _WORD_RE.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.size] += 1.0 if (digest >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeMetadataLLM(BaseChatModel):
+    """Devuelve un JSON de DocumentMetadata derivado del propio texto, tras `latency` segundos."""
+
+    latency: float = 0.0
+    model_name: str = "fake-metadata-llm"
+
+    @property
+    def _llm_type(self):
+        return "fake-metadata"
+
+    def _respond(self, messages):
+        words = _WORD_RE.findall(messages[-1].content)
+        topics = [w for w, _ in Counter(w.lower() for w in words if len(w) > 5).most_common(5)]
+        entities = sorted({w for w in words if w[:1].isupper() and len(w) > 3})[:8]
+        metadata = {
+            "title": " ".join(words[:6]),
+            "summary": " ".join(words[:40]),
+            "topics": topics,
+            "entities": entities,
+        }
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=json.dumps(metadata)))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+
+class FakeAgentLLM(BaseChatModel):
+    """
+    Modelo de chat que imita el bucle del agente RAG: ante una pregunta pide la
+    herramienta retrieve_context y, con su resultado, responde con un extracto.
+    """
+
+    latency: float = 0.0
+    model_name: str = "fake-agent-llm"
+
+    @property
+    def _llm_type(self):
+        return "fake-agent"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages):
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            message = AIMessage(content=f"Según los documentos: {last.content[:200]}")
+        else:
+            call_id = hashlib.blake2b(str(last.content).encode("utf-8"), digest_size=6).hexdigest()
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": "retrieve_context", "args": {"query": last.content}, "id": f"call_{call_id}"}],
+            )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
@@ -0,0 +1,292 @@
+# benchmarks/run_benchmarks.py
+"""
+Benchmark reproducible de ingesta y consulta.
+
+Genera corpus sintéticos escalando los documentos de data/ (10x, 100x, 1000x),
+usa un LLM falso determinista y embeddings locales por hashing, y mide throughput
+de ingesta, latencias de retrieval y de chat extremo a extremo, y pico de RSS.
+Cada escala se ejecuta en un proceso nuevo para que el pico de memoria sea suyo.
+
+Uso:
+    python -m benchmarks.run_benchmarks --scales 10 100 --output bench.json
+    python -m benchmarks.run_benchmarks --scales 10 --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+DEFAULT_SCALES = (10, 100, 1000)
+SAMPLE_QUESTIONS = os.path.join("src", "prompts", "Sample_questions.txt")
+CHAT_CONCURRENCY = 32
+
+
+def _percentiles_ms(samples):
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000.0, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _dir_size_mb(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return round(total / 2**20, 2)
+
+
+def _peak_rss_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_questions():
+    with open(SAMPLE_QUESTIONS, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def make_corpus(scale, out_dir, data_path="data", seed=0):
+    """
+    Replica los documentos de `data_path` `scale` veces. Cada copia lleva una
+    referencia y unas frases barajadas propias para que su hash (y sus chunks) sean distintos.
+    """
+    rng = random.Random(seed)
+    sources = sorted(f for f in os.listdir(data_path) if os.path.isfile(os.path.join(data_path, f)))
+    texts = {}
+    for name in sources:
+        with open(os.path.join(data_path, name), "r") as f:
+            texts[name] = f.read()
+
+    for i in range(scale):
+        copy_dir = os.path.join(out_dir, f"batch_{i // 100:03d}")
+        os.makedirs(copy_dir, exist_ok=True)
+        for name, text in texts.items():
+            sentences = text.split(". ")
+            rng.shuffle(sentences)
+            stem, ext = os.path.splitext(name)
+            with open(os.path.join(copy_dir, f"{stem}_{i:05d}{ext}"), "w") as f:
+                f.write(f"Ref. {stem.upper()}-{i:05d}\n\n" + ". ".join(sentences))
+    return len(sources) * scale
+
+
+class _Progress:
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, stage, count=1):
+        self.counts[stage] = self.counts.get(stage, 0) + count
+
+
+def run_scale(scale, llm_latency, queries_per_run, seed):
+    """Ejecuta todas las mediciones de una escala y devuelve un dict serializable."""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{scale}x_")
+    # Cachés aisladas: los resultados no dependen de ejecuciones anteriores.
+    os.environ["METADATA_CACHE_PATH"] = os.path.join(workdir, "metadata_cache.sqlite")
+    os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(workdir, "embedding_cache")
+
+    from benchmarks.fakes import FakeAgentLLM, FakeMetadataLLM, HashingEmbeddings
+    from src.ingestion.loaders import load_docs
+    from src.ingestion.run_ingestion_pipeline import run_versioned_ingestion
+    from src.ingestion.splitters import split_docs
+    from src.ingestion.store_versions import current_version, discard_build, prepare_build, version_dir
+    from src.ingestion.vector_store import store_in_chroma
+    from src.service.answer_cache import SemanticAnswerCache
+    from src.service.rag_service import aget_chat_answer, load_rag_agent
+
+    try:
+        corpus_dir = os.path.join(workdir, "data")
+        stores_root = os.path.join(workdir, "stores")
+        n_files = make_corpus(scale, corpus_dir, seed=seed)
+        embeddings = HashingEmbeddings()
+        metadata_llm = FakeMetadataLLM(latency=llm_latency)
+        result = {"scale": scale, "files": n_files}
+
+        # Etapas aisladas
+        start = time.perf_counter()
+        docs = load_docs(corpus_dir)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        chunks = split_docs(docs)
+        split_s = time.perf_counter() - start
+        start = time.perf_counter()
+        store_in_chroma(chunks, embeddings, persist_dir=os.path.join(workdir, "store_only"))
+        store_s = time.perf_counter() - start
+        result["load_docs"] = {"seconds": round(load_s, 4), "docs_per_s": round(len(docs) / load_s, 1)}
+        result["split_docs"] = {"seconds": round(split_s, 4), "chunks_per_s": round(len(chunks) / split_s, 1)}
+        result["store_in_chroma"] = {"seconds": round(store_s, 4), "vectors_per_s": round(len(chunks) / store_s, 1)}
+        del docs, chunks
+
+        # Pipeline completo, y re-ingesta sin cambios (camino incremental)
+        progress = _Progress()
+        start = time.perf_counter()
+        run_versioned_ingestion(stores_root, data_path=corpus_dir, progress=progress,
+                                embeddings=embeddings, metadata_llm=metadata_llm)
+        ingest_s = time.perf_counter() - start
+        counts = progress.counts
+        result["ingestion"] = {
+            "seconds": round(ingest_s, 4),
+            "docs_per_s": round(counts.get("documents_loaded", 0) / ingest_s, 1),
+            "chunks_per_s": round(counts.get("chunks_split", 0) / ingest_s, 1),
+            "vectors_per_s": round(counts.get("vectors_upserted", 0) / ingest_s, 1),
+            "counts": counts,
+        }
+        start = time.perf_counter()
+        run_versioned_ingestion(stores_root, data_path=corpus_dir, embeddings=embeddings, metadata_llm=metadata_llm)
+        result["reingest_unchanged"] = {"seconds": round(time.perf_counter() - start, 4)}
+        # Tamaño en disco de la versión publicada (vector store, doc store, metadatos e índices).
+        result["store_mb"] = _dir_size_mb(version_dir(current_version(stores_root), stores_root))
+        # Coste fijo de toda ingesta incremental: copiar la versión actual (reflink si el FS lo admite).
+        start = time.perf_counter()
+        name, _ = prepare_build(stores_root)
+        result["prepare_build"] = {"seconds": round(time.perf_counter() - start, 4), "store_mb": result["store_mb"]}
+        discard_build(name, stores_root)
+
+        # Consultas: las preguntas de ejemplo con un sufijo distinto para no acertar en caché.
+        runtime = load_rag_agent(stores_root=stores_root, embeddings=embeddings, llm=FakeAgentLLM(latency=llm_latency))
+        runtime.answer_cache = SemanticAnswerCache(threshold=float("inf"))
+        questions = load_questions()
+        queries = [f"{questions[i % len(questions)]} ({i})" for i in range(queries_per_run)]
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            runtime.vectordb.similarity_search(query, k=2)
+            latencies.append(time.perf_counter() - start)
+        result["similarity_search"] = _percentiles_ms(latencies)
+
+        async def chat_latencies():
+            samples = []
+            for query in queries:
+                start = time.perf_counter()
+                await aget_chat_answer(runtime, query)
+                samples.append(time.perf_counter() - start)
+            return samples
+
+        result["chat_e2e"] = _percentiles_ms(asyncio.run(chat_latencies()))
+
+        # Las mismas consultas (con otro sufijo, para no acertar en caché) en paralelo:
+        # mide el throughput con los embeddings de consulta agrupados por el batcher.
+        async def chat_concurrent(concurrency=CHAT_CONCURRENCY):
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def ask(query):
+                async with semaphore:
+                    await aget_chat_answer(runtime, query)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(ask(f"{query} [c]") for query in queries))
+            return time.perf_counter() - start
+
+        concurrent_s = asyncio.run(chat_concurrent())
+        result["chat_concurrent"] = {
+            "concurrency": CHAT_CONCURRENCY,
+            "seconds": round(concurrent_s, 4),
+            "queries_per_s": round(len(queries) / concurrent_s, 1),
+        }
+        result["peak_rss_mb"] = _peak_rss_mb()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results, baseline=None):
+    table = Table(title="Benchmark")
+    for column in ("scale", "ingest docs/s", "ingest vectors/s", "split chunks/s", "copia versión s",
+                   "search p95 ms", "chat p95 ms", "chat q/s (concurrente)", "RSS MB"):
+        table.add_column(column, justify="right")
+    previous = {str(r["scale"]): r for r in (baseline or {}).get("results", [])}
+
+    def cell(value, old, higher_is_better):
+        if old is None or not old:
+            return f"{value}"
+        delta = (value - old) / old * 100
+        better = delta > 0 if higher_is_better else delta < 0
+        return f"{value} ([{'green' if better else 'red'}]{delta:+.1f}%[/])"
+
+    for r in results:
+        old = previous.get(str(r["scale"]))
+        get = lambda res, *keys: None if res is None else _dig(res, keys)
+        table.add_row(
+            f"{r['scale']}x",
+            cell(r["ingestion"]["docs_per_s"], get(old, "ingestion", "docs_per_s"), True),
+            cell(r["ingestion"]["vectors_per_s"], get(old, "ingestion", "vectors_per_s"), True),
+            cell(r["split_docs"]["chunks_per_s"], get(old, "split_docs", "chunks_per_s"), True),
+            cell(r["prepare_build"]["seconds"], get(old, "prepare_build", "seconds"), False),
+            cell(r["similarity_search"]["p95_ms"], get(old, "similarity_search", "p95_ms"), False),
+            cell(r["chat_e2e"]["p95_ms"], get(old, "chat_e2e", "p95_ms"), False),
+            cell(r["chat_concurrent"]["queries_per_s"], get(old, "chat_concurrent", "queries_per_s"), True),
+            cell(r["peak_rss_mb"], get(old, "peak_rss_mb"), False),
+        )
+    console.print(table)
+
+
+def _dig(data, keys):
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latencia simulada por llamada al LLM (s).")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por medición de latencia.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar.")
+    args = parser.parse_args(argv)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scale in args.scales:
+        console.log(f"Benchmark a escala {scale}x...")
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_scale, (scale, args.llm_latency, args.queries, args.seed)))
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "params": {"llm_latency": args.llm_latency, "queries": args.queries, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    console.log(f"[green]Resultados guardados en {args.output}[/green]")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
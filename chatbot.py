@@ -2,6 +2,8 @@ import streamlit as st
 import requests
 import json
 import os
+import time
+from urllib.parse import urlencode
 from typing import List, Dict, Any
 
 FASTAPI_BASE_URL = os.environ.get("FASTAPI_URL", "http://127.0.0.1:8000")
@@ -52,45 +54,108 @@ def load_agent_and_update_state():
 
 def show_metadata():
     """Llama al endpoint /metadata y muestra los metadatos."""
-    result = call_api("/metadata", "GET")
+    params = {
+        "level": st.session_state.metadata_level,
+        "page": st.session_state.metadata_page,
+        "page_size": 50,
+    }
+    if st.session_state.metadata_entity:
+        params["entity"] = st.session_state.metadata_entity
+    result = call_api(f"/metadata?{urlencode(params)}", "GET")
     
-    if "metadata" in result:
-        metadata = result["metadata"]
+    if "items" in result:
         st.subheader("Metadatos Generados")
-        st.json(metadata)
+        st.caption(f"Versión {result['version']} · página {result['page']} · {result['total']} resultados")
+        st.json(result["items"])
     else:
         st.error("❌ No se pudieron obtener los metadatos. Revisa los mensajes de error arriba.")
 
 def ingest_data_and_update_state():
-    """Llama al endpoint /ingest y actualiza el estado de la aplicación."""
+    """
+    Llama al endpoint /ingest (que lanza un job en segundo plano) y consulta
+    su progreso en /ingest/{job_id} hasta que termina.
+    """
     st.session_state.ingesting = True
-    with st.spinner("Ejecutando pipeline de ingesta... (Esto puede tardar varios minutos dependiendo de los datos)"):
-        result = call_api("/ingest", "POST")
+    result = call_api("/ingest", "POST")
+    job_id = result.get("job_id")
+
+    status = {"status": "error", "error": result.get("message", "Verifica la consola de FastAPI.")}
+    if job_id:
+        progress_box = st.empty()
+        while True:
+            status = call_api(f"/ingest/{job_id}", "GET")
+            progress = status.get("progress", {})
+            progress_box.info(
+                f"Ingesta {status.get('status', '...')}: "
+                f"{progress.get('documents_loaded', 0)} documentos, "
+                f"{progress.get('chunks_split', 0)} chunks "
+                f"({progress.get('chunks_deduplicated', 0)} duplicados), "
+                f"{progress.get('metadata_generated', 0)} metadatos, "
+                f"{progress.get('vectors_upserted', 0)} vectores."
+            )
+            if status.get("status") not in ("pending", "running"):
+                break
+            time.sleep(1)
+        progress_box.empty()
     st.session_state.ingesting = False
-    
-    if result.get("status") == "success":
-        st.session_state.ingestion_message = "✅ Ingesta de datos completada. ¡Ahora debes recargar el Agente RAG!"
-        st.session_state.agent_ready = False # Invalida el agente actual
+
+    if status.get("status") == "completed":
+        st.session_state.ingestion_message = "✅ Ingesta de datos completada. El agente pasará a usar los nuevos datos en cuanto estén cargados."
         st.success(st.session_state.ingestion_message)
     else:
-        st.session_state.ingestion_message = f"❌ Falló la ingesta: {result.get('message', 'Verifica la consola de FastAPI.')}"
+        st.session_state.ingestion_message = f"❌ Falló la ingesta: {status.get('error') or status.get('status')}"
         st.error(st.session_state.ingestion_message)
 
 def get_agent_response(prompt: str) -> str:
     """Llama al endpoint /chat."""
-    data = {"query": prompt}
+    data = {"query": prompt, "session_id": st.session_state.session_id}
     result = call_api("/chat", "POST", data)
     
     if "response" in result:
+        st.session_state.session_id = result.get("session_id")
         return result["response"]
     else:
         # Si hay un error HTTP o de conexión, call_api ya lo habrá mostrado con st.error
         return "Disculpa, no pude obtener una respuesta. Revisa los mensajes de error arriba."
 
+def stream_agent_response(prompt: str):
+    """
+    Llama al endpoint /chat/stream y va devolviendo los tokens a medida que llegan
+    (Server-Sent Events), para usar con st.write_stream.
+    """
+    url = f"{FASTAPI_BASE_URL}/chat/stream"
+    try:
+        # El historial vive en el servidor: basta con enviar el id de la sesión.
+        payload = {"query": prompt, "session_id": st.session_state.session_id}
+        with requests.post(url, json=payload, stream=True, timeout=(5, 300)) as response:
+            if response.status_code == 429:
+                yield "El servidor está atendiendo muchas consultas. Inténtalo de nuevo en unos segundos."
+                return
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "token":
+                        yield data["content"]
+                    elif event == "done":
+                        st.session_state.session_id = data.get("session_id")
+                        if data.get("sources"):
+                            yield "\n\n*Fuentes: " + ", ".join(os.path.basename(src) for src in data["sources"]) + "*"
+                    elif event == "error":
+                        st.error(data.get("detail", "Error desconocido del servidor."))
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error de conexión con el servidor FastAPI: {e}")
+        yield "Disculpa, no pude obtener una respuesta. Revisa los mensajes de error arriba."
+
 # --- Inicialización del Estado de Streamlit ---
 
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = None
 
 if 'agent_ready' not in st.session_state:
     st.session_state.agent_ready = False
@@ -133,7 +198,7 @@ with st.sidebar:
 
     # --- 2. Botón de Ingesta de Datos ---
     st.subheader("Paso 2: Ingesta de Datos")
-    st.write("Procesa documentos y genera nuevos embeddings. REQUIERE RECARGAR el agente después.")
+    st.write("Procesa documentos y genera nuevos embeddings. El agente se actualiza automáticamente al terminar.")
     
     # El botón llama a la función de ingesta
     st.button(
@@ -150,6 +215,9 @@ with st.sidebar:
     # --- 3. Visualización de Metadatos ---
     st.subheader("Paso 3: Ver Metadatos")
     st.write("Muestra los metadatos generados durante la ingesta.")
+    st.selectbox("Nivel", ["document", "chunk"], key="metadata_level")
+    st.text_input("Filtrar por entidad", key="metadata_entity")
+    st.number_input("Página", min_value=1, step=1, key="metadata_page")
     st.button(
         "Mostrar Metadatos",
         on_click=show_metadata
@@ -176,9 +244,7 @@ if st.session_state.agent_ready:
 
         # 2. Obtener respuesta del agente
         with st.chat_message("assistant"):
-            with st.spinner("El agente está pensando..."):
-                response = get_agent_response(prompt)
-                st.markdown(response)
+            response = st.write_stream(stream_agent_response(prompt))
 
         # 3. Añadir respuesta del agente al historial
         st.session_state.messages.append({"role": "assistant", "content": response})
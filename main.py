@@ -1,68 +1,264 @@
 # src/main.py
+# El informe de arranque se importa primero: mide desde el inicio del proceso.
+from src.observability.startup import STARTUP
+import asyncio
+import contextlib
 import dotenv
+import os
+import threading
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from rich.console import Console
-from src.ingestion.run_ingestion_pipeline import run_ingestion_pipeline
-from src.service.rag_service import load_rag_agent, get_chat_response
-from typing import Dict, Any
+from src.ingestion.store_versions import STORES_ROOT, current_version, version_dir
+from src.metadata.metadata_store import METADATA_DB_FILE, METADATA_MAX_PAGE_SIZE, get_metadata_store
+from src.service.agent_registry import AgentRegistry
+from src.service.ingestion_jobs import IngestionAlreadyRunning, IngestionJobManager
+from src.service.sessions import SessionStore
+from src.observability.metrics import HTTP_SECONDS, REGISTRY, current_trace, start_trace
+from typing import Dict, Any, List, Optional
+import hashlib
 import json
 
 dotenv.load_dotenv()
 
-app = FastAPI()
 console = Console()
 
+# Carga y calienta el agente (vector store, encoder, LLM) en segundo plano al arrancar,
+# mientras el servidor ya responde; /ready indica cuándo termina.
+PRELOAD_AGENT = os.environ.get("PRELOAD_AGENT", "true").lower() == "true"
+
+def preload_agent():
+    STARTUP.begin_preload()
+    try:
+        if current_version(STORES_ROOT) is None:
+            console.log("Sin versión publicada del vector store: no se precarga el agente.")
+            STARTUP.finish("no_version")
+            return
+        agent_registry.load()
+        STARTUP.finish("ready")
+    except Exception as e:
+        console.log(f"❌ Error al precargar el agente: {e}")
+        STARTUP.finish("failed", str(e))
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    STARTUP.mark("serving")
+    if PRELOAD_AGENT:
+        threading.Thread(target=preload_agent, name="agent-preload", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
 class ChatRequest(BaseModel):
     query: str
+    # Sin session_id se abre una sesión nueva; su id viaja en la respuesta.
+    session_id: Optional[str] = Field(None, max_length=128)
 
 class ChatResponse(BaseModel):
     response: str
+    sources: List[str] = []
+    cached: bool = False
+    session_id: Optional[str] = None
 
 class MetadataResponse(BaseModel):
-    metadata: Dict[str, Any] 
+    version: str
+    level: str
+    page: int
+    page_size: int
+    total: int
+    items: List[Dict[str, Any]]
 
 class IngestResponse(BaseModel):
     status: str
     message: str
     metadata: dict = None
+    job_id: Optional[str] = None
+
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    incremental: bool
+    progress: Dict[str, int]
+    summary: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    # La ingesta se completó, pero el agente no pudo pasar a la versión nueva.
+    reload_error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 class LoadResponse(BaseModel):
     status: str
     message: str
 
-rag_agent_executor = None
+agent_registry = AgentRegistry(STORES_ROOT)
+
+def reload_agent_after_ingestion(job):
+    # Si la ingesta publicó una versión nueva, se calienta y se intercambia en segundo plano.
+    if job.summary.get("published"):
+        agent_registry.load_in_background(job.summary["version"], on_error=job.set_reload_error)
+
+# Conversaciones en curso: historial acotado y recuperaciones por sesión.
+chat_sessions = SessionStore()
+
+def run_ingestion(*args, **kwargs):
+    # Import diferido: el pipeline carga los splitters (transformers), Chroma y los modelos.
+    from src.ingestion.run_ingestion_pipeline import run_versioned_ingestion
+    from src.ingestion.vector_store import close_store
+    vectordb, summary = run_versioned_ingestion(*args, **kwargs)
+    # El agente abre la versión publicada por su cuenta: el store de la construcción se cierra ya.
+    close_store(vectordb)
+    return vectordb, summary
+
+ingestion_jobs = IngestionJobManager(run_ingestion, on_success=reload_agent_after_ingestion)
+
+# Máximo de conversaciones simultáneas; por encima se responde 429 en lugar de encolar.
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CHAT_MAX_CONCURRENCY", "16"))
+chat_slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+
+async def acquire_chat_slot():
+    if chat_slots.locked():
+        raise HTTPException(status_code=429, detail="Demasiadas consultas simultáneas. Inténtalo de nuevo en unos segundos.")
+    await chat_slots.acquire()
+
+class ChatStreamResponse(StreamingResponse):
+    """StreamingResponse que llama a on_close al terminar, también si el cliente se va antes de leer el cuerpo."""
 
-@app.post("/ingest", response_model=IngestResponse)
-async def ingest_data():
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): lista separada por comas, W/ se ignora y * coincide."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Traza por petición: se devuelve en la cabecera X-Trace si el cliente la envía
+# (con cualquier valor) o para todas las peticiones con TRACE_ALL_REQUESTS=true.
+TRACE_HEADER = "X-Trace"
+TRACE_ALL_REQUESTS = os.environ.get("TRACE_ALL_REQUESTS", "false").lower() == "true"
+
+def trace_requested(request: Request) -> bool:
+    return TRACE_ALL_REQUESTS or TRACE_HEADER in request.headers
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    trace = start_trace()
+    response = await call_next(request)
+    total = time.perf_counter() - trace.start
+    # Se etiqueta con la plantilla de la ruta (/ingest/{job_id}) para no disparar la cardinalidad.
+    path = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_SECONDS.observe(total, method=request.method, path=path, status=response.status_code)
+    if trace_requested(request):
+        response.headers[TRACE_HEADER] = json.dumps(
+            {"total_ms": round(total * 1000, 2), "spans": trace.to_list()}, separators=(",", ":")
+        )
+    return response
+
+@app.post("/ingest", response_model=IngestResponse, status_code=202)
+async def ingest_data(full: bool = False):
     """
-    Endpoint para ejecutar el pipeline de ingesta.
-    La lógica ya estaba separada, así que esto no cambia.
+    Endpoint para lanzar el pipeline de ingesta como job en segundo plano.
+    Por defecto es incremental (solo ficheros nuevos, modificados o eliminados);
+    con ?full=true se re-ingiere todo el corpus. Devuelve el job_id para
+    consultar el progreso en /ingest/{job_id}. La ingesta construye una versión
+    nueva del store y, al terminar, el agente pasa a usarla sin cortes.
     """
     console.log("🏃‍♂️ Iniciando pipeline de ingesta...")
     try:
-        vectordb, metadata = run_ingestion_pipeline()
-        console.log("✅ Ingesta completada.")
-        return IngestResponse(
-            status="success", 
-            message="Ingesta de datos completada. Llama a /load-agent para recargar el agente.",
-        )
-    except Exception as e:
-        console.log(f"❌ Error durante la ingesta: {e}")
-        raise HTTPException(status_code=500, detail=f"Error de ingesta: {e}")
-    
+        job = ingestion_jobs.submit(STORES_ROOT, incremental=not full)
+    except IngestionAlreadyRunning as e:
+        detail = f"{e} Consulta /ingest/{e.job.id}." if e.job is not None else str(e)
+        raise HTTPException(status_code=409, detail=detail)
+    return IngestResponse(
+        status="accepted",
+        message=f"Ingesta en curso. Consulta /ingest/{job.id} para ver el progreso.",
+        job_id=job.id,
+    )
+
+@app.get("/ingest/{job_id}", response_model=IngestJobResponse)
+async def get_ingest_job(job_id: str):
+    """Endpoint para consultar el estado y el progreso por etapa de un job de ingesta."""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No existe el job de ingesta {job_id}.")
+    return IngestJobResponse(**job.to_dict())
+
+@app.post("/ingest/{job_id}/cancel", response_model=IngestJobResponse)
+async def cancel_ingest_job(job_id: str):
+    """
+    Endpoint para cancelar un job de ingesta. La cancelación se aplica antes de la
+    siguiente llamada al LLM de metadatos o del siguiente lote; lo ya confirmado
+    queda en el checkpoint.
+    """
+    job = ingestion_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No existe el job de ingesta {job_id}.")
+    return IngestJobResponse(**job.to_dict())
+
 @app.get("/metadata", response_model=MetadataResponse)
-async def get_metadata():
+async def get_metadata(
+    request: Request,
+    response: Response,
+    level: str = Query("document", pattern="^(document|chunk)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=METADATA_MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    source: Optional[str] = None,
+    title: Optional[str] = None,
+    entity: Optional[str] = None,
+    topic: Optional[str] = None,
+):
     """
-    Endpoint para obtener los metadatos generados durante la ingesta.
-    Ahora solo lee el archivo metadata.json generado.
+    Endpoint para obtener los metadatos generados durante la ingesta, de documentos
+    o de chunks (level), paginados y con filtros por fuente, prefijo de título, entidad
+    y tema. fields limita los campos devueltos (separados por comas).
+    Se consulta el store SQLite de la versión publicada; el ETag depende de la versión
+    y de los parámetros, así que If-None-Match devuelve 304 mientras no haya ingesta nueva.
     """
     try:
-        with open("metadata.json", "r") as f:
-            metadata = json.load(f)
-        console.log("✅ Metadatos cargados exitosamente.")
-        return MetadataResponse(metadata={"metadata": metadata})
+        version = current_version(STORES_ROOT)
+        if version is None:
+            raise FileNotFoundError("No hay ninguna versión publicada. Ejecuta /ingest primero.")
+
+        params = json.dumps(sorted(request.query_params.multi_items()))
+        etag = f'"{version}-{hashlib.sha1(params.encode()).hexdigest()[:16]}"'
+        if etag_matches(etag, request.headers.get("if-none-match")):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        path = os.path.join(version_dir(version, STORES_ROOT), METADATA_DB_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"La versión {version} no tiene store de metadatos. Ejecuta /ingest.")
+        total, items = await run_in_threadpool(
+            get_metadata_store(path).query,
+            level=level,
+            page=page,
+            page_size=page_size,
+            fields=[f.strip() for f in fields.split(",")] if fields else None,
+            source=source,
+            title=title,
+            entity=entity,
+            topic=topic,
+        )
+        response.headers["ETag"] = etag
+        return MetadataResponse(
+            version=version, level=level, page=page, page_size=page_size, total=total, items=items
+        )
     except Exception as e:
         console.log(f"❌ Error al cargar los metadatos: {e}")
         raise HTTPException(status_code=500, detail=f"Error al cargar los metadatos: {e}")
@@ -70,45 +266,145 @@ async def get_metadata():
 @app.post("/load-agent", response_model=LoadResponse)
 async def load_agent_endpoint():
     """
-    Endpoint para cargar el agente RAG.
-    Ahora solo llama a la función de servicio.
+    Endpoint para cargar el agente RAG sobre la versión publicada del store.
+    Tras cada ingesta el agente se recarga solo; esto sirve para el arranque.
     """
-    global rag_agent_executor
-    
     console.log("🔄 Recibida solicitud para cargar agente...")
     try:
-        rag_agent_executor = load_rag_agent()
+        runtime = await run_in_threadpool(agent_registry.load)
         console.log("✅ Agente RAG cargado y listo (vía servicio).")
-        return LoadResponse(status="success", message="Agente cargado exitosamente.")
+        return LoadResponse(status="success", message=f"Agente cargado exitosamente (versión {runtime.version}).")
         
     except Exception as e:
         console.log(f"❌ Error al cargar el agente: {e}")
-        rag_agent_executor = None
         raise HTTPException(status_code=500, detail=f"Error al cargar el agente: {e}")
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(request: ChatRequest):
     """
     Endpoint para conversar con el agente.
-    Ahora solo llama a la función de servicio.
+    Usa la versión asíncrona del agente para no bloquear el event loop.
     """
-    if rag_agent_executor is None:
+    # Se fija la versión al empezar: un intercambio a mitad de petición no le afecta.
+    runtime = agent_registry.acquire()
+    if runtime is None:
         raise HTTPException(status_code=400, detail="Error: El agente RAG no está inicializado. Llama a /load-agent primero.")
-        
+
     console.log(f"Recibida query: {request.query}")
-    
+
+    try:
+        await acquire_chat_slot()
+    except BaseException:
+        agent_registry.release(runtime)
+        raise
     try:
-        response_text = get_chat_response(rag_agent_executor, request.query)
-        console.log(f"Respuesta generada: {response_text}")
-        return ChatResponse(response=response_text)
+        session = chat_sessions.get(request.session_id)
+        from src.service.rag_service import aget_chat_answer
+        answer = await aget_chat_answer(runtime, request.query, session=session, sessions=chat_sessions)
+        console.log(f"Respuesta generada: {answer['response']}")
+        return ChatResponse(**answer, session_id=session.id)
     except Exception as e:
         console.log(f"❌ Error durante el chat: {e}")
         raise HTTPException(status_code=500, detail=f"Error al procesar la solicitud: {e}")
+    finally:
+        chat_slots.release()
+        agent_registry.release(runtime)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Endpoint de chat en streaming (Server-Sent Events): emite los tokens
+    a medida que se generan y los eventos de las herramientas.
+    """
+    runtime = agent_registry.acquire()
+    if runtime is None:
+        raise HTTPException(status_code=400, detail="Error: El agente RAG no está inicializado. Llama a /load-agent primero.")
+
+    console.log(f"Recibida query (stream): {request.query}")
+    try:
+        await acquire_chat_slot()
+    except BaseException:
+        agent_registry.release(runtime)
+        raise
+    released = False
+
+    def release_slot():
+        # El hueco y el agente se liberan al terminar el generador o, si nunca llega a
+        # iterarse (el cliente se desconecta antes), al cerrarse la respuesta; solo la primera vez.
+        nonlocal released
+        if not released:
+            released = True
+            chat_slots.release()
+            agent_registry.release(runtime)
+
+    try:
+        # Las cabeceras salen antes de que termine la respuesta: la traza completa va en el evento done.
+        trace = current_trace() if trace_requested(http_request) else None
+        session = chat_sessions.get(request.session_id)
+        # Con el agente cargado, rag_service ya está importado.
+        from src.service.rag_service import astream_chat_response
+    except BaseException:
+        release_slot()
+        raise
+
+    async def event_stream():
+        try:
+            async for event in astream_chat_response(runtime, request.query, session=session, sessions=chat_sessions):
+                if event["type"] == "done":
+                    event["session_id"] = session.id
+                    if trace is not None:
+                        event["trace"] = trace.to_list()
+                yield sse_event(event.pop("type"), event)
+        except Exception as e:
+            console.log(f"❌ Error durante el chat: {e}")
+            yield sse_event("error", {"detail": f"Error al procesar la solicitud: {e}"})
+        finally:
+            release_slot()
+
+    return ChatStreamResponse(event_stream(), on_close=release_slot, media_type="text/event-stream",
+                              headers={"Cache-Control": "no-cache"})
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    """Endpoint para cerrar una conversación y liberar su historial."""
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"No existe la sesión {session_id}.")
+    return Response(status_code=204)
+
+@app.get("/stats")
+async def get_stats():
+    """Endpoint con las estadísticas de aciertos de las cachés."""
+    from src.service.rag_service import get_cache_stats
+    return get_cache_stats(agent_registry.current)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Endpoint con las métricas (histogramas por etapa, tokens, cachés, HTTP) en formato Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/startup")
+async def startup_report():
+    """Endpoint con el informe de arranque: hitos, fases de la precarga del agente y módulos pesados cargados."""
+    return STARTUP.to_dict()
+
+@app.get("/ready")
+async def ready():
+    """
+    Endpoint de readiness: 200 cuando el agente está cargado (o no hay ninguna versión
+    publicada que cargar) y 503 mientras se precarga o si la precarga ha fallado.
+    """
+    if agent_registry.current is not None:
+        return {"status": "ready", "version": agent_registry.current.version}
+    if STARTUP.status == "no_version":
+        return {"status": "no_version", "version": None}
+    return JSONResponse({"status": STARTUP.status, "error": STARTUP.error}, status_code=503)
 
 @app.get("/")
 async def root():
     return {"message": "Servidor RAG con FastAPI está funcionando."}
 
+STARTUP.mark("app_imported")
+
 
 # --- Ejecución del Servidor (sin cambios) ---
 if __name__ == "__main__":
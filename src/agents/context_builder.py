@@ -0,0 +1,123 @@
+# src/agents/context_builder.py
+import os
+
+from src.metadata.schema import parse_metadata
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1000"))
+# Candidatos que se recuperan para rellenar el presupuesto.
+CONTEXT_FETCH_K = int(os.environ.get("CONTEXT_FETCH_K", "6"))
+# Si se define (0-1), los candidatos se eligen con MMR en lugar de por similitud pura.
+CONTEXT_MMR_LAMBDA = os.environ.get("CONTEXT_MMR_LAMBDA")
+CONTEXT_MMR_LAMBDA = float(CONTEXT_MMR_LAMBDA) if CONTEXT_MMR_LAMBDA else None
+# Chunks consecutivos separados solo por el separador del splitter (saltos de línea) se consideran contiguos.
+CONTEXT_MERGE_GAP = 4
+
+
+def estimate_tokens(text):
+    # Aproximación habitual de ~4 caracteres por token; basta para repartir el presupuesto.
+    return len(text) // 4 + 1
+
+
+class _Span:
+    """Fragmento contiguo de un documento, formado por uno o varios chunks fusionados."""
+
+    def __init__(self, doc, rank):
+        self.source = doc.metadata.get("source", "desconocido")
+        self.start = doc.metadata.get("start_index")
+        # start_index es relativo a cada documento cargado (p. ej. a cada página de un PDF):
+        # solo se comparan offsets del mismo documento.
+        self.document = doc.metadata.get("doc_id") or (self.source, doc.metadata.get("page"))
+        self.text = doc.page_content
+        self.rank = rank
+        self.docs = [doc]
+
+    @property
+    def end(self):
+        return self.start + len(self.text)
+
+    def absorb(self, other):
+        """Fusiona un span solapado o contiguo a este, sin repetir el texto solapado."""
+        if other.start > self.end:
+            self.text += "\n" + other.text
+        elif other.end > self.end:
+            self.text += other.text[self.end - other.start:]
+        self.rank = min(self.rank, other.rank)
+        self.docs.extend(other.docs)
+
+
+def merge_spans(docs):
+    """
+    Agrupa los chunks por documento (cada página de un PDF es uno) y fusiona los que
+    se solapan o son contiguos según su start_index. Sin start_index (stores antiguos) solo se eliminan los duplicados.
+    Devuelve los spans ordenados por el mejor rango de sus chunks.
+    """
+    spans = []
+    by_document = {}
+    seen_texts = set()
+    for rank, doc in enumerate(docs):
+        if doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+        span = _Span(doc, rank)
+        if span.start is None:
+            spans.append(span)
+        else:
+            by_document.setdefault(span.document, []).append(span)
+
+    for document_spans in by_document.values():
+        document_spans.sort(key=lambda s: s.start)
+        current = document_spans[0]
+        for span in document_spans[1:]:
+            if span.start <= current.end + CONTEXT_MERGE_GAP:
+                current.absorb(span)
+            else:
+                spans.append(current)
+                current = span
+        spans.append(current)
+    return sorted(spans, key=lambda s: s.rank)
+
+
+def citation_header(index, span):
+    """
+    Cabecera compacta: [n] título — fichero. El título sale de los metadatos generados del
+    documento; si el pasaje está también en otros ficheros (deduplicado), se citan todos.
+    """
+    metadata = span.docs[0].metadata
+    # El doc store aporta el título; los stores antiguos lo llevan en los metadatos de cada chunk.
+    title = metadata.get("title") or parse_metadata(metadata.get("generated_metadata")).get("title")
+    name = os.path.basename(span.source)
+    header = f"[{index}] {title} — {name}" if title else f"[{index}] {name}"
+    also = list(dict.fromkeys(
+        os.path.basename(source) for doc in span.docs for source in doc.metadata.get("aliases", [])
+        if source != span.source
+    ))
+    return f"{header} (también en: {', '.join(also)})" if also else header
+
+
+def _render(spans):
+    return "\n\n".join(f"{citation_header(i, span)}\n{span.text}" for i, span in enumerate(spans, start=1))
+
+
+def build_context(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Construye el contexto para el LLM a partir de los documentos recuperados (en orden
+    de relevancia): se añaden mientras quepan en el presupuesto de tokens, fusionando los
+    solapes y los chunks contiguos de una misma fuente, con una cabecera de cita por
+    fragmento en lugar del dict de metadatos completo.
+    Devuelve (texto, documentos_usados).
+    """
+    selected = []
+    context = ""
+    for doc in docs:
+        candidate = _render(merge_spans(selected + [doc]))
+        if estimate_tokens(candidate) > token_budget:
+            continue
+        selected.append(doc)
+        context = candidate
+
+    if not selected and docs:
+        # Ni el primer chunk cabe entero: se recorta para no dejar al agente sin contexto.
+        first = docs[0]
+        trimmed = first.model_copy(update={"page_content": first.page_content[:token_budget * 4]})
+        return _render(merge_spans([trimmed])), [first]
+    return context, selected
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from src.observability.metrics import record_cache, span
+
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "600"))
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """Normaliza mayúsculas, espacios y puntuación final para que consultas casi idénticas coincidan."""
+    query = " ".join(query.lower().split())
+    return re.sub(r"^[¿¡\s]+|[?!.\s]+$", "", query)
+
+
+class LRUCache:
+    """Caché LRU en memoria con caducidad (TTL) y contadores de aciertos/fallos."""
+
+    def __init__(self, max_size=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL, name=None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl and time.monotonic() - entry[0] > self.ttl):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                if self.name:
+                    record_cache(self.name, False)
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            if self.name:
+                record_cache(self.name, True)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+class RetrievalCache:
+    """
+    Memoiza las dos partes de una búsqueda: consulta normalizada -> embedding y
+    (embedding, k, filtro) -> documentos. Cada versión publicada del índice tiene
+    su propia caché, así que no hace falta invalidarla. Con un `batcher`
+    (EmbeddingBatcher), las variantes async agrupan los embeddings de consultas
+    concurrentes en una sola pasada del modelo. Con un `doc_store` (DocStore), el
+    texto de los chunks guardados solo como offsets se materializa en los resultados.
+    Con un `meta_store` (MetadataStore), cada resultado lleva en "aliases" las demás
+    fuentes que contienen el mismo pasaje (chunks deduplicados en la ingesta).
+    """
+
+    def __init__(self, vectordb, max_size=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL,
+                 batcher=None, doc_store=None, meta_store=None):
+        self.vectordb = vectordb
+        self.batcher = batcher
+        self.doc_store = doc_store
+        self.meta_store = meta_store
+        self._embeddings = LRUCache(max_size, ttl, name="retrieval_embeddings")
+        self._results = LRUCache(max_size, ttl, name="retrieval_results")
+
+    def embed_query(self, query):
+        # La forma normalizada solo es la clave: se embebe la consulta tal cual llega.
+        key = normalize_query(query)
+        embedding = self._embeddings.get(key)
+        if embedding is _MISSING:
+            embedding = self.vectordb.embeddings.embed_query(query)
+            self._embeddings.put(key, embedding)
+        return embedding
+
+    async def aembed_query(self, query):
+        """Como embed_query, pero sin bloquear el event loop y pasando por el batcher si lo hay."""
+        key = normalize_query(query)
+        embedding = self._embeddings.get(key)
+        if embedding is _MISSING:
+            if self.batcher is None:
+                embedding = await asyncio.to_thread(self.vectordb.embeddings.embed_query, query)
+            else:
+                embedding = await self.batcher.embed(query)
+            self._embeddings.put(key, embedding)
+        return embedding
+
+    def _search_by_vector(self, embedding, k, filter, mmr_lambda):
+        vector_key = hashlib.blake2b(np.asarray(embedding, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+        key = (vector_key, k, json.dumps(filter, sort_keys=True) if filter else None, mmr_lambda)
+        docs = self._results.get(key)
+        if docs is _MISSING:
+            with span("vector_search"):
+                if mmr_lambda is None:
+                    docs = self.vectordb.similarity_search_by_vector(embedding, k=k, filter=filter)
+                else:
+                    docs = self.vectordb.max_marginal_relevance_search_by_vector(
+                        embedding, k=k, fetch_k=4 * k, lambda_mult=mmr_lambda, filter=filter
+                    )
+            if self.doc_store is not None:
+                docs = self.doc_store.materialize(docs)
+            if self.meta_store is not None:
+                docs = self._with_aliases(docs)
+            self._results.put(key, docs)
+        return list(docs)
+
+    def _with_aliases(self, docs):
+        alias_sources = self.meta_store.alias_sources(doc.id for doc in docs if doc.id)
+        return [
+            doc.model_copy(update={"metadata": {**doc.metadata, "aliases": alias_sources[doc.id]}})
+            if doc.id in alias_sources else doc
+            for doc in docs
+        ]
+
+    def search(self, query, k=2, filter=None, mmr_lambda=None):
+        with span("retrieval"):
+            return self._search_by_vector(self.embed_query(query), k, filter, mmr_lambda)
+
+    async def asearch(self, query, k=2, filter=None, mmr_lambda=None):
+        with span("retrieval"):
+            embedding = await self.aembed_query(query)
+            return await asyncio.to_thread(self._search_by_vector, embedding, k, filter, mmr_lambda)
+
+    def stats(self):
+        stats = {"embeddings": self._embeddings.stats(), "results": self._results.stats()}
+        if self.batcher is not None:
+            stats["batcher"] = self.batcher.stats()
+        return stats
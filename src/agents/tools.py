@@ -1,14 +1,59 @@
-from langchain.tools import tool
+from langchain_core.tools import StructuredTool
+from src.agents.context_builder import CONTEXT_FETCH_K, CONTEXT_MMR_LAMBDA, CONTEXT_TOKEN_BUDGET, build_context
+from src.agents.retrieval_cache import RetrievalCache
+from src.service.sessions import current_session
 
-def make_retrieve_context_tool(vectordb):
-    @tool
-    def retrieve_context(query: str) -> str:
+def make_retrieve_context_tool(vectordb, cache=None, k=CONTEXT_FETCH_K, token_budget=CONTEXT_TOKEN_BUDGET,
+                               mmr_lambda=CONTEXT_MMR_LAMBDA, entity_index=None):
+    # Las búsquedas repetidas se sirven desde la caché en memoria.
+    cache = cache or RetrievalCache(vectordb)
+
+    def candidate_filter(query):
+        # Si la consulta nombra una entidad o tema conocido, se busca solo en sus documentos;
+        # si eso no devuelve nada (o no nombra ninguno), búsqueda sobre toda la colección.
+        sources = entity_index.candidate_sources(query) if entity_index is not None else None
+        return {"source": {"$in": sources}} if sources else None
+
+    def search(query):
+        filter = candidate_filter(query)
+        docs = cache.search(query, k=k, filter=filter, mmr_lambda=mmr_lambda) if filter else []
+        return docs or cache.search(query, k=k, mmr_lambda=mmr_lambda)
+
+    async def asearch(query):
+        filter = candidate_filter(query)
+        docs = await cache.asearch(query, k=k, filter=filter, mmr_lambda=mmr_lambda) if filter else []
+        return docs or await cache.asearch(query, k=k, mmr_lambda=mmr_lambda)
+
+    def retrieve_context(query: str):
         """Retrieve information to help answer a query."""
-        retrieved_docs = vectordb.similarity_search(query, k=2)
-        serialized = "\n\n".join(
-            (f"Source: {doc.metadata}\nContent: {doc.page_content}")
-            for doc in retrieved_docs
-        )
-        return serialized
-
-    return retrieve_context
+        session = current_session()
+        cached = session.cached_retrieval(query) if session is not None else None
+        if cached is not None:
+            return cached
+        # Se recuperan k candidatos y se empaquetan en el presupuesto de tokens,
+        # con cabeceras de cita compactas en lugar de los metadatos completos.
+        result = build_context(search(query), token_budget)
+        if session is not None:
+            session.remember_retrieval(query, *result)
+        return result
+
+    async def aretrieve_context(query: str):
+        """Retrieve information to help answer a query."""
+        # Dentro de una conversación, una consulta ya recuperada se sirve desde la sesión.
+        session = current_session()
+        cached = session.cached_retrieval(query) if session is not None else None
+        if cached is not None:
+            return cached
+        # El agente async usa esta variante: el embedding de la consulta pasa por el batcher de la caché.
+        result = build_context(await asearch(query), token_budget)
+        if session is not None:
+            session.remember_retrieval(query, *result)
+        return result
+
+    # Los documentos usados viajan como artefacto del ToolMessage para poder citar las fuentes.
+    return StructuredTool.from_function(
+        func=retrieve_context,
+        coroutine=aretrieve_context,
+        name="retrieve_context",
+        response_format="content_and_artifact",
+    )
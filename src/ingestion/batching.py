@@ -0,0 +1,8 @@
+from itertools import islice
+
+
+def batched(iterable, size):
+    """Agrupa un iterable en listas de como mucho `size` elementos, sin materializarlo entero."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
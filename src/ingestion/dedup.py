@@ -0,0 +1,303 @@
+# src/ingestion/dedup.py
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from rich.console import Console
+
+console = Console()
+
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "true").lower() == "true"
+# Jaccard estimada (fracción de minhashes iguales) a partir de la cual dos chunks son el mismo pasaje.
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.85"))
+DEDUP_NUM_PERM = 64
+# 16 bandas de 4 filas: los pares con Jaccard >= ~0.5 comparten alguna banda y se verifican.
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_SIZE = 3
+# Las palabras más largas (URLs, cadenas) se truncan para hashearlas.
+_MAX_WORD_CHARS = 24
+# Chunks por bloque al calcular firmas: acota la matriz temporal (permutaciones x shingles).
+DEDUP_BLOCK_SIZE = 256
+# Filas nuevas que se buscan con diccionarios antes de fusionarlas en las tablas ordenadas.
+DEDUP_MERGE_ROWS = 65536
+DEDUP_COMPACT_RATIO = 0.5
+DEDUP_DIR = "dedup_index"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_ROWS_PER_BAND = DEDUP_NUM_PERM // DEDUP_BANDS
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(20240212)
+# Permutaciones por multiplicación-desplazamiento: h -> (a*h + b) mod 2^64, 32 bits altos.
+_A = _rng.randint(1, 1 << 63, size=DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 1 << 63, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_CHAR_MULT = _rng.randint(1, 1 << 62, size=_MAX_WORD_CHARS, dtype=np.uint64) | np.uint64(1)
+_SHINGLE_MULT = _rng.randint(1, 1 << 62, size=DEDUP_SHINGLE_SIZE, dtype=np.uint64) | np.uint64(1)
+_BAND_MULT = _rng.randint(1, 1 << 62, size=_ROWS_PER_BAND, dtype=np.uint64) | np.uint64(1)
+
+
+def shingle_hashes(texts):
+    """
+    Hashes de 32 bits de los shingles de DEDUP_SHINGLE_SIZE palabras (en minúscula) de
+    varios textos, concatenados, y cuántos corresponden a cada texto. Las palabras se
+    hashean todas a la vez sobre sus códigos Unicode (hasta _MAX_WORD_CHARS caracteres).
+    """
+    words = [_WORD_RE.findall(text.lower()) for text in texts]
+    counts = np.array([len(w) for w in words], dtype=np.int64)
+    lengths = np.maximum(counts - DEDUP_SHINGLE_SIZE + 1, 0)
+    flat = [word for text_words in words for word in text_words]
+    if not lengths.any():
+        return np.zeros(0, dtype=np.uint64), lengths
+    codes = np.array(flat, dtype=f"<U{_MAX_WORD_CHARS}").view(np.uint32).reshape(len(flat), _MAX_WORD_CHARS)
+    word_hashes = (codes.astype(np.uint64) * _CHAR_MULT).sum(axis=1, dtype=np.uint64)
+
+    n = len(flat) - DEDUP_SHINGLE_SIZE + 1
+    combined = np.zeros(n, dtype=np.uint64)
+    for i in range(DEDUP_SHINGLE_SIZE):
+        combined += word_hashes[i:i + n] * _SHINGLE_MULT[i]
+    # Solo los shingles que no cruzan de un texto al siguiente.
+    text_of = np.repeat(np.arange(len(texts)), counts)
+    combined = combined[text_of[:n] == text_of[DEDUP_SHINGLE_SIZE - 1:]]
+    return (combined ^ (combined >> np.uint64(32))) & _MAX_HASH, lengths
+
+
+def minhash_signatures(texts):
+    """
+    Firmas MinHash (n x DEDUP_NUM_PERM, uint32) de varios textos, por bloques: los
+    shingles del bloque se concatenan y cada permutación se aplica a todos a la vez.
+    Devuelve también qué textos tienen shingles (los más cortos no se deduplican).
+    """
+    signatures = np.full((len(texts), DEDUP_NUM_PERM), 0xFFFFFFFF, dtype=np.uint32)
+    valid = np.zeros(len(texts), dtype=bool)
+    for start in range(0, len(texts), DEDUP_BLOCK_SIZE):
+        flat, lengths = shingle_hashes(texts[start:start + DEDUP_BLOCK_SIZE])
+        rows = np.flatnonzero(lengths)
+        if not len(rows):
+            continue
+        offsets = np.concatenate(([0], np.cumsum(lengths[rows])[:-1]))
+        permuted = (_A[:, None] * flat[None, :] + _B[:, None]) >> np.uint64(32)
+        signatures[start + rows] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        valid[start + rows] = True
+    return signatures, valid
+
+
+def band_keys(signatures):
+    """Una clave de 64 bits por banda de cada firma (n x DEDUP_BANDS)."""
+    bands = signatures.reshape(len(signatures), DEDUP_BANDS, _ROWS_PER_BAND).astype(np.uint64)
+    return (bands * _BAND_MULT).sum(axis=2, dtype=np.uint64)
+
+
+class DedupIndex:
+    """
+    Índice LSH de los chunks canónicos (los que están en el vector store) de una
+    versión del store. Las firmas se guardan en un fichero append-only que se lee
+    como memmap; por banda hay una tabla ordenada de claves (búsqueda vectorizada
+    con searchsorted para todo un lote) más diccionarios para las filas recientes.
+    Como en el vector store numpy, header.json confirma las filas escritas y los
+    borrados se marcan hasta que compensa compactar.
+    """
+
+    def __init__(self, persist_dir, threshold=DEDUP_THRESHOLD):
+        self.path = os.path.join(persist_dir, DEDUP_DIR)
+        self.threshold = threshold
+        self.aliased = 0
+        self._header_path = os.path.join(self.path, "header.json")
+        self._signatures_path = os.path.join(self.path, "signatures.bin")
+        self._records_path = os.path.join(self.path, "records.jsonl")
+        self._deleted_path = os.path.join(self.path, "deleted.npy")
+        self._load()
+
+    def _load(self):
+        self._ids, self._sources, self._row_of = [], [], {}
+        self._dead = set()
+        self._mmap = None
+        self._flushed = 0
+        self._new_signatures = []
+        count = records_size = 0
+        if os.path.exists(self._header_path):
+            with open(self._header_path, "r") as f:
+                count = json.load(f)["count"]
+        # Un índice vacío (p. ej. de una ingesta sin chunks) puede no tener ficheros de datos.
+        if not os.path.exists(self._records_path):
+            count = 0
+        if count:
+            with open(self._records_path, "rb") as f:
+                while len(self._ids) < count:
+                    record = json.loads(f.readline())
+                    self._row_of[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._sources.append(record["source"])
+                records_size = f.tell()
+        # Lo escrito después del último header confirmado se descarta.
+        for path, size in ((self._signatures_path, count * DEDUP_NUM_PERM * 4), (self._records_path, records_size)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        if count and os.path.exists(self._deleted_path):
+            self._dead = {int(row) for row in np.load(self._deleted_path) if row < count}
+        for row in self._dead:
+            if self._row_of.get(self._ids[row]) == row:
+                del self._row_of[self._ids[row]]
+        self._flushed = count
+        self._build_tables()
+
+    def _signatures(self):
+        if self._mmap is None and self._flushed:
+            self._mmap = np.memmap(self._signatures_path, dtype=np.uint32, mode="r",
+                                   shape=(self._flushed, DEDUP_NUM_PERM))
+        return self._mmap
+
+    def _signature(self, row):
+        return self._signatures()[row] if row < self._flushed else self._new_signatures[row - self._flushed]
+
+    def _build_tables(self):
+        """Tablas ordenadas por banda con todas las filas (clave -> filas con esa clave)."""
+        keys = np.empty((len(self._ids), DEDUP_BANDS), dtype=np.uint64)
+        for start in range(0, self._flushed, DEDUP_MERGE_ROWS):
+            block = np.asarray(self._signatures()[start:start + DEDUP_MERGE_ROWS])
+            keys[start:start + len(block)] = band_keys(block)
+        if self._new_signatures:
+            keys[self._flushed:] = band_keys(np.asarray(self._new_signatures, dtype=np.uint32))
+        order = np.argsort(keys, axis=0, kind="stable")
+        self._sorted_rows = order.T.copy()
+        self._sorted_keys = np.take_along_axis(keys, order, axis=0).T.copy()
+        self._delta = [{} for _ in range(DEDUP_BANDS)]
+        self._delta_rows = 0
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._row_of
+
+    def _append(self, source, chunk_id, signature, keys):
+        row = len(self._ids)
+        self._row_of[chunk_id] = row
+        self._ids.append(chunk_id)
+        self._sources.append(source)
+        self._new_signatures.append(signature)
+        for band, key in enumerate(keys.tolist()):
+            self._delta[band].setdefault(key, []).append(row)
+        self._delta_rows += 1
+
+    def _candidates(self, keys, lo, hi):
+        rows = set()
+        for band in np.flatnonzero(hi > lo):
+            rows.update(self._sorted_rows[band, lo[band]:hi[band]].tolist())
+        for band, key in enumerate(keys.tolist()):
+            rows.update(self._delta[band].get(key, ()))
+        return rows
+
+    def assign(self, items, exclude=frozenset()):
+        """
+        Decide, para cada (source, chunk_id, texto), si es casi duplicado de un chunk
+        canónico ya indexado (o anterior en el mismo lote). Los que no lo son pasan a
+        ser canónicos. Los de exclude (chunks de ficheros modificados, que se van a
+        borrar) no sirven como canónicos; los que ya están indexados siguen siéndolo.
+        Devuelve {chunk_id_alias: chunk_id_canónico}.
+        """
+        if not items:
+            return {}
+        signatures, valid = minhash_signatures([text for _, _, text in items])
+        keys = band_keys(signatures)
+        lo = np.empty(keys.shape, dtype=np.int64)
+        hi = np.empty(keys.shape, dtype=np.int64)
+        for band in range(DEDUP_BANDS):
+            lo[:, band] = np.searchsorted(self._sorted_keys[band], keys[:, band], side="left")
+            hi[:, band] = np.searchsorted(self._sorted_keys[band], keys[:, band], side="right")
+
+        aliases = {}
+        for i, (source, cid, _) in enumerate(items):
+            if not valid[i] or cid in self._row_of:
+                continue
+            best, best_similarity = None, self.threshold
+            for row in self._candidates(keys[i], lo[i], hi[i]):
+                if row in self._dead or self._ids[row] in exclude:
+                    continue
+                similarity = np.count_nonzero(self._signature(row) == signatures[i]) / DEDUP_NUM_PERM
+                if similarity >= best_similarity:
+                    best, best_similarity = row, similarity
+            if best is None:
+                self._append(source, cid, signatures[i], keys[i])
+            else:
+                aliases[cid] = self._ids[best]
+        self.aliased += len(aliases)
+        self._maybe_merge()
+        return aliases
+
+    def add(self, items):
+        """Indexa (source, chunk_id, texto) como canónicos sin buscar duplicados (reanudaciones y promociones)."""
+        items = [item for item in items if item[1] not in self._row_of]
+        if not items:
+            return
+        signatures, valid = minhash_signatures([text for _, _, text in items])
+        keys = band_keys(signatures)
+        for i, (source, cid, _) in enumerate(items):
+            if valid[i]:
+                self._append(source, cid, signatures[i], keys[i])
+        self._maybe_merge()
+
+    def remove(self, chunk_ids):
+        for cid in chunk_ids:
+            row = self._row_of.pop(cid, None)
+            if row is not None:
+                self._dead.add(row)
+
+    def retain(self, chunk_ids):
+        """Descarta las filas que no están en chunk_ids (p. ej. de un lote sin confirmar en el manifiesto)."""
+        self.remove([cid for cid in list(self._row_of) if cid not in chunk_ids])
+
+    def _maybe_merge(self):
+        if self._delta_rows > max(DEDUP_MERGE_ROWS, len(self._ids) // 4):
+            self._build_tables()
+
+    def flush(self):
+        """Escribe las filas nuevas y los borrados; el header se escribe el último."""
+        os.makedirs(self.path, exist_ok=True)
+        # Los ficheros de datos se crean aunque no haya filas nuevas.
+        with open(self._signatures_path, "ab") as f:
+            np.asarray(self._new_signatures, dtype=np.uint32).reshape(-1, DEDUP_NUM_PERM).tofile(f)
+        with open(self._records_path, "a") as f:
+            f.write("".join(
+                json.dumps({"id": self._ids[row], "source": self._sources[row]}, ensure_ascii=False) + "\n"
+                for row in range(self._flushed, len(self._ids))
+            ))
+        tmp_path = f"{self._deleted_path}.tmp.npy"
+        np.save(tmp_path, np.array(sorted(self._dead), dtype=np.int64))
+        os.replace(tmp_path, self._deleted_path)
+        tmp_path = f"{self._header_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"count": len(self._ids), "num_perm": DEDUP_NUM_PERM}, f)
+        os.replace(tmp_path, self._header_path)
+        if self._new_signatures:
+            self._flushed, self._new_signatures, self._mmap = len(self._ids), [], None
+        if len(self._ids) > 1000 and len(self._dead) > DEDUP_COMPACT_RATIO * len(self._ids):
+            self._compact()
+
+    def _compact(self):
+        live = [row for row in range(len(self._ids)) if row not in self._dead]
+        tmp_dir = f"{self.path}.compact"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.asarray(self._signatures()[live]).tofile(os.path.join(tmp_dir, "signatures.bin"))
+        with open(os.path.join(tmp_dir, "records.jsonl"), "w") as f:
+            for row in live:
+                f.write(json.dumps({"id": self._ids[row], "source": self._sources[row]}, ensure_ascii=False) + "\n")
+        with open(os.path.join(tmp_dir, "header.json"), "w") as f:
+            json.dump({"count": len(live), "num_perm": DEDUP_NUM_PERM}, f)
+        self._mmap = None
+        old_dir = f"{self.path}.old"
+        os.replace(self.path, old_dir)
+        os.replace(tmp_dir, self.path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        console.log(f"Índice de duplicados compactado: {len(self._ids)} -> {len(live)} filas.")
+        self._load()
+
+    def close(self):
+        """Suelta el memmap de las firmas; una lectura posterior lo vuelve a abrir."""
+        self._mmap = None
+
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._load()
@@ -0,0 +1,261 @@
+# src/ingestion/doc_store.py
+import hashlib
+import json
+import mmap
+import os
+import shutil
+from array import array
+
+from rich.console import Console
+from .manifest import text_hash
+
+console = Console()
+
+DOC_STORE_DIR = "doc_store"
+# Se compacta cuando el texto de documentos eliminados supera esta fracción del fichero.
+DOC_STORE_COMPACT_RATIO = float(os.environ.get("DOC_STORE_COMPACT_RATIO", "0.5"))
+
+_INDEX_FILE = "docs.jsonl"
+
+
+def doc_key(source, index, text):
+    """ID determinista de un documento cargado (un fichero de texto o una página de un PDF)."""
+    key = f"{source}\x00{index}\x00{text_hash(text)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class ChunkRef:
+    """
+    Un chunk como referencia a su documento: offsets en bytes [start, end) dentro
+    del texto UTF-8 del documento, y start_index (en caracteres) para fusionar
+    chunks contiguos al construir el contexto. El texto se lee del DocStore
+    solo cuando hace falta.
+    """
+
+    __slots__ = ("doc_id", "start", "end", "start_index")
+
+    def __init__(self, doc_id, start, end, start_index):
+        self.doc_id = doc_id
+        self.start = start
+        self.end = end
+        self.start_index = start_index
+
+    def metadata(self, source):
+        """Metadatos del chunk en el vector store: solo la referencia, sin texto ni metadatos del padre."""
+        return {"source": source, "doc_id": self.doc_id, "start": self.start, "end": self.end,
+                "start_index": self.start_index}
+
+    def __repr__(self):
+        return f"ChunkRef({self.doc_id}, {self.start}, {self.end})"
+
+
+class ChunkTable:
+    """Chunks de un conjunto de documentos en arrays por columna, en lugar de un objeto por chunk."""
+
+    __slots__ = ("_doc_ids", "_doc_rows", "_docs", "_starts", "_ends", "_start_indexes")
+
+    def __init__(self):
+        self._doc_ids = []
+        self._doc_rows = {}
+        self._docs = array("I")
+        self._starts = array("Q")
+        self._ends = array("Q")
+        self._start_indexes = array("Q")
+
+    @classmethod
+    def from_spans(cls, doc_id, text, spans):
+        """Tabla de los chunks de un documento a partir de (start_index, texto_del_chunk)."""
+        table = cls()
+        table.extend(doc_id, text, spans)
+        return table
+
+    def extend(self, doc_id, text, spans):
+        row = self._doc_rows.get(doc_id)
+        if row is None:
+            row = self._doc_rows[doc_id] = len(self._doc_ids)
+            self._doc_ids.append(doc_id)
+        # Offsets en bytes calculados de forma incremental (los spans vienen ordenados).
+        char_pos = byte_pos = 0
+        for start_index, chunk in spans:
+            byte_pos += len(text[char_pos:start_index].encode("utf-8"))
+            char_pos = start_index
+            self._docs.append(row)
+            self._starts.append(byte_pos)
+            self._ends.append(byte_pos + len(chunk.encode("utf-8")))
+            self._start_indexes.append(start_index)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __getitem__(self, i):
+        return ChunkRef(self._doc_ids[self._docs[i]], self._starts[i], self._ends[i], self._start_indexes[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class DocStore:
+    """
+    Texto original de los documentos, una sola vez, en un fichero append-only
+    (texts-<n>.bin) que se lee como mmap; docs.jsonl registra en su cabecera qué
+    fichero de texto está vigente y, por documento, su offset, longitud, fuente,
+    título y metadatos del loader (y los borrados).
+    Los chunks solo guardan (doc_id, start, end) y se materializan al embeberlos
+    o al devolverlos al prompt. Un único escritor (la ingesta, sobre su propia
+    versión del store); las versiones publicadas solo se leen. En stores antiguos,
+    sin doc store, queda vacío.
+    """
+
+    def __init__(self, persist_dir):
+        self.dir = os.path.join(persist_dir, DOC_STORE_DIR)
+        self._index_path = os.path.join(self.dir, _INDEX_FILE)
+        self._generation = 0
+        self._docs = {}
+        self._size = 0
+        self._dead_bytes = 0
+        self._mmap = None
+        self._mapped_size = 0
+        self._load()
+
+    @property
+    def _texts_path(self):
+        return os.path.join(self.dir, f"texts-{self._generation}.bin")
+
+    def _load(self):
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "r") as f:
+            self._generation = json.loads(f.readline())["generation"]
+            self._size = os.path.getsize(self._texts_path) if os.path.exists(self._texts_path) else 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir por una ingesta interrumpida.
+                    break
+                if entry.get("deleted"):
+                    removed = self._docs.pop(entry["id"], None)
+                    if removed is not None:
+                        self._dead_bytes += removed["length"]
+                elif entry["offset"] + entry["length"] <= self._size:
+                    self._docs[entry["id"]] = entry
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def document(self, doc_id):
+        return self._docs.get(doc_id)
+
+    def add_documents(self, documents):
+        """Añade documentos (doc_id, source, text, metadata, title); los que ya existen se omiten."""
+        new = [d for d in documents if d[0] not in self._docs]
+        if not new:
+            return
+        if not os.path.exists(self._index_path):
+            os.makedirs(self.dir, exist_ok=True)
+            with open(self._index_path, "w") as f:
+                f.write(json.dumps({"generation": self._generation}) + "\n")
+        entries = []
+        # Primero el texto y después el índice: un documento solo existe si está en ambos.
+        with open(self._texts_path, "ab") as f:
+            f.truncate(self._size)
+            for doc_id, source, text, metadata, title in new:
+                data = text.encode("utf-8")
+                entries.append({"id": doc_id, "source": source, "offset": self._size, "length": len(data),
+                                "title": title, "metadata": metadata or {}})
+                f.write(data)
+                self._size += len(data)
+        with open(self._index_path, "a") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        for entry in entries:
+            self._docs[entry["id"]] = entry
+
+    def remove(self, doc_ids):
+        removed = [doc_id for doc_id in doc_ids if doc_id in self._docs]
+        if not removed:
+            return
+        with open(self._index_path, "a") as f:
+            f.write("".join(json.dumps({"id": doc_id, "deleted": True}) + "\n" for doc_id in removed))
+        for doc_id in removed:
+            self._dead_bytes += self._docs.pop(doc_id)["length"]
+        if self._dead_bytes > DOC_STORE_COMPACT_RATIO * self._size:
+            self._compact()
+
+    def reset(self):
+        self._close_mmap()
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self._docs, self._size, self._dead_bytes, self._generation = {}, 0, 0, 0
+
+    def _compact(self):
+        """
+        Copia los documentos vivos a un fichero de texto nuevo y publica el índice
+        que lo referencia con un único os.replace; los offsets de los chunks son
+        relativos a su documento, así que el vector store no cambia.
+        """
+        self._close_mmap()
+        old_texts = self._texts_path
+        generation = self._generation + 1
+        new_texts = os.path.join(self.dir, f"texts-{generation}.bin")
+        tmp_index = f"{self._index_path}.tmp"
+        entries, offset = [], 0
+        with open(old_texts, "rb") as src, open(new_texts, "wb") as dst:
+            for entry in self._docs.values():
+                src.seek(entry["offset"])
+                dst.write(src.read(entry["length"]))
+                entries.append({**entry, "offset": offset})
+                offset += entry["length"]
+        with open(tmp_index, "w") as f:
+            f.write(json.dumps({"generation": generation}) + "\n")
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        os.replace(tmp_index, self._index_path)
+        os.remove(old_texts)
+        console.log(f"Doc store compactado: {self._size} -> {offset} bytes.")
+        self._generation = generation
+        self._docs = {entry["id"]: entry for entry in entries}
+        self._size, self._dead_bytes = offset, 0
+
+    def close(self):
+        self._close_mmap()
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap, self._mapped_size = None, 0
+
+    def _map(self):
+        if not self._size:
+            return b""
+        if self._mmap is None or self._mapped_size < self._size:
+            self._close_mmap()
+            with open(self._texts_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._mmap)
+        return self._mmap
+
+    def text(self, ref):
+        """Texto de un chunk (ChunkRef o cualquier objeto con doc_id, start y end)."""
+        entry = self._docs[ref.doc_id]
+        return self._map()[entry["offset"] + ref.start:entry["offset"] + ref.end].decode("utf-8")
+
+    def materialize(self, docs):
+        """
+        Rellena el texto de los resultados del vector store que solo guardan la
+        referencia, junto con los metadatos del documento padre y su título.
+        Los de stores antiguos (con el texto dentro) se devuelven tal cual.
+        """
+        result = []
+        for doc in docs:
+            metadata = doc.metadata
+            entry = self._docs.get(metadata.get("doc_id")) if not doc.page_content else None
+            if entry is None:
+                result.append(doc)
+                continue
+            text = self._map()[entry["offset"] + metadata["start"]:entry["offset"] + metadata["end"]].decode("utf-8")
+            result.append(doc.model_copy(update={
+                "page_content": text,
+                "metadata": {**entry["metadata"], "title": entry["title"], **metadata},
+            }))
+        return result
@@ -0,0 +1,236 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.observability.metrics import record_cache, span
+
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join("cache", "embeddings"))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+# Los vectores de consultas solo se guardan en memoria (LRU): cada consulta distinta no debe crecer el fichero.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+
+
+def embedding_key(text, kind="doc"):
+    # Documentos y consultas se cachean por separado: algunos modelos los embeben distinto.
+    return hashlib.blake2b(f"{kind}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def embed_queries(embeddings, texts):
+    """
+    Embebe varias consultas en una sola pasada del modelo cuando es equivalente a
+    embed_query: modelos con embed_queries propio, o sin parámetros específicos de
+    consulta (query_encode_kwargs de HuggingFaceEmbeddings). Si no, una a una.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if getattr(embeddings, "query_encode_kwargs", None):
+        return [embeddings.embed_query(text) for text in texts]
+    return embeddings.embed_documents(texts)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltorio de un modelo de embeddings con caché direccionada por contenido.
+
+    Los vectores de documentos se guardan en un fichero binario append-only (float32
+    o float16) que se lee como memmap de NumPy; un fichero de índice paralelo guarda
+    el hash de cada fila. Solo los textos que no están en caché se embeben, en lotes
+    grandes. Varias instancias (y procesos) comparten los ficheros: cada escritura
+    toma un flock exclusivo y relee antes el índice del disco, así que la fila de cada
+    vector la fija el fichero y no la vista de una instancia. Las consultas no
+    escriben en disco: usan los vectores ya guardados y una LRU en memoria.
+    """
+
+    def __init__(self, embeddings, namespace, cache_dir=EMBEDDING_CACHE_DIR,
+                 dtype=EMBEDDING_CACHE_DTYPE, batch_size=EMBEDDING_BATCH_SIZE,
+                 query_cache_size=QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.dtype = np.dtype(dtype)
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir = os.path.join(cache_dir, namespace.replace("/", "__"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._meta_path = os.path.join(self.cache_dir, "meta.json")
+        self._vectors_path = os.path.join(self.cache_dir, "vectors.bin")
+        self._index_path = os.path.join(self.cache_dir, "index.txt")
+        self._lock_path = os.path.join(self.cache_dir, "write.lock")
+        self._lock = threading.Lock()
+        self._index = {}
+        self._rows = 0
+        self._index_offset = 0
+        self._dim = None
+        self._mmap = None
+        self._queries = OrderedDict()
+        self._refresh()
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Incorpora las filas que otras instancias o procesos han añadido desde la última lectura."""
+        if self._dim is None:
+            if not os.path.exists(self._meta_path):
+                return
+            with open(self._meta_path, "r") as f:
+                meta = json.load(f)
+            if np.dtype(meta["dtype"]) != self.dtype:
+                raise ValueError(
+                    f"La caché de embeddings en {self.cache_dir} usa {meta['dtype']}, no {self.dtype}."
+                )
+            self._dim = meta["dim"]
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # Solo las líneas completas: el vector de una fila se escribe antes que su línea del índice.
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        for key in data[:end].decode("ascii").split():
+            self._index.setdefault(key, self._rows)
+            self._rows += 1
+        self._index_offset += end
+
+    def _vectors(self):
+        if self._mmap is None or self._mmap.shape[0] != self._rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self._dim))
+        return self._mmap
+
+    def _append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._write_lock():
+            self._refresh()
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                # Atómico: otras instancias lo leen sin tomar el lock.
+                tmp_path = f"{self._meta_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"dim": self._dim, "dtype": self.dtype.name}, f)
+                os.replace(tmp_path, self._meta_path)
+            # Una escritura interrumpida puede dejar vectores sin índice o una línea a medias:
+            # con el lock tomado, lo que no está confirmado en el índice se descarta.
+            for path, size in ((self._vectors_path, self._rows * self._dim * self.dtype.itemsize),
+                               (self._index_path, self._index_offset)):
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+            # Otra instancia puede haberlos guardado mientras se calculaban.
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._index]
+            if new:
+                # Primero los vectores y después el índice: una fila solo existe si está en ambos.
+                with open(self._vectors_path, "ab") as f:
+                    f.write(np.asarray([v for _, v in new]).astype(self.dtype).tobytes())
+                with open(self._index_path, "a") as f:
+                    f.write("".join(f"{key}\n" for key, _ in new))
+            self._refresh()
+        self._mmap = None
+
+    def _lookup(self, keys):
+        rows = [self._index[key] for key in keys]
+        return self._vectors()[rows].astype(np.float32)
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(text) for text in texts]
+        with self._lock:
+            self._refresh()
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._index and key not in missing:
+                    missing[key] = text
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+            record_cache("embeddings", True, len(keys) - len(missing))
+            record_cache("embeddings", False, len(missing))
+
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), self.batch_size):
+                batch_keys = missing_keys[start:start + self.batch_size]
+                with span("embed"):
+                    vectors = self.embeddings.embed_documents([missing[key] for key in batch_keys])
+                self._append(batch_keys, vectors)
+
+            if not keys:
+                return []
+            return self._lookup(keys).tolist()
+
+    def _cached_query(self, key):
+        """Vector de una consulta en la LRU o, de cachés antiguas, en el fichero (sin escribir en disco)."""
+        vector = self._queries.get(key)
+        if vector is not None:
+            self._queries.move_to_end(key)
+            return vector
+        if key in self._index:
+            vector = self._lookup([key])[0].tolist()
+            self._remember_query(key, vector)
+        return vector
+
+    def _remember_query(self, key, vector):
+        self._queries[key] = vector
+        self._queries.move_to_end(key)
+        while len(self._queries) > self.query_cache_size:
+            self._queries.popitem(last=False)
+
+    def embed_query(self, text):
+        key = embedding_key(text, kind="query")
+        with self._lock:
+            vector = self._cached_query(key)
+            record_cache("query_embeddings", vector is not None)
+            if vector is not None:
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+            with span("query_embed"):
+                vector = [float(x) for x in self.embeddings.embed_query(text)]
+            self._remember_query(key, vector)
+            return list(vector)
+
+    def embed_queries(self, texts):
+        """Como embed_query para varias consultas, con una única pasada del modelo para las que faltan."""
+        keys = [embedding_key(text, kind="query") for text in texts]
+        with self._lock:
+            found, missing = {}, {}
+            for key, text in zip(keys, texts):
+                if key in found or key in missing:
+                    continue
+                vector = self._cached_query(key)
+                if vector is None:
+                    missing[key] = text
+                else:
+                    found[key] = vector
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+            record_cache("query_embeddings", True, len(keys) - len(missing))
+            record_cache("query_embeddings", False, len(missing))
+            if missing:
+                with span("query_embed"):
+                    vectors = embed_queries(self.embeddings, list(missing.values()))
+                for key, vector in zip(missing, vectors):
+                    found[key] = [float(x) for x in vector]
+                    self._remember_query(key, found[key])
+            return [list(found[key]) for key in keys]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "vectors": self._rows,
+            "query_vectors": len(self._queries),
+        }
@@ -1,5 +1,20 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+from .embedding_cache import CachedEmbeddings
 
-def get_embeddings_model():
-    """Inicializa el modelo de embeddings."""
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
\ No newline at end of file
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch" (sentence-transformers) u "onnx" (ONNX Runtime, int8 por defecto).
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "torch").lower()
+
+def get_embeddings_model(backend=EMBEDDINGS_BACKEND):
+    """Inicializa el modelo de embeddings, envuelto en la caché persistente de vectores."""
+    if backend == "onnx":
+        from .onnx_embeddings import OnnxEmbeddings
+        embeddings = OnnxEmbeddings(EMBEDDING_MODEL)
+        # Los vectores cuantizados no son idénticos a los de PyTorch: caché aparte.
+        namespace = f"{EMBEDDING_MODEL}-{os.path.basename(embeddings.model_path).removesuffix('.onnx')}"
+        return CachedEmbeddings(embeddings, namespace=namespace)
+    if backend != "torch":
+        raise ValueError(f"Backend de embeddings desconocido: {backend} (usa 'torch' u 'onnx').")
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return CachedEmbeddings(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), namespace=EMBEDDING_MODEL)
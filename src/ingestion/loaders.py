@@ -1,17 +1,177 @@
 from langchain_community.document_loaders import TextLoader, PyPDFLoader
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
 import os
+import time
 from rich.console import Console
 
 console = Console()
 
+LOADER_MAX_WORKERS = int(os.environ.get("LOADER_MAX_WORKERS", str(os.cpu_count() or 1)))
+LOADER_TIMEOUT = float(os.environ.get("LOADER_TIMEOUT", "120"))
+# Cada cuánto se mira si un worker ha empezado un fichero (su timeout cuenta desde entonces).
+LOADER_START_POLL = 0.5
+
+# Extensión -> (clase de loader, es_costoso). Los loaders costosos en CPU se
+# ejecutan en un pool de procesos; el resto, en el proceso principal.
+LOADER_REGISTRY = {
+    ".txt": (TextLoader, False),
+    ".md": (TextLoader, False),
+    ".pdf": (PyPDFLoader, True),
+}
+
+def register_loader(extension, loader_cls, cpu_heavy=False):
+    """Registra (o reemplaza) el loader usado para una extensión, p. ej. '.docx'."""
+    LOADER_REGISTRY[extension.lower()] = (loader_cls, cpu_heavy)
+
+def _extension(path):
+    return os.path.splitext(path)[1].lower()
+
+def list_files(data_path="data"):
+    """Descubre recursivamente los ficheros con un loader registrado."""
+    files, skipped = [], 0
+    for root, dirs, names in os.walk(data_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if name.startswith("."):
+                continue
+            if _extension(name) in LOADER_REGISTRY:
+                files.append(os.path.join(root, name))
+            else:
+                skipped += 1
+    if skipped:
+        console.log(f"[yellow]{skipped} ficheros ignorados por no tener loader registrado.[/yellow]")
+    return sorted(files)
+
+def load_file(path):
+    loader_cls, _ = LOADER_REGISTRY[_extension(path)]
+    return loader_cls(path).load()
+
+def _read_file(loader_cls, path):
+    # Los workers arrancan con spawn e importan el registro de cero: la clase viaja con la
+    # tarea para que los loaders añadidos con register_loader también funcionen en ellos.
+    return loader_cls(path).load()
+
+def _new_pool(max_workers):
+    # spawn en lugar de fork: el proceso ya tiene hilos (servidor, jobs, clientes) y un
+    # hijo creado con fork puede heredar locks tomados por ellos y bloquearse.
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def _kill_pool(executor):
+    # Un worker colgado no termina solo: se matan los procesos antes de descartar el pool.
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _load_inline(path):
+    try:
+        return load_file(path)
+    except Exception as e:
+        console.log(f"[red]Error al cargar {path}:[/red] {e}")
+        return None
+
+def iter_loaded_files(paths, max_workers=LOADER_MAX_WORKERS, timeout=LOADER_TIMEOUT):
+    """
+    Carga los ficheros y genera (path, docs) a medida que terminan, no en orden.
+    Los formatos costosos (PDF) se parsean en un pool de procesos con como mucho
+    max_workers ficheros en vuelo; los ligeros se cargan en este proceso mientras tanto.
+    Un fichero que falla o supera `timeout` segundos se registra y se omite sin
+    afectar al resto. El timeout cuenta desde que un worker empieza el fichero y no
+    incluye el tiempo que el consumidor tiene suspendido el generador; un fichero ya
+    terminado nunca caduca. Tras un timeout el pool se recicla (los workers colgados
+    no liberan su hueco) y los demás ficheros en vuelo se relanzan en el nuevo.
+    """
+    heavy = [path for path in paths if LOADER_REGISTRY[_extension(path)][1]]
+    light = [path for path in paths if not LOADER_REGISTRY[_extension(path)][1]]
+
+    if not heavy:
+        for path in light:
+            docs = _load_inline(path)
+            if docs is not None:
+                yield path, docs
+        return
+
+    def submit(path):
+        return executor.submit(_read_file, LOADER_REGISTRY[_extension(path)][0], path)
+
+    def resume(since):
+        # El tiempo con el generador suspendido se añade a los plazos de los ficheros en curso.
+        paused = time.monotonic() - since
+        for future, (path, deadline) in in_flight.items():
+            if deadline is not None:
+                in_flight[future] = (path, deadline + paused)
+
+    executor = _new_pool(max_workers)
+    heavy_iter, light_iter = iter(heavy), iter(light)
+    # future -> (path, plazo); el plazo se fija cuando un worker empieza el fichero.
+    in_flight = {}
+    light_left = True
+    try:
+        while True:
+            while len(in_flight) < max_workers:
+                path = next(heavy_iter, None)
+                if path is None:
+                    break
+                in_flight[submit(path)] = (path, None)
+
+            if light_left:
+                path = next(light_iter, None)
+                if path is None:
+                    light_left = False
+                else:
+                    docs = _load_inline(path)
+                    if docs is not None:
+                        since = time.monotonic()
+                        yield path, docs
+                        resume(since)
+
+            if not in_flight:
+                if light_left:
+                    continue
+                break
+
+            now = time.monotonic()
+            for future, (path, deadline) in in_flight.items():
+                if deadline is None and (future.running() or future.done()):
+                    in_flight[future] = (path, now + timeout)
+            # Mientras queden ficheros ligeros solo se recogen los PDFs ya terminados.
+            waits = [deadline - now for _, deadline in in_flight.values() if deadline is not None]
+            if len(waits) < len(in_flight):
+                waits.append(LOADER_START_POLL)
+            wait_for = 0 if light_left else max(0.0, min(waits))
+            done, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, _ = in_flight.pop(future)
+                try:
+                    docs = future.result()
+                except Exception as e:
+                    console.log(f"[red]Error al cargar {path}:[/red] {e}")
+                    continue
+                since = time.monotonic()
+                yield path, docs
+                resume(since)
+
+            now = time.monotonic()
+            expired = [
+                future for future, (_, deadline) in in_flight.items()
+                if deadline is not None and now >= deadline and not future.done()
+            ]
+            if expired:
+                for future in expired:
+                    path, _ = in_flight.pop(future)
+                    console.log(f"[red]Timeout ({timeout}s) al cargar {path}; se omite.[/red]")
+                _kill_pool(executor)
+                executor = _new_pool(max_workers)
+                in_flight = {submit(path): (path, None) for path, _ in in_flight.values()}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_docs(data_path="data"):
+    """Genera los documentos a medida que se cargan, sin cargar todo el corpus en memoria."""
+    for _, docs in iter_loaded_files(list_files(data_path)):
+        yield from docs
+
 def load_docs(data_path="data"):
-    docs = []
-    for file in os.listdir(data_path):
-        path = os.path.join(data_path, file)
-        if file.endswith(".pdf"):
-            loader = PyPDFLoader(path)
-        else:
-            loader = TextLoader(path)
-        docs.extend(loader.load())
+    docs = list(iter_docs(data_path))
     console.log(f"Loaded {len(docs)} documents.")
-    return docs
\ No newline at end of file
+    return docs
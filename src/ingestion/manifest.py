@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = "ingestion_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_hash(path, block_size=1 << 20):
+    """Calcula el hash SHA-256 del contenido binario de un fichero."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source, index, text):
+    """
+    ID determinista de un chunk: el mismo fichero con el mismo contenido
+    produce siempre los mismos IDs, lo que permite hacer upserts.
+    """
+    key = f"{source}\x00{index}\x00{text_hash(text)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def new_manifest():
+    # "pending" guarda el progreso de los ficheros a medio ingerir (checkpoint por lote).
+    return {"version": MANIFEST_VERSION, "files": {}, "pending": {}}
+
+
+def load_manifest(path):
+    """Carga el manifiesto de ingesta; si no existe (o es de otra versión) devuelve uno vacío."""
+    if not os.path.exists(path):
+        return new_manifest()
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return new_manifest()
+    manifest.setdefault("pending", {})
+    return manifest
+
+
+def save_manifest(manifest, path):
+    # Escritura atómica: un fallo a mitad de escritura no corrompe el manifiesto anterior.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def diff_manifest(manifest, current_hashes):
+    """
+    Compara los hashes actuales de los ficheros con el manifiesto.
+    Devuelve (nuevos_o_modificados, eliminados).
+    """
+    known = manifest["files"]
+    changed = [
+        source for source, digest in current_hashes.items()
+        if known.get(source, {}).get("hash") != digest
+    ]
+    removed = [source for source in known if source not in current_hashes]
+    return changed, removed
@@ -0,0 +1,386 @@
+# src/ingestion/numpy_store.py
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+NUMPY_STORE_DIR = "numpy_index"
+NUMPY_STORE_DTYPE = os.environ.get("NUMPY_STORE_DTYPE", "float32")
+# Filas por bloque al puntuar: acota la memoria temporal con float16/int8.
+NUMPY_STORE_BLOCK_ROWS = int(os.environ.get("NUMPY_STORE_BLOCK_ROWS", "65536"))
+# Se compacta (se reescriben los ficheros sin las filas borradas) cuando superan esta fracción.
+NUMPY_STORE_COMPACT_RATIO = float(os.environ.get("NUMPY_STORE_COMPACT_RATIO", "0.5"))
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+def _truncate(path, size):
+    if os.path.getsize(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+def _matches(values, condition):
+    """Máscara booleana de una condición estilo Chroma sobre una columna de metadatos."""
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    mask = np.ones(len(values), dtype=bool)
+    for op, operand in condition.items():
+        if op == "$eq":
+            mask &= values == operand
+        elif op == "$ne":
+            mask &= values != operand
+        elif op == "$in":
+            mask &= np.isin(values, list(operand))
+        elif op == "$nin":
+            mask &= ~np.isin(values, list(operand))
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {op}")
+    return mask
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store en proceso: los vectores normalizados viven en una matriz contigua
+    (float32, float16 o int8 con escala por fila) en un fichero que se lee como memmap,
+    de modo que varios workers de uvicorn comparten las mismas páginas del page cache.
+    Un top-k es un producto matriz-vector por bloques más argpartition.
+
+    Las filas son append-only: un upsert o un borrado marca la fila anterior como
+    borrada (tombstone), y la matriz se compacta cuando hay demasiadas. El número de
+    filas válidas se confirma en header.json al final de cada escritura, así que un
+    corte a mitad deja el store en su último estado consistente.
+    Los filtros admiten igualdad y $eq/$ne/$in/$nin por campo, combinados con $and/$or.
+    """
+
+    def __init__(self, persist_directory="chroma_db", embedding_function=None, dtype=NUMPY_STORE_DTYPE):
+        self.embedding_function = embedding_function
+        self.path = os.path.join(persist_directory, NUMPY_STORE_DIR)
+        self._header_path = os.path.join(self.path, "header.json")
+        self._vectors_path = os.path.join(self.path, "vectors.bin")
+        self._scales_path = os.path.join(self.path, "scales.bin")
+        self._records_path = os.path.join(self.path, "records.jsonl")
+        self._deleted_path = os.path.join(self.path, "deleted.npy")
+        self._lock = threading.Lock()
+        self._load(np.dtype(dtype))
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    # --- Persistencia ---
+
+    def _load(self, dtype):
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._row_of = {}
+        self._columns = {}
+        self._mmap = None
+        self._scales = None
+        self.dim = None
+        self.dtype = dtype
+        if not os.path.exists(self._header_path):
+            self._deleted = np.zeros(0, dtype=bool)
+            return
+
+        with open(self._header_path, "r") as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        self.dtype = np.dtype(header["dtype"])
+        count = header["count"]
+        with open(self._records_path, "rb") as f:
+            while len(self._ids) < count:
+                record = json.loads(f.readline())
+                self._append_record(record["id"], record["text"], record["metadata"])
+            records_size = f.tell()
+
+        # Se descarta lo que se escribiera después del último header confirmado (solo
+        # escribe si hace falta: los workers que sirven el store lo abren en modo lectura).
+        _truncate(self._vectors_path, count * self.dim * self.dtype.itemsize)
+        if self.dtype == np.int8:
+            _truncate(self._scales_path, count * 4)
+        _truncate(self._records_path, records_size)
+
+        deleted = np.load(self._deleted_path) if os.path.exists(self._deleted_path) else np.zeros(0, dtype=bool)
+        self._deleted = np.zeros(count, dtype=bool)
+        self._deleted[:min(count, len(deleted))] = deleted[:count]
+        for row in np.flatnonzero(self._deleted):
+            if self._row_of.get(self._ids[row]) == row:
+                del self._row_of[self._ids[row]]
+
+    def _append_record(self, doc_id, text, metadata):
+        self._row_of[doc_id] = len(self._ids)
+        self._ids.append(doc_id)
+        self._texts.append(text)
+        self._metadatas.append(metadata)
+
+    def _write_header(self):
+        tmp_path = f"{self._header_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": len(self._ids)}, f)
+        os.replace(tmp_path, self._header_path)
+
+    def _save_deleted(self):
+        tmp_path = f"{self._deleted_path}.tmp.npy"
+        np.save(tmp_path, self._deleted)
+        os.replace(tmp_path, self._deleted_path)
+
+    def _matrix(self):
+        if self._mmap is None and self._ids:
+            self._mmap = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(len(self._ids), self.dim))
+            if self.dtype == np.int8:
+                self._scales = np.fromfile(self._scales_path, dtype=np.float32, count=len(self._ids))
+        return self._mmap
+
+    def _encode(self, vectors):
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    # --- Escritura ---
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        vectors = _normalize_rows(self.embedding_function.embed_documents(texts))
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def add_vectors(self, vectors, texts, metadatas, ids):
+        """Upsert por ID de vectores ya calculados."""
+        vectors = _normalize_rows(vectors)
+        # Dentro de un mismo lote, gana la última aparición de cada ID.
+        last = {doc_id: i for i, doc_id in enumerate(ids)}
+        keep = sorted(last.values())
+        vectors = vectors[keep]
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Dimensión {vectors.shape[1]} distinta de la del índice ({self.dim}).")
+
+            encoded, scales = self._encode(vectors)
+            with open(self._vectors_path, "ab") as f:
+                f.write(encoded.tobytes())
+            if scales is not None:
+                with open(self._scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+
+            replaced = [self._row_of[ids[i]] for i in keep if ids[i] in self._row_of]
+            with open(self._records_path, "a") as f:
+                for i in keep:
+                    f.write(json.dumps({"id": ids[i], "text": texts[i], "metadata": metadatas[i] or {}},
+                                       ensure_ascii=False) + "\n")
+                    self._append_record(ids[i], texts[i], metadatas[i] or {})
+
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(keep), dtype=bool)])
+            self._deleted[replaced] = True
+            self._after_write()
+        return list(ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            rows = [self._row_of.pop(doc_id) for doc_id in ids if doc_id in self._row_of]
+            if not rows:
+                return False
+            self._deleted[rows] = True
+            self._after_write()
+        return True
+
+    def _after_write(self):
+        self._mmap = None
+        self._scales = None
+        self._columns = {}
+        self._save_deleted()
+        self._write_header()
+        if len(self._ids) > 1000 and self._deleted.mean() > NUMPY_STORE_COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        live = np.flatnonzero(~self._deleted)
+        matrix = self._matrix()
+        tmp_dir = f"{self.path}.compact"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.asarray(matrix[live]).tofile(os.path.join(tmp_dir, "vectors.bin"))
+        if self.dtype == np.int8:
+            self._scales[live].tofile(os.path.join(tmp_dir, "scales.bin"))
+        with open(os.path.join(tmp_dir, "records.jsonl"), "w") as f:
+            for row in live:
+                f.write(json.dumps({"id": self._ids[row], "text": self._texts[row], "metadata": self._metadatas[row]},
+                                   ensure_ascii=False) + "\n")
+        np.save(os.path.join(tmp_dir, "deleted.npy"), np.zeros(len(live), dtype=bool))
+        with open(os.path.join(tmp_dir, "header.json"), "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": len(live)}, f)
+
+        self._mmap = None
+        old_dir = f"{self.path}.old"
+        os.replace(self.path, old_dir)
+        os.replace(tmp_dir, self.path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self._load(self.dtype)
+
+    def reset_collection(self):
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._load(self.dtype)
+
+    def close(self):
+        """Suelta el memmap de la matriz; una lectura posterior lo vuelve a abrir."""
+        with self._lock:
+            self._mmap = None
+            self._scales = None
+
+    # --- Lectura ---
+
+    def _column(self, key):
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self._metadatas), dtype=object)
+            column[:] = [metadata.get(key) for metadata in self._metadatas]
+            self._columns[key] = column
+        return column
+
+    def _filter_mask(self, where):
+        if not where:
+            return np.ones(len(self._ids), dtype=bool)
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._filter_mask(sub)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._filter_mask(sub) for sub in condition])
+            else:
+                mask &= _matches(self._column(key), condition)
+        return mask
+
+    def _snapshot(self, filter=None):
+        """
+        Estado de lectura consistente: la matriz y las listas de un momento dado. Las
+        escrituras solo añaden filas o sustituyen los objetos, así que puntuar fuera
+        del lock no bloquea a las demás consultas.
+        """
+        with self._lock:
+            if not self._ids:
+                return None
+            valid = ~self._deleted & self._filter_mask(filter)
+            return self._matrix(), self._scales, valid, (self._ids, self._texts, self._metadatas)
+
+    @staticmethod
+    def _scores(queries, matrix, scales):
+        """Similitud coseno (queries × filas), por bloques de filas."""
+        scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], NUMPY_STORE_BLOCK_ROWS):
+            block = matrix[start:start + NUMPY_STORE_BLOCK_ROWS]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+            if scales is not None:
+                scores[:, start:start + len(block)] *= scales[start:start + len(block)]
+        return scores
+
+    @staticmethod
+    def _document(records, row):
+        ids, texts, metadatas = records
+        return Document(id=ids[row], page_content=texts[row], metadata=dict(metadatas[row]))
+
+    def _top_k(self, queries, k, filter=None):
+        snapshot = self._snapshot(filter)
+        if snapshot is None:
+            return [[] for _ in range(len(queries))]
+        matrix, scales, valid, records = snapshot
+        scores = self._scores(queries, matrix, scales)
+        scores[:, ~valid] = -np.inf
+        k = min(k, int(valid.sum()))
+        results = []
+        for row_scores in scores:
+            if k == 0:
+                results.append([])
+                continue
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            top = top[np.argsort(-row_scores[top])]
+            results.append([(self._document(records, row), float(row_scores[row])) for row in top])
+        return results
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return self._top_k(_normalize_rows(embedding), k, filter)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def batch_similarity_search_by_vector(self, embeddings, k=4, filter=None):
+        """Top-k de varias consultas con un único producto matriz-matriz."""
+        return [[doc for doc, _ in hits] for hits in self._top_k(_normalize_rows(embeddings), k, filter)]
+
+    def batch_similarity_search(self, queries, k=4, filter=None):
+        embeddings = [self.embedding_function.embed_query(query) for query in queries]
+        return self.batch_similarity_search_by_vector(embeddings, k, filter)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None,
+                                                **kwargs):
+        query = _normalize_rows(embedding)
+        snapshot = self._snapshot(filter)
+        if snapshot is None:
+            return []
+        matrix, scales, valid, records = snapshot
+        scores = self._scores(query, matrix, scales)[0]
+        scores[~valid] = -np.inf
+        fetch_k = min(fetch_k, int(valid.sum()))
+        if fetch_k == 0:
+            return []
+        candidates = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+        vectors = np.asarray(matrix[candidates], dtype=np.float32)
+        if scales is not None:
+            vectors *= scales[candidates][:, None]
+        selected = maximal_marginal_relevance(query[0], vectors, lambda_mult=lambda_mult, k=k)
+        return [self._document(records, candidates[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    def get_by_ids(self, ids):
+        with self._lock:
+            records = (self._ids, self._texts, self._metadatas)
+            return [self._document(records, self._row_of[doc_id]) for doc_id in ids if doc_id in self._row_of]
+
+    def _select_relevance_score_fn(self):
+        # Las puntuaciones ya son similitudes coseno en [-1, 1].
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory="chroma_db", **kwargs):
+        store = cls(persist_directory=persist_directory, embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def __len__(self):
+        return len(self._row_of)
@@ -0,0 +1,203 @@
+# src/ingestion/onnx_embeddings.py
+"""
+Backend de embeddings sobre ONNX Runtime para nodos solo-CPU.
+
+El modelo de sentence-transformers (o un directorio local de Hugging Face) se
+exporta una vez a ONNX, se cuantiza a int8 (cuantización dinámica) y se ejecuta
+con ONNX Runtime. Los textos se agrupan por longitud antes de formar los lotes
+para que el relleno (padding) sea mínimo. El pooling (media con máscara) y la
+normalización L2 reproducen los de all-MiniLM-L6-v2 en sentence-transformers.
+
+Comprobar que la calidad coincide con el backend de PyTorch:
+    python -m src.ingestion.onnx_embeddings --check
+"""
+import argparse
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from rich.console import Console
+
+console = Console()
+
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", os.path.join("cache", "onnx"))
+ONNX_QUANTIZE = os.environ.get("ONNX_QUANTIZE", "true").lower() == "true"
+ONNX_BATCH_SIZE = int(os.environ.get("ONNX_BATCH_SIZE", "64"))
+# 0 deja que ONNX Runtime use todos los núcleos físicos.
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", "0"))
+# Longitud máxima de secuencia de all-MiniLM-L6-v2 en sentence-transformers.
+ONNX_MAX_LENGTH = int(os.environ.get("ONNX_MAX_LENGTH", "256"))
+# Similitud coseno mínima, texto a texto, frente al backend de PyTorch.
+ONNX_PARITY_TOLERANCE = float(os.environ.get("ONNX_PARITY_TOLERANCE", "0.98"))
+
+
+def resolve_model_id(model_name):
+    """Los nombres cortos de sentence-transformers se resuelven a su repo de Hugging Face."""
+    if os.path.isdir(model_name) or "/" in model_name:
+        return model_name
+    return f"sentence-transformers/{model_name}"
+
+
+def onnx_model_path(model_name, model_dir=ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE):
+    base = os.path.join(model_dir, os.path.basename(os.path.normpath(model_name)))
+    return base, os.path.join(base, "model.int8.onnx" if quantize else "model.onnx")
+
+
+def export_onnx(model_name, model_dir=ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE):
+    """
+    Exporta el transformer a ONNX (ejes dinámicos de lote y secuencia) junto con
+    su tokenizer y, si se pide, genera la versión cuantizada a int8. Si el fichero
+    ya existe no se vuelve a exportar. Devuelve la ruta del modelo a cargar.
+    """
+    base, path = onnx_model_path(model_name, model_dir, quantize)
+    if os.path.exists(path):
+        return path
+
+    # Solo la exportación necesita torch; la inferencia se hace con onnxruntime.
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    model_id = resolve_model_id(model_name)
+    console.log(f"Exportando {model_id} a ONNX en {base}...")
+    os.makedirs(base, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id).eval()
+    tokenizer.save_pretrained(base)
+
+    sample = tokenizer(["exportación a onnx"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(base, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        console.log("Cuantizando el modelo ONNX a int8...")
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    return path
+
+
+def length_buckets(lengths, batch_size):
+    """
+    Agrupa índices en lotes de textos de longitud parecida (orden por longitud),
+    para que cada lote se rellene solo hasta su propio máximo.
+    """
+    order = np.argsort(lengths, kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings de sentence-transformers ejecutados con ONNX Runtime (opcionalmente int8)."""
+
+    def __init__(self, model_name, model_dir=ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE, batch_size=ONNX_BATCH_SIZE,
+                 intra_op_threads=ONNX_INTRA_OP_THREADS, max_length=ONNX_MAX_LENGTH, normalize=True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.normalize = normalize
+        self.model_path = export_onnx(model_name, model_dir, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(self.model_path))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, encodings):
+        batch = self.tokenizer.pad(encodings, return_tensors="np")
+        inputs = {name: batch[name].astype(np.int64) for name in self._input_names if name in batch}
+        hidden = self.session.run(None, inputs)[0]
+        # Media de los tokens reales (sin relleno).
+        mask = batch["attention_mask"][..., None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def _embed(self, texts):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        result = None
+        for indices in length_buckets(lengths, self.batch_size):
+            encodings = [{key: encoded[key][i] for key in encoded.keys()} for i in indices]
+            vectors = self._encode_batch(encodings)
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[indices] = vectors
+        return result
+
+    def embed_documents(self, texts):
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text):
+        return self._embed([text])[0].tolist()
+
+
+def check_parity(reference, candidate, texts, tolerance=ONNX_PARITY_TOLERANCE, k=5):
+    """
+    Compara dos backends sobre los mismos textos: similitud coseno texto a texto
+    y coincidencia del top-k de vecinos (cada texto usado como consulta).
+    """
+    ref = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cand = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    ref /= np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand /= np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+    cosines = (ref * cand).sum(axis=1)
+
+    k = min(k, len(texts))
+    ref_top = np.argsort(-(ref @ ref.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand @ cand.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)])
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "topk_overlap": float(overlap),
+        "passed": bool(cosines.min() >= tolerance),
+    }
+
+
+def main():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from .embeddings import EMBEDDING_MODEL
+    from .loaders import load_docs
+    from .splitters import split_docs
+
+    parser = argparse.ArgumentParser(description="Comprueba el backend ONNX frente al de PyTorch.")
+    parser.add_argument("--check", action="store_true", help="Compara la calidad con el backend de PyTorch.")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--tolerance", type=float, default=ONNX_PARITY_TOLERANCE)
+    args = parser.parse_args()
+
+    candidate = OnnxEmbeddings(args.model)
+    console.log(f"Modelo ONNX listo en {candidate.model_path}")
+    if args.check:
+        texts = [chunk.page_content for chunk in split_docs(load_docs(args.data))]
+        report = check_parity(HuggingFaceEmbeddings(model_name=args.model), candidate, texts, args.tolerance)
+        console.log(report)
+        if not report["passed"]:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
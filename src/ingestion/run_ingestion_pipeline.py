@@ -1,33 +1,415 @@
 # src/main.py
-from .loaders import load_docs
-from .splitters import split_docs
+from .loaders import iter_loaded_files, list_files
+from .splitters import split_offsets
+from .doc_store import ChunkRef, ChunkTable, DocStore, doc_key
+from .dedup import DEDUP_ENABLED, DedupIndex
 from .embeddings import get_embeddings_model
-from .vector_store import store_in_chroma
-from src.metadata.generate_metadata import generate_metadata
-from langchain_groq import ChatGroq
-import json
+from .vector_store import close_store, open_chroma_store, upsert_chunk_refs, delete_chunks
+from .batching import batched
+from .store_versions import (
+    STORES_ROOT,
+    build_lock,
+    current_version,
+    discard_build,
+    prepare_build,
+    publish_version,
+)
+from .manifest import (
+    MANIFEST_FILE,
+    chunk_id,
+    diff_manifest,
+    file_hash,
+    load_manifest,
+    new_manifest,
+    save_manifest,
+)
+from src.metadata.generate_metadata import METADATA_MAX_CONCURRENCY, generate_document_and_chunk_metadata, parse_metadata
+from src.metadata.inverted_index import build_inverted_index, metadata_terms, save_inverted_index
+from src.metadata.metadata_store import METADATA_DB_FILE, MetadataStore
+from src.observability.metrics import span, timed_iter
+import os
 from rich.console import Console
 
 
 console = Console()
 
-def run_ingestion_pipeline():
-    docs = load_docs()
-    # Generar metadatos por DOCUMENTO (antes de chunking)
-    llm_metadata = ChatGroq(model="llama-3.1-8b-instant")
-    metadata_list = []
-    for doc in docs:
-        metadata = generate_metadata(doc.page_content, llm_metadata)
-        doc.metadata["generated_metadata"] = metadata
-        metadata_list.append(metadata)
-
-    with open("metadata.json", "w") as f:
-        json.dump(metadata_list, f, indent=2)
-    console.log("[green]Metadata generated and saved to metadata.json[/green]")
-
-    chunks = split_docs(docs)
-    embeddings = get_embeddings_model()
-    metadata = [generate_metadata(chunk.page_content, ChatGroq(model="llama-3.1-8b-instant")) for chunk in chunks]
-    vectordb = store_in_chroma(chunks, embeddings)
-
-    return vectordb, metadata
\ No newline at end of file
+INGEST_FILE_BATCH_SIZE = int(os.environ.get("INGEST_FILE_BATCH_SIZE", "16"))
+INGEST_CHUNK_BATCH_SIZE = int(os.environ.get("INGEST_CHUNK_BATCH_SIZE", "256"))
+
+
+class StoreLoadError(Exception):
+    """No se pudieron abrir los stores de un directorio de versión (construcción dañada)."""
+
+
+def _delete_chunks(vectordb, doc_store, meta_store, dedup, manifest, ids):
+    """
+    Borra chunks canónicos del vector store y del índice de duplicados. Si alguno
+    tenía alias en otros ficheros, el primero que sigue vivo pasa a ser el canónico:
+    se embebe desde su referencia en el doc store y hereda los demás alias.
+    """
+    ids = set(ids)
+    if not ids:
+        return
+    delete_chunks(vectordb, ids)
+    if dedup is not None:
+        dedup.remove(ids)
+
+    promoted = {}
+    for alias in meta_store.aliases_of(ids):
+        if (alias["canonical_id"] in promoted or alias["chunk_id"] in ids
+                or alias["doc_id"] not in doc_store or alias["source"] not in manifest["files"]):
+            continue
+        promoted[alias["canonical_id"]] = alias
+    if not promoted:
+        return
+    refs = [ChunkRef(a["doc_id"], a["start"], a["end"], a["start_index"]) for a in promoted.values()]
+    texts = [doc_store.text(ref) for ref in refs]
+    upsert_chunk_refs(
+        vectordb,
+        texts,
+        [ref.metadata(a["source"]) for ref, a in zip(refs, promoted.values())],
+        [a["chunk_id"] for a in promoted.values()],
+    )
+    if dedup is not None:
+        dedup.add([(a["source"], a["chunk_id"], text) for a, text in zip(promoted.values(), texts)])
+    for canonical, alias in promoted.items():
+        meta_store.promote_alias(alias["chunk_id"], canonical)
+        manifest["files"][alias["source"]]["chunk_ids"].append(alias["chunk_id"])
+    console.log(f"{len(promoted)} chunks duplicados promovidos a canónicos.")
+
+
+def _finalize_file(vectordb, doc_store, meta_store, dedup, manifest, path):
+    """
+    Marca un fichero como ingerido por completo: sustituye sus metadatos y alias en
+    el store de metadatos, mueve su entrada de "pending" a "files" y borra los chunks
+    (y los textos en el doc store) de su versión anterior que ya no existen.
+    """
+    entry = manifest["pending"].pop(path)
+    previous = manifest["files"].get(path, {})
+    meta_store.replace_file(path, entry["metadata"], entry["chunk_ids"], entry.get("chunk_metadata", []),
+                            entry.get("aliases", []))
+    manifest["files"][path] = {
+        "hash": entry["hash"],
+        "doc_ids": entry["doc_ids"],
+        "chunk_ids": entry["chunk_ids"],
+        "metadata": entry["metadata"],
+        "chunk_terms": entry.get("chunk_terms", {}),
+    }
+    _delete_chunks(vectordb, doc_store, meta_store, dedup, manifest,
+                   set(previous.get("chunk_ids", [])) - set(entry["chunk_ids"]))
+    doc_store.remove(set(previous.get("doc_ids", [])) - set(entry["doc_ids"]))
+    aliased = len(entry.get("aliases", []))
+    console.log(f"[green]{path}: {len(entry['chunk_ids'])} chunks actualizados"
+                f"{f' ({aliased} duplicados)' if aliased else ''}.[/green]")
+
+
+def _no_progress(stage, count=1):
+    pass
+
+
+def _not_cancelled():
+    pass
+
+
+def _iter_described_chunks(paths, current_hashes, manifest, vectordb, doc_store, meta_store, dedup,
+                           max_concurrency, file_batch_size, progress, check_cancelled, metadata_llm):
+    """
+    Etapas load → split → dedup → metadata, por lotes de ficheros. Genera (path, id,
+    ChunkRef) bajo demanda: el siguiente lote no se carga hasta que se consumen los
+    chunks del anterior, así que la memoria depende del tamaño de lote y no del corpus.
+    El texto de cada documento se guarda una vez en el doc store y los chunks son
+    solo offsets sobre él; su texto se materializa para el LLM y al embeberlo.
+    Los chunks casi duplicados de otro ya indexado quedan como alias suyos: no pasan
+    por el LLM ni se embeben, solo se registran para citarlos.
+    Los ficheros que fallan al cargarse no llegan aquí y se reintentan en la próxima ingesta.
+    """
+    pending = manifest["pending"]
+    # Chunks que la ingesta va a sustituir: no pueden ser el canónico de un duplicado nuevo.
+    retiring = set()
+    for path in paths:
+        retiring.update(manifest["files"].get(path, {}).get("chunk_ids", []))
+        if path in pending and pending[path]["hash"] != current_hashes[path]:
+            retiring.update(pending[path]["chunk_ids"])
+    for loaded_batch in timed_iter(batched(iter_loaded_files(paths), file_batch_size), "load"):
+        check_cancelled()
+        progress("documents_loaded", sum(len(docs) for _, docs in loaded_batch))
+
+        # Cada documento se trocea por separado para poder asociar a sus chunks
+        # los metadatos del documento padre.
+        with span("split"):
+            files = [(path, docs, [split_offsets(doc.page_content) for doc in docs]) for path, docs in loaded_batch]
+        progress("chunks_split", sum(len(spans) for _, _, doc_spans in files for spans in doc_spans))
+
+        file_ids, aliases = [], {}
+        for path, _, doc_spans in files:
+            ids = []
+            for spans in doc_spans:
+                for _, text in spans:
+                    ids.append(chunk_id(path, len(ids), text))
+            file_ids.append(ids)
+        if dedup is not None:
+            # Todo el lote a la vez: las firmas MinHash se calculan vectorizadas.
+            with span("dedup"):
+                fresh = []
+                for (path, _, doc_spans), ids in zip(files, file_ids):
+                    texts = [text for spans in doc_spans for _, text in spans]
+                    previous = pending.get(path)
+                    if previous and previous["hash"] == current_hashes[path]:
+                        # Reanudación: se mantiene la asignación de la ingesta interrumpida.
+                        resumed = {row[0]: row[1] for row in previous.get("aliases", [])}
+                        aliases.update(resumed)
+                        dedup.add([(path, cid, text) for cid, text in zip(ids, texts) if cid not in resumed])
+                    else:
+                        fresh.extend((path, cid, text) for cid, text in zip(ids, texts))
+                assigned = dedup.assign(fresh, exclude=retiring)
+                aliases.update(assigned)
+            progress("chunks_deduplicated", len(assigned))
+
+        # Pasada por documento y por chunk (solo los canónicos) en paralelo, con un único cliente LLM.
+        with span("metadata"):
+            doc_metadata, chunk_metadata = generate_document_and_chunk_metadata(
+                [doc.page_content for _, docs, _ in files for doc in docs],
+                [chunk for (_, _, doc_spans), ids in zip(files, file_ids)
+                 for cid, chunk in zip(ids, (chunk for spans in doc_spans for _, chunk in spans))
+                 if cid not in aliases],
+                llm=metadata_llm,
+                max_concurrency=max_concurrency,
+                check_cancelled=check_cancelled,
+            )
+        progress("metadata_generated", len(doc_metadata) + len(chunk_metadata))
+
+        doc_offset = chunk_offset = 0
+        for (path, docs, doc_spans), all_ids in zip(files, file_ids):
+            file_metadata = doc_metadata[doc_offset:doc_offset + len(docs)]
+            doc_offset += len(docs)
+
+            doc_ids = [doc_key(path, i, doc.page_content) for i, doc in enumerate(docs)]
+            doc_store.add_documents([
+                (doc_id, path, doc.page_content, doc.metadata, parse_metadata(metadata).get("title"))
+                for doc_id, doc, metadata in zip(doc_ids, docs, file_metadata)
+            ])
+
+            chunks = ChunkTable()
+            for doc_id, doc, spans in zip(doc_ids, docs, doc_spans):
+                chunks.extend(doc_id, doc.page_content, spans)
+            ids, refs, chunks_metadata, alias_rows = [], [], [], []
+            for cid, ref in zip(all_ids, chunks):
+                if cid in aliases:
+                    alias_rows.append([cid, aliases[cid], ref.doc_id, ref.start, ref.end, ref.start_index])
+                    continue
+                ids.append(cid)
+                refs.append(ref)
+                chunks_metadata.append(chunk_metadata[chunk_offset] or "")
+                chunk_offset += 1
+
+            # Entidades y temas propios de cada chunk, para el índice invertido.
+            chunk_terms = {}
+            for cid, metadata in zip(ids, chunks_metadata):
+                for term in metadata_terms(metadata):
+                    chunk_terms.setdefault(term, []).append(cid)
+
+            # Si una ingesta anterior se interrumpió a mitad de este fichero (mismo hash),
+            # se reanuda desde los lotes ya confirmados.
+            previous = pending.get(path)
+            committed = previous["committed"] if previous and previous["hash"] == current_hashes[path] else []
+            done = set(committed) & set(ids)
+            if previous and previous["hash"] != current_hashes[path]:
+                # Checkpoint de una versión anterior del fichero que no llegó a terminarse.
+                live = manifest["files"].get(path, {}).get("chunk_ids", [])
+                _delete_chunks(vectordb, doc_store, meta_store, dedup, manifest,
+                               set(previous["chunk_ids"]) - set(live) - set(ids))
+            pending[path] = {
+                "hash": current_hashes[path],
+                "doc_ids": doc_ids,
+                "chunk_ids": ids,
+                "metadata": [m for m in file_metadata if m is not None],
+                "chunk_terms": chunk_terms,
+                # Solo hasta finalizar el fichero; después vive en el store de metadatos.
+                "chunk_metadata": chunks_metadata,
+                # [chunk_id, canonical_id, doc_id, start, end, start_index] de los duplicados.
+                "aliases": alias_rows,
+                "committed": [cid for cid in ids if cid in done],
+            }
+
+            remaining = [(cid, ref) for cid, ref in zip(ids, refs) if cid not in done]
+            if not remaining:
+                _finalize_file(vectordb, doc_store, meta_store, dedup, manifest, path)
+            for cid, ref in remaining:
+                yield path, cid, ref
+
+
+def _commit_batch(vectordb, doc_store, meta_store, dedup, manifest, batch):
+    """Etapas embed → upsert de un lote de chunks y checkpoint de su progreso."""
+    # El span "upsert" incluye el cálculo de embeddings, que también se mide aparte como "embed".
+    with span("upsert"):
+        upsert_chunk_refs(
+            vectordb,
+            [doc_store.text(ref) for _, _, ref in batch],
+            [ref.metadata(path) for path, _, ref in batch],
+            [cid for _, cid, _ in batch],
+        )
+
+    pending = manifest["pending"]
+    for path, cid, _ in batch:
+        pending[path]["committed"].append(cid)
+    for path in dict.fromkeys(path for path, _, _ in batch):
+        if len(pending[path]["committed"]) == len(pending[path]["chunk_ids"]):
+            _finalize_file(vectordb, doc_store, meta_store, dedup, manifest, path)
+    return len(batch)
+
+
+def run_ingestion_pipeline(data_path="data", persist_dir="chroma_db", incremental=True,
+                           max_concurrency=METADATA_MAX_CONCURRENCY,
+                           file_batch_size=INGEST_FILE_BATCH_SIZE, chunk_batch_size=INGEST_CHUNK_BATCH_SIZE,
+                           progress=_no_progress, check_cancelled=_not_cancelled,
+                           embeddings=None, metadata_llm=None):
+    """
+    Ingesta incremental y en streaming: solo se cargan, describen (LLM) y embeben los
+    ficheros nuevos o modificados según el manifiesto de hashes, y los chunks fluyen en
+    lotes de tamaño fijo (load → split → metadata → embed → upsert). Cada lote confirmado
+    se registra en el manifiesto, de modo que una ingesta interrumpida se reanuda donde se
+    quedó. Los chunks de ficheros eliminados, y los que desaparecen de los modificados,
+    se borran del vector store. Los chunks casi duplicados (MinHash/LSH, ver dedup.py)
+    se guardan como alias de un chunk canónico en lugar de describirse y embeberse otra
+    vez. Los metadatos de documento y de chunk se guardan en el
+    store SQLite de la versión (metadata.sqlite), que sirve /metadata, y el texto de los
+    documentos en su doc store: el vector store solo guarda vectores y offsets.
+    Con incremental=False se vacía la colección y se re-ingiere todo.
+    max_concurrency limita las llamadas al LLM de metadatos en vuelo.
+    progress(etapa, n) recibe los contadores por etapa; check_cancelled() se llama entre
+    lotes y antes de cada llamada al LLM de metadatos, y puede lanzar una excepción
+    para detener la ingesta (el checkpoint se conserva). Si los stores del directorio
+    no se pueden abrir se lanza StoreLoadError.
+    embeddings y metadata_llm permiten sustituir los modelos por defecto (p. ej. en benchmarks).
+    """
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    embeddings = embeddings or get_embeddings_model()
+    meta_store_path = os.path.join(persist_dir, METADATA_DB_FILE)
+    backfill = incremental and not os.path.exists(meta_store_path)
+    vectordb = meta_store = doc_store = None
+    try:
+        vectordb = open_chroma_store(embeddings, persist_dir)
+        meta_store = MetadataStore(meta_store_path)
+        doc_store = DocStore(persist_dir)
+        dedup = DedupIndex(persist_dir) if DEDUP_ENABLED else None
+    except Exception as e:
+        for store in (meta_store, doc_store):
+            if store is not None:
+                store.close()
+        if vectordb is not None:
+            close_store(vectordb)
+        raise StoreLoadError(f"No se pudo abrir el store de {persist_dir}: {e}") from e
+
+    try:
+        if incremental:
+            manifest = load_manifest(manifest_path)
+        else:
+            vectordb.reset_collection()
+            meta_store.reset()
+            doc_store.reset()
+            if dedup is not None:
+                dedup.reset()
+            manifest = new_manifest()
+
+        if backfill and manifest["files"]:
+            # Stores anteriores al store de metadatos: se rellena con los metadatos de
+            # documento del manifiesto (los de chunk no se guardaban).
+            for source, entry in manifest["files"].items():
+                meta_store.replace_file(source, entry["metadata"], [], [])
+
+        current_hashes = {path: file_hash(path) for path in list_files(data_path)}
+        changed, removed = diff_manifest(manifest, current_hashes)
+        console.log(
+            f"Ficheros: {len(current_hashes)} en total, {len(changed)} nuevos/modificados, "
+            f"{len(removed)} eliminados."
+        )
+
+        # Purga de los ficheros eliminados y de checkpoints que ya no corresponden a ningún cambio
+        for source in removed:
+            entry = manifest["files"].pop(source)
+            meta_store.delete_file(source)
+            _delete_chunks(vectordb, doc_store, meta_store, dedup, manifest, entry["chunk_ids"])
+            doc_store.remove(entry.get("doc_ids", []))
+        for source in list(manifest["pending"]):
+            if source not in changed:
+                live = manifest["files"].get(source, {})
+                entry = manifest["pending"].pop(source)
+                _delete_chunks(vectordb, doc_store, meta_store, dedup, manifest,
+                               set(entry["chunk_ids"]) - set(live.get("chunk_ids", [])))
+                doc_store.remove(set(entry.get("doc_ids", [])) - set(live.get("doc_ids", [])))
+        if dedup is not None:
+            # El índice se guarda antes que el manifiesto: tras una interrupción puede tener
+            # canónicos de un lote que el manifiesto no llegó a registrar.
+            dedup.retain({cid for entries in (manifest["files"], manifest["pending"])
+                          for entry in entries.values() for cid in entry["chunk_ids"]})
+            dedup.flush()
+        save_manifest(manifest, manifest_path)
+
+        chunks_upserted = 0
+        stream = _iter_described_chunks(changed, current_hashes, manifest, vectordb, doc_store, meta_store, dedup,
+                                        max_concurrency, file_batch_size, progress, check_cancelled, metadata_llm)
+        for batch in batched(stream, chunk_batch_size):
+            check_cancelled()
+            committed = _commit_batch(vectordb, doc_store, meta_store, dedup, manifest, batch)
+            chunks_upserted += committed
+            progress("vectors_upserted", committed)
+            if dedup is not None:
+                dedup.flush()
+            save_manifest(manifest, manifest_path)
+
+        if dedup is not None:
+            dedup.flush()
+        save_manifest(manifest, manifest_path)
+
+        save_inverted_index(build_inverted_index(manifest), persist_dir)
+
+        summary = {
+            "files_updated": len(changed),
+            "files_removed": len(removed),
+            "chunks_upserted": chunks_upserted,
+            "chunks_deduplicated": dedup.aliased if dedup is not None else 0,
+        }
+        return vectordb, summary
+    except BaseException:
+        # Si la ingesta no termina, nadie recibe el vector store: se cierra aquí.
+        close_store(vectordb)
+        raise
+    finally:
+        meta_store.close()
+        doc_store.close()
+        if dedup is not None:
+            dedup.close()
+
+
+def run_versioned_ingestion(stores_root=STORES_ROOT, incremental=True, **kwargs):
+    """
+    Ingesta sobre un directorio de versión nuevo en lugar del store que se está
+    sirviendo: se parte de una copia de la versión actual, se aplica la ingesta
+    incremental y, al terminar, se publica la nueva versión. Si no hay cambios
+    no se crea versión nueva. El resumen incluye la versión resultante.
+    Mientras dura se mantiene el lock de construcción del directorio de stores
+    (BuildInProgress si otra ingesta lo tiene).
+    """
+    with build_lock(stores_root):
+        for attempt in range(2):
+            name, build_dir = prepare_build(stores_root, incremental)
+            try:
+                vectordb, summary = run_ingestion_pipeline(persist_dir=build_dir, incremental=incremental, **kwargs)
+                break
+            except StoreLoadError as e:
+                # Reanudarla fallaría igual cada vez: se descarta y se prueba con una construcción nueva.
+                discard_build(name, stores_root)
+                if attempt:
+                    raise
+                console.log(f"[red]Construcción {name} dañada ({e}); se descarta.[/red]")
+
+        base = current_version(stores_root)
+        if incremental and base is not None and not summary["files_updated"] and not summary["files_removed"]:
+            # Sus ficheros se cierran antes de borrar la construcción.
+            close_store(vectordb)
+            discard_build(name, stores_root)
+            console.log("Sin cambios en los documentos: se mantiene la versión actual.")
+            return vectordb, {**summary, "version": base, "published": False}
+
+        publish_version(name, stores_root)
+        return vectordb, {**summary, "version": name, "published": True}
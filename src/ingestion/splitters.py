@@ -2,7 +2,22 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 def split_docs(docs, chunk_size=1000, chunk_overlap=100):
     # Split documents into chunks using RecursiveCharacterTextSplitter to preserve hierarchy.
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    # start_index permite reconocer después los chunks solapados o contiguos de un mismo documento.
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
     chunks = splitter.split_documents(docs)
-    # console.log(f"Split into {len(chunks)} chunks.")
-    return chunks
\ No newline at end of file
+    # console.log(f"Split into {len(chunks)} chunks.")
+    return chunks
+
+def split_offsets(text, chunk_size=1000, chunk_overlap=100):
+    """
+    Como split_docs para un único texto, pero sin crear un Document por chunk:
+    devuelve (start_index, texto_del_chunk) con el mismo cálculo de start_index.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    spans = []
+    index, previous_len = 0, 0
+    for chunk in splitter.split_text(text):
+        index = text.find(chunk, max(0, index + previous_len - chunk_overlap))
+        spans.append((index, chunk))
+        previous_len = len(chunk)
+    return spans
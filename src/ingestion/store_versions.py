@@ -0,0 +1,160 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from rich.console import Console
+
+console = Console()
+
+STORES_ROOT = os.environ.get("VECTOR_STORES_DIR", "stores")
+KEEP_VERSIONS = int(os.environ.get("VECTOR_STORES_KEEP", "2"))
+
+CURRENT_FILE = "CURRENT"
+BUILDING_FILE = "BUILDING"
+BUILD_LOCK_FILE = "BUILD.lock"
+# ioctl de Linux que clona un fichero compartiendo sus bloques (copy-on-write).
+_FICLONE = 0x40049409
+
+
+class BuildInProgress(Exception):
+    """Otra ingesta (de este u otro proceso) está construyendo una versión sobre el mismo directorio."""
+
+
+def version_dir(name, root=STORES_ROOT):
+    return os.path.join(root, name)
+
+
+def current_version(root=STORES_ROOT):
+    """Nombre de la versión publicada actualmente, o None si aún no hay ninguna."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _building_versions(root):
+    if not os.path.isdir(root):
+        return []
+    return [
+        name for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, BUILDING_FILE))
+    ]
+
+
+@contextlib.contextmanager
+def build_lock(root=STORES_ROOT):
+    """
+    Lock exclusivo (flock) sobre el directorio de stores durante toda la construcción
+    y la publicación de una versión: con varios workers de uvicorn, o una ingesta
+    lanzada a mano, solo uno construye a la vez. Si está tomado lanza BuildInProgress.
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, BUILD_LOCK_FILE), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BuildInProgress(f"Ya hay una ingesta en curso sobre {root}.") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_in_progress(root=STORES_ROOT):
+    """Indica si otra ingesta tiene ahora el lock de construcción (comprobación sin esperar)."""
+    try:
+        with build_lock(root):
+            return False
+    except BuildInProgress:
+        return True
+
+
+def _clone_file(src, dst):
+    """
+    Copia un fichero con reflink si el sistema de ficheros lo permite (btrfs, XFS,
+    APFS...): coste casi constante y sin duplicar bloques hasta que se modifican.
+    Si no, copia normal. No se usan hard links: los stores se modifican en sitio
+    (SQLite, HNSW) o por append, y eso alteraría la versión publicada.
+    """
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except OSError:
+        return shutil.copy2(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def prepare_build(root=STORES_ROOT, incremental=True):
+    """
+    Prepara el directorio donde se construirá la siguiente versión del store.
+
+    En modo incremental parte de una copia de la versión publicada (los stores
+    publicados no se modifican nunca). La copia es por reflink cuando el sistema de
+    ficheros lo admite; si no, cuesta lo mismo que copiar la versión entera (vectores
+    y textos incluidos) y crece con el corpus aunque cambie un solo fichero: se registra
+    su duración y el benchmark la mide aparte (prepare_build). Si hay una construcción interrumpida que
+    partía de la misma base y modo, se reutiliza para reanudarla desde su checkpoint.
+    Devuelve (nombre, directorio).
+    """
+    base = current_version(root) if incremental else None
+    for name in _building_versions(root):
+        with open(os.path.join(root, name, BUILDING_FILE), "r") as f:
+            marker = json.load(f)
+        if marker.get("base") == base and marker.get("incremental") == incremental:
+            console.log(f"Reanudando la construcción interrumpida de la versión {name}.")
+            return name, version_dir(name, root)
+        shutil.rmtree(version_dir(name, root), ignore_errors=True)
+
+    # Nombres ordenables cronológicamente (hasta el microsegundo).
+    name = f"v{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+    path = version_dir(name, root)
+    if base is not None:
+        start = time.perf_counter()
+        shutil.copytree(version_dir(base, root), path, copy_function=_clone_file)
+        console.log(f"Versión {base} copiada para la construcción en {time.perf_counter() - start:.2f}s.")
+    else:
+        os.makedirs(path)
+    with open(os.path.join(path, BUILDING_FILE), "w") as f:
+        json.dump({"base": base, "incremental": incremental}, f)
+    return name, path
+
+
+def discard_build(name, root=STORES_ROOT):
+    shutil.rmtree(version_dir(name, root), ignore_errors=True)
+
+
+def publish_version(name, root=STORES_ROOT):
+    """Publica una versión terminada: el puntero CURRENT se reemplaza de forma atómica."""
+    os.remove(os.path.join(root, name, BUILDING_FILE))
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(name)
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    console.log(f"[green]Versión {name} del vector store publicada.[/green]")
+
+
+def gc_versions(root=STORES_ROOT, keep=KEEP_VERSIONS, in_use=()):
+    """
+    Borra las versiones publicadas más antiguas, conservando las `keep` más recientes,
+    la actual y las que sigan en uso. Las construcciones en curso no se tocan.
+    """
+    if not os.path.isdir(root):
+        return []
+    current = current_version(root)
+    building = set(_building_versions(root))
+    published = sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)) and name not in building
+    )
+    protected = set(published[-keep:]) | {current} | set(in_use)
+    removed = [name for name in published if name not in protected]
+    for name in removed:
+        shutil.rmtree(version_dir(name, root), ignore_errors=True)
+    if removed:
+        console.log(f"Versiones antiguas eliminadas: {', '.join(removed)}")
+    return removed
@@ -1,11 +1,11 @@
 from langchain_community.document_loaders import DirectoryLoader, TextLoader, PyPDFLoader
 from langchain_groq import ChatGroq
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.prompts import PromptTemplate
 from langchain_community.llms import Ollama
 from pydantic import BaseModel
+from src.ingestion.embeddings import get_embeddings_model
 import json
 from rich.console import Console
 import os
@@ -36,7 +36,7 @@ def split_docs(docs, chunk_size=1000, chunk_overlap=100):
 
 def store_in_chroma(chunks, persist_dir="chroma_db"):
     # Generate embeddings for each chunk and store in ChromaDB.
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    embeddings = get_embeddings_model()
     vectordb = Chroma.from_documents(chunks, embedding=embeddings, persist_directory=persist_dir)
     console.log("Embeddings stored in ChromaDB.")
     return vectordb
@@ -1,19 +1,76 @@
-from langchain_community.vectorstores import Chroma
-from langchain_chroma import Chroma
+from .embeddings import get_embeddings_model
+from .numpy_store import NumpyVectorStore
 import os
 
+# "chroma" o "numpy" (índice en proceso sobre una matriz en memmap, ver numpy_store).
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "chroma").lower()
 
-def store_in_chroma(chunks, embeddings, persist_dir="chroma_db"):
+
+def get_store_class(backend=VECTOR_STORE_BACKEND):
+    if backend == "numpy":
+        return NumpyVectorStore
+    if backend == "chroma":
+        # Import diferido: chromadb solo se carga si se usa este backend.
+        from langchain_chroma import Chroma
+        return Chroma
+    raise ValueError(f"Backend de vector store desconocido: {backend} (usa 'chroma' o 'numpy').")
+
+
+def store_in_chroma(chunks, embeddings, persist_dir="chroma_db", ids=None):
     # console.log(f"[yellow]First chunk metadata:[/yellow] {chunks[0].metadata}")
     # Generate embeddings for each chunk and store in ChromaDB.
-    vectordb = Chroma.from_documents(chunks, embedding=embeddings, persist_directory=persist_dir)
+    vectordb = get_store_class().from_documents(chunks, embedding=embeddings, persist_directory=persist_dir, ids=ids)
     # console.log("Embeddings stored in ChromaDB.")
     return vectordb
 
 
-def load_chroma_store(persist_path: str):
+def open_chroma_store(embeddings, persist_dir="chroma_db"):
+    """
+    Abre (o crea si no existe) el vector store persistido, listo para
+    upserts y borrados incrementales.
+    """
+    return get_store_class()(persist_directory=persist_dir, embedding_function=embeddings)
+
+
+def upsert_chunk_refs(vectordb, texts, metadatas, ids):
+    """
+    Upsert de chunks por referencia: se embeben sus textos (materializados del
+    DocStore) pero en el vector store solo se guardan el vector y los metadatos
+    con la referencia (doc_id, start, end); el texto no se duplica.
+    """
+    if not ids:
+        return
+    vectors = vectordb.embeddings.embed_documents(texts)
+    stored = [""] * len(ids)
+    if isinstance(vectordb, NumpyVectorStore):
+        vectordb.add_vectors(vectors, stored, metadatas, ids)
+    else:
+        vectordb._collection.upsert(ids=ids, embeddings=vectors, metadatas=metadatas, documents=stored)
+
+
+def delete_chunks(vectordb, ids):
+    if ids:
+        vectordb.delete(ids=list(ids))
+
+
+def close_store(vectordb):
+    """
+    Libera los ficheros que tiene abiertos un vector store: el memmap del store
+    NumPy o el sistema compartido de Chroma de ese directorio (SQLite y HNSW).
+    """
+    if isinstance(vectordb, NumpyVectorStore):
+        vectordb.close()
+        return
+    from chromadb.api.shared_system_client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(vectordb._client._identifier, None)
+    if system is not None:
+        system.stop()
+
+
+def load_chroma_store(persist_path: str, embeddings=None):
     """
     Carga un vector store de Chroma previamente persistido.
+    Las consultas se embeben con el mismo modelo (y caché) que la ingesta.
     """
-    vectordb = Chroma(persist_directory=persist_path)
-    return vectordb
\ No newline at end of file
+    vectordb = get_store_class()(persist_directory=persist_path, embedding_function=embeddings or get_embeddings_model())
+    return vectordb
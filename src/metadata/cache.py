@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.observability.metrics import record_cache
+
+METADATA_CACHE_PATH = os.environ.get("METADATA_CACHE_PATH", os.path.join("cache", "metadata_cache.sqlite"))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", "50000"))
+
+
+def normalize_text(text):
+    # Los cambios de espacios en blanco no cambian la respuesta esperada del LLM.
+    return " ".join(text.split())
+
+
+def model_name_of(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def cache_key(text, prompt_template, model_name, schema=None):
+    """Clave de caché: hash de (texto normalizado, plantilla del prompt, modelo, esquema de salida)."""
+    payload = json.dumps(
+        [normalize_text(text), prompt_template, model_name, schema],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MetadataCache:
+    """
+    Caché persistente (SQLite) de respuestas del LLM de metadatos, con
+    expulsión LRU cuando se supera max_entries y contadores de aciertos/fallos.
+    """
+
+    def __init__(self, path=METADATA_CACHE_PATH, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            record_cache("metadata", row is not None)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO entries (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            if cursor.rowcount:
+                self._size += 1
+            else:
+                self._conn.execute(
+                    "UPDATE entries SET value = ?, last_access = ? WHERE key = ?",
+                    (value, time.time(), key),
+                )
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Se expulsa un 10% extra para no pagar un DELETE en cada inserción.
+        excess = self._size - self.max_entries + max(1, self.max_entries // 10)
+        self._conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    """Devuelve la caché de metadatos compartida del proceso."""
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = MetadataCache()
+    return _metadata_cache
@@ -1,12 +1,66 @@
+import asyncio
+import json
+import os
+from pydantic import ValidationError
 from rich.console import Console
-from src.prompts.metadata_prompt import METADATA_PROMPT
+from src.prompts.metadata_prompt import METADATA_PROMPT, METADATA_REDUCE_PROMPT
+from src.metadata.cache import cache_key, get_metadata_cache, model_name_of
+from src.metadata.schema import DocumentMetadata, parse_metadata
+from src.observability.metrics import llm_callbacks
+from src.service.llm_gateway import groq_chat_model
 
 console = Console()
 
+METADATA_MODEL = "llama-3.1-8b-instant"
+METADATA_MAX_CONCURRENCY = int(os.environ.get("METADATA_MAX_CONCURRENCY", "8"))
+# Tokens (estimados) de texto por llamada al LLM de metadatos. Los documentos más
+# largos se trocean en secciones de este tamaño (map) y sus metadatos se fusionan (reduce).
+METADATA_SECTION_TOKEN_BUDGET = int(os.environ.get("METADATA_SECTION_TOKEN_BUDGET", "6000"))
+METADATA_SECTION_OVERLAP = 200
+# Misma aproximación de ~4 caracteres por token que context_builder.
+_CHARS_PER_TOKEN = 4
+# Esquema de salida de todas las llamadas (map, reduce y documento completo): forma
+# parte de la clave de caché, así que cambiar DocumentMetadata invalida las entradas.
+METADATA_SCHEMA = json.dumps(DocumentMetadata.model_json_schema(), sort_keys=True)
+
+_metadata_llm = None
+
+
+class _CancellableSemaphore(asyncio.Semaphore):
+    """
+    Semáforo de las llamadas al LLM que llama a check_cancelled() antes de esperar
+    hueco y al conseguirlo: una cancelación (check_cancelled lanza) detiene el lote
+    en curso sin esperar a que terminen todas sus llamadas.
+    """
+
+    def __init__(self, value, check_cancelled):
+        super().__init__(value)
+        self._check_cancelled = check_cancelled
+
+    async def acquire(self):
+        self._check_cancelled()
+        await super().acquire()
+        try:
+            self._check_cancelled()
+        except BaseException:
+            self.release()
+            raise
+        return True
+
+def get_metadata_llm():
+    """
+    Devuelve el cliente LLM compartido para la generación de metadatos (se crea una
+    sola vez). Sus peticiones van al gateway con prioridad "bulk", detrás del chat.
+    """
+    global _metadata_llm
+    if _metadata_llm is None:
+        _metadata_llm = groq_chat_model(METADATA_MODEL, priority="bulk")
+    return _metadata_llm
+
 def generate_metadata(text, llm):
     chain = METADATA_PROMPT | llm
     result = chain.invoke({"text": text})
-    
+
     if hasattr(result, "content"):
         result = result.content
 
@@ -16,4 +70,155 @@ def generate_metadata(text, llm):
         return result
     except Exception as e:
         console.log(f"[red]Failed to parse metadata:[/red] {e}")
-        return None
\ No newline at end of file
+        return None
+
+def validate_metadata(raw):
+    """Metadatos como DocumentMetadata, o None si la salida del LLM no cumple el esquema."""
+    data = parse_metadata(raw)
+    for field in ("topics", "entities"):
+        if isinstance(data.get(field), str):
+            data[field] = [data[field]]
+    try:
+        return DocumentMetadata(**{field: data.get(field) for field in DocumentMetadata.model_fields})
+    except ValidationError:
+        return None
+
+
+def split_sections(text, token_budget=METADATA_SECTION_TOKEN_BUDGET):
+    """Secciones consecutivas de un documento que caben en una llamada al LLM de metadatos."""
+    size = token_budget * _CHARS_PER_TOKEN
+    if len(text) <= size:
+        return [text]
+    # Import diferido: langchain_text_splitters carga transformers, que el servidor no necesita.
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=METADATA_SECTION_OVERLAP)
+    return splitter.split_text(text)
+
+
+def _merge_metadata(partials):
+    """Fusión sin LLM (si falla el reduce): primer título, resúmenes concatenados y uniones sin duplicados."""
+    return DocumentMetadata(
+        title=partials[0].title,
+        summary=" ".join(p.summary for p in partials[:3]),
+        topics=list(dict.fromkeys(t for p in partials for t in p.topics)),
+        entities=list(dict.fromkeys(e for p in partials for e in p.entities)),
+    )
+
+
+async def _areduce_metadata(partials, llm, semaphore, cache, token_budget):
+    """
+    Fusiona metadatos parciales en uno. Si no caben en una llamada se fusionan
+    por grupos, en paralelo, y después los resultados (reduce en árbol).
+    """
+    groups, group, used = [], [], 0
+    for partial in partials:
+        size = len(partial.model_dump_json()) // _CHARS_PER_TOKEN + 1
+        if group and used + size > token_budget:
+            groups.append(group)
+            group, used = [], 0
+        group.append(partial)
+        used += size
+    groups.append(group)
+    if len(groups) > 1 and all(len(g) == 1 for g in groups):
+        # Cada parcial llena el presupuesto por sí solo: no se puede reducir más con el LLM.
+        return _merge_metadata(partials)
+
+    async def reduce_group(group):
+        if len(group) == 1:
+            return group[0]
+        text = json.dumps([p.model_dump() for p in group], ensure_ascii=False, indent=1)
+        raw = await agenerate_metadata(text, llm, semaphore, cache, prompt=METADATA_REDUCE_PROMPT,
+                                       component="metadata_reduce", schema=METADATA_SCHEMA)
+        return validate_metadata(raw) or _merge_metadata(group)
+
+    reduced = await asyncio.gather(*(reduce_group(g) for g in groups))
+    if len(reduced) == 1:
+        return reduced[0]
+    return await _areduce_metadata(reduced, llm, semaphore, cache, token_budget)
+
+
+async def agenerate_document_metadata(text, llm, semaphore, cache=None, token_budget=METADATA_SECTION_TOKEN_BUDGET):
+    """
+    Metadatos de un documento completo. Si cabe en una llamada se genera en una
+    sola (devuelve la salida del LLM); si no, map-reduce: metadatos parciales de
+    cada sección en paralelo, fusionados en un DocumentMetadata validado (como
+    JSON). La latencia depende de la profundidad del reduce, no de la longitud.
+    """
+    sections = split_sections(text, token_budget)
+    if len(sections) == 1:
+        return await agenerate_metadata(text, llm, semaphore, cache)
+
+    raw_partials = await agenerate_metadata_batch(sections, llm, semaphore, cache)
+    partials = [p for p in map(validate_metadata, raw_partials) if p is not None]
+    if not partials:
+        console.log(f"[red]Sin metadatos válidos para ninguna de las {len(sections)} secciones del documento.[/red]")
+        return None
+    metadata = await _areduce_metadata(partials, llm, semaphore, cache, token_budget)
+    return metadata.model_dump_json()
+
+
+async def agenerate_metadata(text, llm, semaphore, cache=None, prompt=METADATA_PROMPT, component="metadata",
+                             schema=METADATA_SCHEMA):
+    """
+    Versión asíncrona de generate_metadata. Consulta primero la caché (si se
+    pasa); el semáforo limita las peticiones en vuelo y un fallo solo degrada
+    este elemento (devuelve None). La caché es SQLite síncrono: se consulta y
+    se escribe en un hilo para no bloquear el event loop.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(text, prompt.template, model_name_of(llm), schema=schema)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
+
+    chain = prompt | llm
+    async with semaphore:
+        try:
+            result = await chain.ainvoke({"text": text}, config={"callbacks": llm_callbacks(component)})
+        except Exception as e:
+            console.log(f"[red]Failed to generate metadata:[/red] {e}")
+            return None
+
+    if hasattr(result, "content"):
+        result = result.content
+    if cache is not None and result:
+        await asyncio.to_thread(cache.put, key, result)
+    return result
+
+async def agenerate_metadata_batch(texts, llm, semaphore, cache=None):
+    # gather conserva el orden de entrada.
+    return await asyncio.gather(*(agenerate_metadata(text, llm, semaphore, cache) for text in texts))
+
+async def agenerate_document_and_chunk_metadata(doc_texts, chunk_texts, llm=None, max_concurrency=METADATA_MAX_CONCURRENCY,
+                                                use_cache=True, check_cancelled=None):
+    """
+    Lanza a la vez la pasada por documento y la pasada por chunk, compartiendo
+    cliente, caché y límite de concurrencia. Los documentos que no caben en una
+    llamada se procesan con map-reduce. Devuelve (metadatos_docs, metadatos_chunks).
+    check_cancelled() se comprueba antes de cada llamada al LLM; su excepción se propaga.
+    """
+    llm = llm or get_metadata_llm()
+    cache = get_metadata_cache() if use_cache else None
+    if check_cancelled is None:
+        semaphore = asyncio.Semaphore(max_concurrency)
+    else:
+        semaphore = _CancellableSemaphore(max_concurrency, check_cancelled)
+    doc_results, chunk_results = await asyncio.gather(
+        asyncio.gather(*(agenerate_document_metadata(text, llm, semaphore, cache) for text in doc_texts)),
+        agenerate_metadata_batch(chunk_texts, llm, semaphore, cache),
+    )
+    console.log(
+        f"[blue]Metadatos generados:[/blue] {len(doc_results)} documentos, {len(chunk_results)} chunks "
+        f"({sum(r is None for r in doc_results + chunk_results)} fallidos)."
+    )
+    if cache is not None:
+        console.log(f"[blue]Caché de metadatos:[/blue] {cache.stats()}")
+    return doc_results, chunk_results
+
+def generate_document_and_chunk_metadata(doc_texts, chunk_texts, llm=None, max_concurrency=METADATA_MAX_CONCURRENCY,
+                                         use_cache=True, check_cancelled=None):
+    """Envoltorio síncrono de agenerate_document_and_chunk_metadata."""
+    return asyncio.run(
+        agenerate_document_and_chunk_metadata(doc_texts, chunk_texts, llm, max_concurrency, use_cache, check_cancelled)
+    )
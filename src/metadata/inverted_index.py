@@ -0,0 +1,121 @@
+# src/metadata/inverted_index.py
+import json
+import os
+import re
+import unicodedata
+
+from rich.console import Console
+from src.metadata.schema import parse_metadata
+
+console = Console()
+
+ENTITY_INDEX_FILE = "entity_index.json"
+# Un término presente en más de esta fracción de los documentos no discrimina y se ignora.
+ENTITY_INDEX_MAX_FRACTION = float(os.environ.get("ENTITY_INDEX_MAX_FRACTION", "0.5"))
+
+# Sufijos societarios que el LLM incluye o no según el texto ("Global Infrastructure Ltd.").
+_LEGAL_SUFFIXES = {"ltd", "inc", "llc", "corp", "co", "sa", "sl", "gmbh", "plc"}
+_NON_WORD_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_term(term):
+    """Minúsculas, sin acentos ni puntuación y sin sufijos societarios finales."""
+    text = unicodedata.normalize("NFKD", str(term))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    words = _NON_WORD_RE.sub(" ", text.replace(".", "")).split()
+    while len(words) > 1 and words[-1] in _LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def metadata_terms(raw_metadata):
+    """Términos normalizados (entidades y temas) de una salida del LLM de metadatos."""
+    metadata = parse_metadata(raw_metadata)
+    terms = set()
+    for key in ("entities", "topics"):
+        values = metadata.get(key) or []
+        if isinstance(values, str):
+            values = [values]
+        for value in values:
+            term = normalize_term(value)
+            if len(term) >= 3:
+                terms.add(term)
+    return terms
+
+
+def build_inverted_index(manifest):
+    """
+    Índice término -> documentos y chunks a partir del manifiesto: los términos de los
+    metadatos de un documento apuntan a todos sus chunks; los de los metadatos de un
+    chunk (chunk_terms), solo a ese chunk.
+    """
+    terms = {}
+    for source, entry in manifest["files"].items():
+        doc_terms = set()
+        for metadata in entry.get("metadata", []):
+            doc_terms |= metadata_terms(metadata)
+        for term in doc_terms:
+            postings = terms.setdefault(term, {"sources": set(), "chunks": set()})
+            postings["sources"].add(source)
+            postings["chunks"].update(entry["chunk_ids"])
+        for term, chunk_ids in entry.get("chunk_terms", {}).items():
+            postings = terms.setdefault(term, {"sources": set(), "chunks": set()})
+            postings["sources"].add(source)
+            postings["chunks"].update(chunk_ids)
+    return {
+        "documents": len(manifest["files"]),
+        "terms": {
+            term: {"sources": sorted(p["sources"]), "chunks": sorted(p["chunks"])}
+            for term, p in sorted(terms.items())
+        },
+    }
+
+
+def save_inverted_index(index, persist_dir):
+    path = os.path.join(persist_dir, ENTITY_INDEX_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    console.log(f"Índice de entidades y temas: {len(index['terms'])} términos.")
+
+
+class EntityIndex:
+    """Resuelve qué documentos menciona una consulta, para restringir la búsqueda vectorial a ellos."""
+
+    def __init__(self, index, max_fraction=ENTITY_INDEX_MAX_FRACTION):
+        documents = index.get("documents", 0)
+        limit = max(1, int(documents * max_fraction))
+        # Solo se conservan los términos selectivos.
+        self.terms = {
+            term: postings for term, postings in index.get("terms", {}).items()
+            if len(postings["sources"]) <= limit
+        }
+        self.max_words = max((len(term.split()) for term in self.terms), default=0)
+
+    @classmethod
+    def load(cls, persist_dir):
+        """Carga el índice de una versión del store; si no existe (stores antiguos) queda vacío."""
+        try:
+            with open(os.path.join(persist_dir, ENTITY_INDEX_FILE), "r") as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls({})
+
+    def match_terms(self, query):
+        """Términos del índice que aparecen en la consulta (n-gramas de palabras normalizadas)."""
+        words = normalize_term(query).split()
+        found = []
+        for n in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                ngram = " ".join(words[start:start + n])
+                if ngram in self.terms:
+                    found.append(ngram)
+        return found
+
+    def candidate_sources(self, query):
+        """Documentos asociados a los términos de la consulta, o None si no nombra ninguno conocido."""
+        sources = set()
+        for term in self.match_terms(query):
+            sources.update(self.terms[term]["sources"])
+        return sorted(sources) or None
@@ -0,0 +1,270 @@
+# src/metadata/metadata_store.py
+import functools
+import json
+import os
+
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    delete,
+    func,
+    inspect,
+    insert,
+    select,
+    update,
+)
+from src.metadata.schema import parse_metadata
+from src.metadata.inverted_index import normalize_term
+
+METADATA_DB_FILE = "metadata.sqlite"
+METADATA_MAX_PAGE_SIZE = 500
+
+_schema = MetaData()
+
+documents = Table(
+    "documents", _schema,
+    Column("id", Integer, primary_key=True),
+    Column("source", String, nullable=False),
+    Column("doc_index", Integer, nullable=False),
+    Column("title", Text),
+    Column("title_norm", Text),
+    Column("summary", Text),
+    Column("topics", Text),
+    Column("entities", Text),
+    Column("raw", Text),
+    Index("idx_documents_source", "source"),
+    Index("idx_documents_title", "title_norm"),
+)
+
+chunks = Table(
+    "chunks", _schema,
+    Column("chunk_id", String, primary_key=True),
+    Column("source", String, nullable=False),
+    Column("chunk_index", Integer, nullable=False),
+    Column("title", Text),
+    Column("title_norm", Text),
+    Column("summary", Text),
+    Column("topics", Text),
+    Column("entities", Text),
+    Column("raw", Text),
+    Index("idx_chunks_source", "source"),
+    Index("idx_chunks_title", "title_norm"),
+)
+
+# Una fila por (término, documento o chunk). chunk_id es NULL en los términos de documento.
+entities = Table(
+    "entities", _schema,
+    Column("term", String, nullable=False),
+    Column("kind", String, nullable=False),
+    Column("source", String, nullable=False),
+    Column("chunk_id", String),
+    Index("idx_entities_term", "term", "kind"),
+    Index("idx_entities_source", "source"),
+)
+
+# Chunks casi duplicados de otro (el canónico, el único que está en el vector store).
+# Se guarda su referencia en el doc store para poder promoverlos si el canónico desaparece.
+chunk_aliases = Table(
+    "chunk_aliases", _schema,
+    Column("chunk_id", String, primary_key=True),
+    Column("canonical_id", String, nullable=False),
+    Column("source", String, nullable=False),
+    Column("doc_id", String, nullable=False),
+    Column("start", Integer, nullable=False),
+    Column("end", Integer, nullable=False),
+    Column("start_index", Integer, nullable=False),
+    Index("idx_chunk_aliases_canonical", "canonical_id"),
+    Index("idx_chunk_aliases_source", "source"),
+)
+
+LEVELS = {"document": documents, "chunk": chunks}
+FIELDS = {
+    "document": ("source", "doc_index", "title", "summary", "topics", "entities"),
+    "chunk": ("chunk_id", "source", "chunk_index", "title", "summary", "topics", "entities"),
+}
+_JSON_FIELDS = {"topics", "entities"}
+
+
+def _as_list(value):
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value] if isinstance(value, list) else []
+
+
+def _row(raw):
+    """Columnas de una fila a partir de la salida del LLM de metadatos."""
+    metadata = parse_metadata(raw)
+    title = metadata.get("title")
+    title = str(title) if title else None
+    topics, found_entities = _as_list(metadata.get("topics")), _as_list(metadata.get("entities"))
+    row = {
+        "title": title,
+        "title_norm": normalize_term(title) if title else None,
+        "summary": str(metadata["summary"]) if metadata.get("summary") else None,
+        "topics": json.dumps(topics, ensure_ascii=False),
+        "entities": json.dumps(found_entities, ensure_ascii=False),
+        "raw": raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False),
+    }
+    terms = [("entity", normalize_term(v)) for v in found_entities] + [("topic", normalize_term(v)) for v in topics]
+    return row, {(kind, term) for kind, term in terms if term}
+
+
+class MetadataStore:
+    """
+    Metadatos de documentos y chunks en SQLite, con índices por fuente, título y
+    entidad/tema, para consultas paginadas y filtradas que no dependen del tamaño
+    del corpus. Vive en cada versión del store, junto al vector store.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.engine = create_engine(f"sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true")
+            # Los stores anteriores a la deduplicación no tienen tabla de alias.
+            self.has_aliases = inspect(self.engine).has_table("chunk_aliases")
+        else:
+            self.has_aliases = True
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.engine = create_engine(f"sqlite:///{path}")
+            _schema.create_all(self.engine)
+
+    def close(self):
+        """Cierra las conexiones abiertas; el engine las reabre si se vuelve a consultar."""
+        self.engine.dispose()
+
+    def reset(self):
+        with self.engine.begin() as conn:
+            for table in (documents, chunks, entities, chunk_aliases):
+                conn.execute(delete(table))
+
+    def delete_file(self, source):
+        with self.engine.begin() as conn:
+            self._delete_file(conn, source)
+
+    @staticmethod
+    def _delete_file(conn, source):
+        for table in (documents, chunks, entities, chunk_aliases):
+            conn.execute(delete(table).where(table.c.source == source))
+
+    def replace_file(self, source, doc_metadata, chunk_ids, chunk_metadata, aliases=()):
+        """
+        Sustituye, en una transacción, los metadatos de documento y de chunk de un fichero
+        y sus alias: (chunk_id, canonical_id, doc_id, start, end, start_index).
+        """
+        doc_rows, chunk_rows, entity_rows = [], [], set()
+        for i, raw in enumerate(doc_metadata):
+            row, terms = _row(raw)
+            doc_rows.append({**row, "source": source, "doc_index": i})
+            entity_rows.update((term, kind, source, None) for kind, term in terms)
+        for i, (cid, raw) in enumerate(zip(chunk_ids, chunk_metadata)):
+            row, terms = _row(raw)
+            chunk_rows.append({**row, "chunk_id": cid, "source": source, "chunk_index": i})
+            entity_rows.update((term, kind, source, cid) for kind, term in terms)
+
+        with self.engine.begin() as conn:
+            self._delete_file(conn, source)
+            if doc_rows:
+                conn.execute(insert(documents), doc_rows)
+            if chunk_rows:
+                conn.execute(insert(chunks), chunk_rows)
+            if entity_rows:
+                conn.execute(insert(entities), [
+                    {"term": term, "kind": kind, "source": src, "chunk_id": cid}
+                    for term, kind, src, cid in entity_rows
+                ])
+            if aliases:
+                conn.execute(insert(chunk_aliases), [
+                    {"chunk_id": cid, "canonical_id": canonical, "source": source, "doc_id": doc_id,
+                     "start": start, "end": end, "start_index": start_index}
+                    for cid, canonical, doc_id, start, end, start_index in aliases
+                ])
+
+    def aliases_of(self, canonical_ids):
+        """Alias de los chunks canónicos dados, como dicts, en orden de fuente."""
+        canonical_ids = list(canonical_ids)
+        if not canonical_ids or not self.has_aliases:
+            return []
+        rows = []
+        with self.engine.connect() as conn:
+            # Por tandas, por debajo del límite de variables de SQLite.
+            for start in range(0, len(canonical_ids), 500):
+                rows.extend(conn.execute(
+                    select(chunk_aliases).where(chunk_aliases.c.canonical_id.in_(canonical_ids[start:start + 500]))
+                    .order_by(chunk_aliases.c.source, chunk_aliases.c.start_index)
+                ).mappings().all())
+        return [dict(row) for row in rows]
+
+    def alias_sources(self, canonical_ids):
+        """{canonical_id: [fuentes de sus alias]}, para citar todas las copias de un pasaje."""
+        result = {}
+        for row in self.aliases_of(canonical_ids):
+            sources = result.setdefault(row["canonical_id"], [])
+            if row["source"] not in sources:
+                sources.append(row["source"])
+        return result
+
+    def promote_alias(self, chunk_id, previous_canonical_id):
+        """Convierte un alias en el chunk canónico de los demás alias de su canónico anterior."""
+        with self.engine.begin() as conn:
+            conn.execute(delete(chunk_aliases).where(chunk_aliases.c.chunk_id == chunk_id))
+            conn.execute(
+                update(chunk_aliases).where(chunk_aliases.c.canonical_id == previous_canonical_id)
+                .values(canonical_id=chunk_id)
+            )
+
+    def query(self, level="document", page=1, page_size=50, fields=None, source=None, title=None,
+              entity=None, topic=None):
+        """
+        Página de metadatos de documentos o chunks. title filtra por prefijo (normalizado);
+        entity y topic, por término normalizado. Devuelve (total, filas).
+        """
+        table = LEVELS[level]
+        fields = [f for f in (fields or FIELDS[level]) if f in FIELDS[level]] or list(FIELDS[level])
+        page_size = max(1, min(page_size, METADATA_MAX_PAGE_SIZE))
+
+        conditions = []
+        if source:
+            conditions.append(table.c.source == source)
+        if title:
+            prefix = normalize_term(title)
+            # Rango en lugar de LIKE para que se use el índice.
+            conditions.append(table.c.title_norm >= prefix)
+            conditions.append(table.c.title_norm < prefix + "\uffff")
+        for kind, value in (("entity", entity), ("topic", topic)):
+            if not value:
+                continue
+            matches = select(entities.c.chunk_id if level == "chunk" else entities.c.source).where(
+                entities.c.term == normalize_term(value),
+                entities.c.kind == kind,
+                entities.c.chunk_id.isnot(None) if level == "chunk" else entities.c.chunk_id.is_(None),
+            )
+            key = table.c.chunk_id if level == "chunk" else table.c.source
+            conditions.append(key.in_(matches))
+
+        order = (table.c.source, table.c.chunk_index if level == "chunk" else table.c.doc_index)
+        with self.engine.connect() as conn:
+            total = conn.execute(select(func.count()).select_from(table).where(*conditions)).scalar_one()
+            rows = conn.execute(
+                select(*(table.c[f] for f in fields)).where(*conditions).order_by(*order)
+                .limit(page_size).offset((max(page, 1) - 1) * page_size)
+            ).mappings().all()
+
+        items = []
+        for row in rows:
+            item = dict(row)
+            for name in _JSON_FIELDS & item.keys():
+                item[name] = json.loads(item[name]) if item[name] else []
+            items.append(item)
+        return total, items
+
+
+@functools.lru_cache(maxsize=4)
+def get_metadata_store(path):
+    """Store de solo lectura (compartido) de una versión publicada."""
+    return MetadataStore(path, readonly=True)
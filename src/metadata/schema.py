@@ -1,7 +1,29 @@
+import json
+
 from pydantic import BaseModel
 
 class DocumentMetadata(BaseModel):
     title: str
     summary: str
     topics: list[str]
-    entities: list[str]
\ No newline at end of file
+    entities: list[str]
+
+
+def parse_metadata(raw):
+    """
+    Interpreta la salida del LLM de metadatos (JSON, a veces entre ```json ... ``` o con
+    texto alrededor) y devuelve un dict con las claves en minúscula, o {} si no es válida.
+    """
+    if isinstance(raw, dict):
+        data = raw
+    else:
+        start, end = (raw or "").find("{"), (raw or "").rfind("}")
+        if start == -1 or end <= start:
+            return {}
+        try:
+            data = json.loads(raw[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+    if not isinstance(data, dict):
+        return {}
+    return {str(key).lower(): value for key, value in data.items()}
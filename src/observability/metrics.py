@@ -0,0 +1,310 @@
+# src/observability/metrics.py
+"""
+Instrumentación ligera: contadores, gauges e histogramas en memoria que se
+exponen en formato de texto de Prometheus, spans de tiempo por etapa y una
+traza opcional por petición (guardada en una contextvar).
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _render_samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Todas las métricas en formato de exposición de texto de Prometheus."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Duración de cada etapa instrumentada.", ["stage"])
+LLM_SECONDS = REGISTRY.histogram("rag_llm_call_seconds", "Duración de cada llamada al LLM.", ["component", "model"])
+LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "Tokens consumidos por las llamadas al LLM.",
+                              ["component", "model", "kind"])
+LLM_ERRORS = REGISTRY.counter("rag_llm_errors_total", "Llamadas al LLM que han fallado.", ["component"])
+CACHE_REQUESTS = REGISTRY.counter("rag_cache_requests_total", "Consultas a las cachés, por resultado.",
+                                  ["cache", "result"])
+HTTP_SECONDS = REGISTRY.histogram("rag_http_request_seconds", "Duración de las peticiones HTTP.",
+                                  ["method", "path", "status"])
+EMBED_BATCH_SIZE = REGISTRY.histogram("rag_embedding_batch_size", "Consultas por pasada del batcher de embeddings.",
+                                      buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+EMBED_BATCH_WAIT = REGISTRY.histogram("rag_embedding_batch_wait_seconds",
+                                      "Espera de cada consulta en el batcher hasta que sale su lote.",
+                                      buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+LLM_GATEWAY_QUEUE = REGISTRY.gauge("rag_llm_gateway_queue_depth", "Peticiones esperando turno en el gateway del LLM.",
+                                   ["priority"])
+LLM_GATEWAY_WAIT = REGISTRY.histogram("rag_llm_gateway_wait_seconds", "Espera en cola del gateway hasta enviar la petición.",
+                                      ["priority"])
+LLM_GATEWAY_RETRIES = REGISTRY.counter("rag_llm_gateway_retries_total", "Reintentos del gateway del LLM, por motivo.",
+                                       ["priority", "reason"])
+LLM_GATEWAY_COALESCED = REGISTRY.counter("rag_llm_gateway_coalesced_total",
+                                         "Peticiones servidas por otra idéntica ya en vuelo.", ["priority"])
+
+
+def record_cache(cache, hit, count=1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+# --- Trazas por petición ---
+
+class Trace:
+    """Lista de spans (etapa, inicio y duración en ms relativos al comienzo de la petición)."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration):
+        with self._lock:
+            self.spans.append({
+                "stage": name,
+                "start_ms": round((started - self.start) * 1000, 2),
+                "ms": round(duration * 1000, 2),
+            })
+
+    def to_list(self):
+        with self._lock:
+            return list(self.spans)
+
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+
+
+def start_trace(trace=None):
+    """Activa una traza (nueva si no se pasa) en el contexto actual (se propaga a tareas e hilos hijos)."""
+    trace = trace or Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_span(name, started, duration):
+    STAGE_SECONDS.observe(duration, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+
+@contextmanager
+def span(name):
+    """Mide el bloque como la etapa `name` (histograma y, si la hay, traza de la petición)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.perf_counter() - started)
+
+
+def timed_iter(iterable, name):
+    """Itera `iterable` midiendo como etapa `name` el tiempo de obtener cada elemento."""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record_span(name, started, time.perf_counter() - started)
+        yield item
+
+
+# --- Callbacks de LangChain ---
+
+def _token_usage(response):
+    """(prompt, completion) a partir del llm_output (Groq/OpenAI) o del usage_metadata del mensaje."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+    return 0, 0
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Mide cada llamada al LLM y cada herramienta (pasos del agente) y cuenta los
+    tokens consumidos, etiquetados con el componente que hace la llamada.
+    """
+
+    # Se ejecuta en el mismo contexto que la llamada, para ver la traza de la petición.
+    run_inline = True
+
+    def __init__(self, component):
+        self.component = component
+        self._runs = {}
+
+    def _start(self, run_id, name, model=None):
+        self._runs[run_id] = (name, model, time.perf_counter())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, "llm", model)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._start(run_id, "llm", params.get("model_name") or params.get("model") or "unknown")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        entry = self._runs.pop(run_id, None)
+        if entry is None:
+            return
+        _, model, started = entry
+        duration = time.perf_counter() - started
+        LLM_SECONDS.observe(duration, component=self.component, model=model)
+        record_span(f"{self.component}.llm", started, duration)
+        prompt_tokens, completion_tokens = _token_usage(response)
+        LLM_TOKENS.inc(prompt_tokens, component=self.component, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, component=self.component, model=model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+        LLM_ERRORS.inc(component=self.component)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, f"{self.component}.tool.{(serialized or {}).get('name', 'tool')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        entry = self._runs.pop(run_id, None)
+        if entry is not None:
+            name, _, started = entry
+            record_span(name, started, time.perf_counter() - started)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+_callbacks = {}
+
+
+def llm_callbacks(component):
+    """Lista de callbacks (compartida) para pasar en el config de una llamada a LangChain."""
+    if component not in _callbacks:
+        _callbacks[component] = [MetricsCallbackHandler(component)]
+    return _callbacks[component]
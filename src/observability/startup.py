@@ -0,0 +1,83 @@
+# src/observability/startup.py
+"""
+Informe de arranque del servidor: hitos en segundos desde que arrancó el proceso
+(aplicación importada, servidor aceptando peticiones, agente listo) y las fases de
+la precarga del agente (imports diferidos, encoder, vector store, LLM y
+calentamiento) como una traza. Se expone en /startup.
+"""
+import os
+import sys
+import threading
+import time
+
+from src.observability.metrics import REGISTRY, Trace, start_trace
+
+STARTUP_SECONDS = REGISTRY.gauge("rag_startup_seconds", "Segundos desde el arranque del proceso hasta cada hito.",
+                                 ["milestone"])
+
+# Módulos pesados que no deberían cargarse antes de que el servidor responda.
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers", "onnxruntime", "chromadb",
+                 "langchain_text_splitters", "langchain_groq", "langgraph")
+
+
+def process_age():
+    """Segundos desde que arrancó el proceso (Linux, vía /proc); 0 si no se puede saber."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # El campo 22 (starttime) va en ticks desde el arranque del sistema, como /proc/uptime.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupReport:
+    """
+    Hitos del arranque y traza de la precarga, ambos relativos al inicio del proceso.
+    status: starting → loading → ready, o failed / no_version si no hay agente que servir.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter() - process_age()
+        self.status = "starting"
+        self.error = None
+        self.milestones = {}
+        self.trace = Trace()
+        self.trace.start = self.started
+        self._lock = threading.Lock()
+
+    def mark(self, milestone):
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            self.milestones[milestone] = round(elapsed, 3)
+        STARTUP_SECONDS.set(elapsed, milestone=milestone)
+        if milestone == "serving":
+            # Lo que ya está importado cuando el servidor empieza a responder.
+            self.milestones["heavy_modules_at_serving"] = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    def begin_preload(self):
+        """Activa la traza del arranque en el hilo actual: los spans de la carga del agente quedan en el informe."""
+        self.status = "loading"
+        start_trace(self.trace)
+
+    def finish(self, status, error=None):
+        self.status, self.error = status, error
+        self.mark(status)
+
+    def to_dict(self):
+        with self._lock:
+            milestones = dict(self.milestones)
+        return {
+            "status": self.status,
+            "error": self.error,
+            "uptime_s": round(time.perf_counter() - self.started, 3),
+            "milestones": milestones,
+            "phases": self.trace.to_list(),
+            "heavy_modules_loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+        }
+
+
+# Se crea al importarse, lo primero que hace main.py.
+STARTUP = StartupReport()
@@ -13,4 +13,21 @@ METADATA_PROMPT = PromptTemplate.from_template(
 
     Return valid JSON only.
     """
-    )
\ No newline at end of file
+    )
+
+METADATA_REDUCE_PROMPT = PromptTemplate.from_template(
+    """
+    You are a metadata generator. The following JSON objects are the metadata of
+    consecutive sections of the same document. Merge them into the metadata of the
+    whole document, as JSON:
+    - Title: a concise title for the whole document
+    - Summary: 2–3 sentence description of the whole document
+    - Topics: list of key themes, without duplicates
+    - Entities: list of named entities (people, organizations, locations), without duplicates
+
+    Section metadata:
+    {text}
+
+    Return valid JSON only.
+    """
+    )
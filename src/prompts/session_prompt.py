@@ -0,0 +1,28 @@
+from langchain_core.prompts import PromptTemplate
+
+SESSION_SUMMARY_PROMPT = PromptTemplate.from_template(
+    """
+    You are summarizing a conversation between a user and a document assistant.
+    Update the running summary with the new turns. Keep the facts, names, dates and
+    document sources the user may refer back to; drop greetings and repetitions.
+    Write at most {max_words} words, in Spanish.
+
+    Current summary:
+    {summary}
+
+    New turns:
+    {turns}
+
+    Return only the updated summary.
+    """
+    )
+
+CONVERSATION_CONTEXT_PROMPT = """
+CONVERSATION SO FAR:
+{summary}
+
+PASSAGES ALREADY RETRIEVED IN THIS CONVERSATION:
+{passages}
+
+If these passages answer the question, answer from them (citing them as usual) without calling retrieve_context again. Call retrieve_context only for information they do not cover.
+"""
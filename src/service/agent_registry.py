@@ -0,0 +1,116 @@
+# src/service/agent_registry.py
+import threading
+from rich.console import Console
+from src.ingestion.store_versions import STORES_ROOT, gc_versions
+from src.observability.metrics import span
+
+console = Console()
+
+
+def _load_rag_agent(**kwargs):
+    # Import diferido: el agente arrastra LangChain, el vector store y el modelo de embeddings,
+    # que no hacen falta para que el servidor arranque y responda.
+    with span("load.imports"):
+        from src.service.rag_service import load_rag_agent
+    return load_rag_agent(**kwargs)
+
+
+class AgentRegistry:
+    """
+    Mantiene el agente RAG en servicio y lo reemplaza sin cortes: la nueva versión
+    se carga y se calienta aparte y después se intercambia de forma atómica.
+    Las peticiones en vuelo terminan con la versión que leyeron al empezar
+    (acquire/release); la versión reemplazada se cierra cuando acaba la última
+    y solo entonces puede borrarse su directorio.
+    """
+
+    def __init__(self, stores_root=STORES_ROOT, loader=_load_rag_agent):
+        self.stores_root = stores_root
+        self._loader = loader
+        self._current = None
+        # Peticiones en curso por agente y agentes reemplazados que aún tienen alguna.
+        self._in_flight = {}
+        self._retired = []
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self._current
+
+    def acquire(self):
+        """Devuelve el agente en servicio (o None) y lo mantiene abierto hasta release()."""
+        with self._swap_lock:
+            runtime = self._current
+            if runtime is not None:
+                self._in_flight[runtime] = self._in_flight.get(runtime, 0) + 1
+            return runtime
+
+    def release(self, runtime):
+        with self._swap_lock:
+            self._in_flight[runtime] -= 1
+            if self._in_flight[runtime]:
+                return
+            del self._in_flight[runtime]
+            if runtime not in self._retired:
+                return
+            self._retired.remove(runtime)
+        # Era la última petición de una versión reemplazada: se cierra y se borra fuera del event loop.
+        thread = threading.Thread(target=self._retire, args=(runtime,), name=f"agent-close-{runtime.version}",
+                                  daemon=True)
+        thread.start()
+
+    def load(self, version=None):
+        """Carga, calienta y publica el agente de `version` (por defecto, la versión actual)."""
+        with self._load_lock:
+            runtime = self._loader(version=version, stores_root=self.stores_root)
+            with span("load.warm"):
+                runtime.warm()
+            replaced = self._swap(runtime)
+        if replaced is not None:
+            self._retire(replaced)
+        else:
+            self._collect()
+        return runtime
+
+    def _swap(self, runtime):
+        """Publica `runtime` y devuelve el agente que ya se puede cerrar (si hay alguno)."""
+        with self._swap_lock:
+            previous = self._current
+            # Los nombres de versión son ordenables por fecha: nunca se vuelve a una anterior.
+            if previous is not None and runtime.version < previous.version:
+                console.log(f"Se ignora la versión {runtime.version}: ya se sirve {previous.version}.")
+                return runtime
+            self._current = runtime
+            if previous is not None and self._in_flight.get(previous):
+                self._retired.append(previous)
+                previous = None
+        console.log(f"✅ Agente RAG en servicio con la versión {runtime.version}.")
+        return previous
+
+    def _retire(self, runtime):
+        try:
+            runtime.close()
+        except Exception as e:
+            console.log(f"❌ Error al cerrar la versión {runtime.version} del agente: {e}")
+        self._collect()
+
+    def _collect(self):
+        # Las versiones con agentes aún abiertos no se borran.
+        with self._swap_lock:
+            in_use = [runtime.version for runtime in (self._current, *self._retired) if runtime is not None]
+        gc_versions(self.stores_root, in_use=in_use)
+
+    def load_in_background(self, version=None, on_error=None):
+        """Carga la versión en un hilo aparte; on_error(excepción) se llama si falla."""
+        def target():
+            try:
+                self.load(version)
+            except Exception as e:
+                console.log(f"❌ Error al cargar la versión {version} del agente: {e}")
+                if on_error is not None:
+                    on_error(e)
+
+        thread = threading.Thread(target=target, name=f"agent-load-{version}", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,98 @@
+# src/service/answer_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from src.observability.metrics import record_cache
+
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+
+
+class SemanticAnswerCache:
+    """
+    Caché semántica de respuestas: guarda el embedding normalizado de cada consulta
+    junto a su respuesta y fuentes, y devuelve la respuesta cacheada cuando la
+    similitud coseno con una consulta nueva supera `threshold`.
+
+    Los vectores viven en una matriz preasignada (una fila por entrada), así que una
+    búsqueda es un único producto matriz-vector. Las entradas se expulsan por LRU y
+    la caché entera se vacía cuando cambia la versión de la colección.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_size=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._payloads = [None] * max_size
+        self._lru = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._version = version
+            self._valid[:] = False
+            self._payloads = [None] * self.max_size
+            self._lru.clear()
+
+    def _best_slot(self, vector):
+        if self._matrix is None or not self._lru:
+            return None, -1.0
+        scores = self._matrix @ vector
+        scores[~self._valid] = -np.inf
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def lookup(self, vector, version=None):
+        """Devuelve (respuesta, fuentes) si hay una consulta cacheada lo bastante parecida, o None."""
+        vector = self._normalize(vector)
+        with self._lock:
+            self._sync_version(version)
+            slot, score = self._best_slot(vector)
+            if slot is None or score < self.threshold:
+                self.misses += 1
+                record_cache("answers", False)
+                return None
+            self.hits += 1
+            record_cache("answers", True)
+            self._lru.move_to_end(slot)
+            return self._payloads[slot]
+
+    def put(self, vector, answer, sources, version=None):
+        vector = self._normalize(vector)
+        with self._lock:
+            self._sync_version(version)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            slot, score = self._best_slot(vector)
+            if slot is None or score < self.threshold:
+                free = np.flatnonzero(~self._valid)
+                slot = int(free[0]) if free.size else next(iter(self._lru))
+
+            self._matrix[slot] = vector
+            self._valid[slot] = True
+            self._payloads[slot] = (answer, list(sources))
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._lru),
+            "threshold": self.threshold,
+        }
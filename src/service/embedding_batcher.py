@@ -0,0 +1,89 @@
+# src/service/embedding_batcher.py
+import asyncio
+import os
+import time
+
+from src.observability.metrics import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT
+
+EMBED_BATCHING = os.environ.get("EMBED_BATCHING", "true").lower() == "true"
+EMBED_BATCH_MAX_SIZE = int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32"))
+# Con 0 no se espera: los lotes se forman solo con lo que llega mientras el modelo está ocupado.
+EMBED_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "2"))
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa los embeddings de consulta de peticiones concurrentes: las consultas se
+    acumulan hasta max_wait_ms o hasta max_batch_size, se embeben en una sola pasada
+    de embed_fn (fuera del event loop) y cada llamador recibe su vector.
+    Mientras un lote está en el modelo, las consultas nuevas forman el siguiente.
+    Se usa solo desde el event loop; no necesita locks.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_MAX_WAIT_MS):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self._pending = []
+        self._timer = None
+        self._running = None
+        # Referencias a las tareas en curso para que no las recoja el GC.
+        self._tasks = set()
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        if self._running is not None and not self._running.done():
+            # El modelo está ocupado: el lote sigue creciendo y sale cuando termine el actual.
+            return
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        task = asyncio.ensure_future(self._run(batch))
+        self._running = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        dispatched = time.perf_counter()
+        for _, _, queued in batch:
+            EMBED_BATCH_WAIT.observe(dispatched - queued)
+        # Consultas idénticas del mismo lote se embeben una vez.
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        EMBED_BATCH_SIZE.observe(len(texts))
+        self.batches += 1
+        self.queries += len(batch)
+        try:
+            vectors = dict(zip(texts, await asyncio.to_thread(self.embed_fn, texts)))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for text, future, _ in batch:
+                if not future.done():
+                    future.set_result(vectors[text])
+        finally:
+            self._running = None
+            if self._pending:
+                self._flush()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
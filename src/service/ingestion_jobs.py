@@ -0,0 +1,165 @@
+# src/service/ingestion_jobs.py
+import os
+import threading
+import time
+import uuid
+from rich.console import Console
+from src.ingestion.store_versions import build_in_progress
+
+console = Console()
+
+PROGRESS_STAGES = (
+    "documents_loaded", "chunks_split", "chunks_deduplicated", "metadata_generated", "vectors_upserted",
+)
+
+
+class IngestionCancelled(Exception):
+    """Se lanza dentro del pipeline cuando se ha pedido cancelar la ingesta."""
+
+
+class IngestionAlreadyRunning(Exception):
+    """job es None si la ingesta en curso la lanzó otro proceso (otro worker)."""
+
+    def __init__(self, job=None):
+        where = f"job {job.id}" if job is not None else "en otro proceso"
+        super().__init__(f"Ya hay una ingesta en curso para este store ({where}).")
+        self.job = job
+
+
+class IngestionJob:
+    """Estado, progreso por etapa y señal de cancelación de una ingesta en segundo plano."""
+
+    def __init__(self, store_dir, incremental=True):
+        self.id = uuid.uuid4().hex
+        self.store_dir = store_dir
+        self.incremental = incremental
+        self.status = "pending"
+        self.progress = {stage: 0 for stage in PROGRESS_STAGES}
+        self.summary = None
+        self.error = None
+        self.reload_error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, stage, count=1):
+        with self._lock:
+            self.progress[stage] += count
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise IngestionCancelled()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def set_reload_error(self, error):
+        with self._lock:
+            self.reload_error = str(error)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "incremental": self.incremental,
+                "progress": dict(self.progress),
+                "summary": self.summary,
+                "error": self.error,
+                "reload_error": self.reload_error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class IngestionJobManager:
+    """
+    Lanza ingestas en un hilo de fondo (una como máximo por store) y guarda
+    su estado para que los endpoints puedan consultarlo o cancelarlas.
+    `on_success(job)` se llama al terminar bien un job (p. ej. para recargar el agente);
+    si falla, el job sigue completado y el error queda en reload_error.
+    """
+
+    def __init__(self, run_pipeline, on_success=None, max_finished_jobs=50):
+        self._run_pipeline = run_pipeline
+        self._on_success = on_success
+        self._max_finished_jobs = max_finished_jobs
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, store_dir, incremental=True):
+        store_key = os.path.abspath(store_dir)
+        with self._lock:
+            running = self._active.get(store_key)
+            if running is not None:
+                raise IngestionAlreadyRunning(running)
+            # Las de otros workers solo se ven en el lock de construcción del directorio;
+            # el job lo toma al ejecutarse y, si otro se adelanta, falla con BuildInProgress.
+            if build_in_progress(store_dir):
+                raise IngestionAlreadyRunning()
+            job = IngestionJob(store_dir, incremental)
+            self._jobs[job.id] = job
+            self._active[store_key] = job
+            self._prune()
+
+        thread = threading.Thread(
+            target=self._run, args=(job, store_key), name=f"ingestion-{job.id[:8]}", daemon=True
+        )
+        thread.start()
+        return job
+
+    def _run(self, job, store_key):
+        job.status = "running"
+        job.started_at = time.time()
+        console.log(f"🏃‍♂️ Job de ingesta {job.id} iniciado.")
+        try:
+            _, summary = self._run_pipeline(
+                job.store_dir,
+                incremental=job.incremental,
+                progress=job.report,
+                check_cancelled=job.check_cancelled,
+            )
+            job.summary = summary
+            job.status = "completed"
+            console.log(f"✅ Job de ingesta {job.id} completado.")
+        except IngestionCancelled:
+            job.status = "cancelled"
+            console.log(f"🛑 Job de ingesta {job.id} cancelado.")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            console.log(f"❌ Error en el job de ingesta {job.id}: {e}")
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(store_key, None)
+
+        # La versión ya está publicada: un fallo al recargar el agente no hace fallar el job.
+        if job.status == "completed" and self._on_success is not None:
+            try:
+                self._on_success(job)
+            except Exception as e:
+                job.set_reload_error(e)
+                console.log(f"❌ Error al recargar el agente tras el job de ingesta {job.id}: {e}")
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None and job.finished_at is None:
+            job.cancel()
+        return job
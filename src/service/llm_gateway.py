@@ -0,0 +1,406 @@
+# src/service/llm_gateway.py
+import asyncio
+import concurrent.futures
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_groq import ChatGroq
+from rich.console import Console
+from src.observability.metrics import LLM_GATEWAY_COALESCED, LLM_GATEWAY_QUEUE, LLM_GATEWAY_RETRIES, LLM_GATEWAY_WAIT
+
+console = Console()
+
+LLM_GATEWAY = os.environ.get("LLM_GATEWAY", "true").lower() == "true"
+# Límites de la cuenta de Groq (0 = sin límite); por defecto, los del plan gratuito de llama-3.1-8b-instant.
+LLM_GATEWAY_RPM = int(os.environ.get("LLM_GATEWAY_RPM", "30"))
+LLM_GATEWAY_TPM = int(os.environ.get("LLM_GATEWAY_TPM", "6000"))
+# Tokens de salida que se reservan si la petición no fija max_tokens; se corrigen con el uso real.
+LLM_GATEWAY_OUTPUT_TOKENS = int(os.environ.get("LLM_GATEWAY_OUTPUT_TOKENS", "512"))
+# Fracción del límite por minuto que se puede gastar de golpe; el resto se repone de forma
+# continua, así que en cualquier ventana de 60 s no se supera el límite.
+LLM_GATEWAY_BURST = float(os.environ.get("LLM_GATEWAY_BURST", "0.1"))
+# Fracción de cada cubo que las peticiones de prioridad "bulk" no pueden consumir: queda libre para el chat.
+LLM_GATEWAY_BULK_RESERVE = float(os.environ.get("LLM_GATEWAY_BULK_RESERVE", "0.2"))
+LLM_GATEWAY_MAX_RETRIES = int(os.environ.get("LLM_GATEWAY_MAX_RETRIES", "5"))
+LLM_GATEWAY_BACKOFF_BASE = float(os.environ.get("LLM_GATEWAY_BACKOFF_BASE", "1.0"))
+LLM_GATEWAY_BACKOFF_MAX = float(os.environ.get("LLM_GATEWAY_BACKOFF_MAX", "30.0"))
+
+# Menor valor = antes en la cola.
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+
+def estimate_request_tokens(messages, max_tokens=None):
+    # ~4 caracteres por token, como context_builder, más la salida esperada.
+    text_len = sum(len(m.content if isinstance(m.content, str) else json.dumps(m.content, default=str))
+                   for m in messages)
+    return text_len // 4 + 1 + (max_tokens or LLM_GATEWAY_OUTPUT_TOKENS)
+
+
+def _status_code(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def _retry_reason(error):
+    """Motivo del reintento, o None si el error no es transitorio."""
+    status = _status_code(error)
+    if status == 429:
+        return "rate_limited"
+    if status is not None and status >= 500:
+        return "server_error"
+    if isinstance(error, (TimeoutError, ConnectionError)) or \
+            type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return "connection"
+    return None
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _usage_tokens(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class TokenBucket:
+    """
+    Cubo de tokens para un límite por minuto: admite ráfagas de `burst` del límite y
+    se repone al ritmo del resto. Con per_minute=0 no limita.
+    """
+
+    def __init__(self, per_minute, burst=LLM_GATEWAY_BURST):
+        self.capacity = per_minute * burst
+        self.rate = per_minute * (1 - burst) / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _cost(self, amount, reserve):
+        # Una petición mayor que el cubo pasa cuando está lleno, en lugar de no pasar nunca.
+        return min(amount, self.capacity * (1 - reserve))
+
+    def wait_time(self, amount, reserve, now):
+        """Segundos hasta poder retirar `amount` dejando en el cubo la fracción `reserve`."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        missing = self._cost(amount, reserve) + reserve * self.capacity - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount, reserve=0.0):
+        if self.capacity:
+            self.level -= self._cost(amount, reserve)
+
+    def adjust(self, delta):
+        """Corrige una estimación con el consumo real (el nivel puede quedar negativo: deuda)."""
+        if self.capacity:
+            self.level = min(self.capacity, self.level - delta)
+
+    def drain(self):
+        if self.capacity:
+            self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("priority", "loop", "wakeup")
+
+    def __init__(self, priority, loop):
+        self.priority = priority
+        self.loop = loop
+        self.wakeup = None
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _OwnerCancelled(Exception):
+    """El llamador que lanzó una petición compartida se ha cancelado; quien esperaba la repite."""
+
+
+class LLMGateway:
+    """
+    Punto único de salida hacia el proveedor del LLM, compartido por el chat y la
+    ingesta (que corren en event loops distintos, de ahí los locks y los futures
+    thread-safe). Cada petición espera su turno en una cola por prioridad (el chat
+    antes que la ingesta, FIFO dentro de cada clase) hasta que los cubos de
+    peticiones y tokens por minuto la admiten; los 429 y errores transitorios se
+    reintentan con backoff exponencial con jitter, y un 429 pausa a todas las
+    peticiones. Las peticiones idénticas en vuelo se resuelven con una sola llamada.
+    """
+
+    def __init__(self, rpm=LLM_GATEWAY_RPM, tpm=LLM_GATEWAY_TPM, bulk_reserve=LLM_GATEWAY_BULK_RESERVE,
+                 max_retries=LLM_GATEWAY_MAX_RETRIES, backoff_base=LLM_GATEWAY_BACKOFF_BASE,
+                 backoff_max=LLM_GATEWAY_BACKOFF_MAX):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self._inflight = {}
+        self.calls = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    def _wake_head(self):
+        if self._queue:
+            head = self._queue[0][2]
+            if head.wakeup is not None:
+                head.loop.call_soon_threadsafe(_wake, head.wakeup)
+
+    async def _acquire(self, priority, tokens):
+        """Espera el turno de la petición y descuenta su coste de los cubos."""
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, loop)
+        reserve = self.bulk_reserve if priority == "bulk" else 0.0
+        queued = time.perf_counter()
+        with self._lock:
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), waiter))
+        LLM_GATEWAY_QUEUE.inc(priority=priority)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    delay = None
+                    if self._queue[0][2] is waiter:
+                        delay = max(self._blocked_until - now,
+                                    self.requests.wait_time(1, reserve, now),
+                                    self.tokens.wait_time(tokens, reserve, now))
+                        if delay <= 0:
+                            self.requests.take(1, reserve)
+                            self.tokens.take(tokens, reserve)
+                            heapq.heappop(self._queue)
+                            self._wake_head()
+                            return
+                    # Sin ser la primera se espera a que la despierten; siendo la primera,
+                    # a que se rellenen los cubos (o a que llegue otra más prioritaria).
+                    waiter.wakeup = loop.create_future()
+                await asyncio.wait({waiter.wakeup}, timeout=delay)
+        except BaseException:
+            with self._lock:
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self._wake_head()
+            raise
+        finally:
+            LLM_GATEWAY_QUEUE.dec(priority=priority)
+            LLM_GATEWAY_WAIT.observe(time.perf_counter() - queued, priority=priority)
+
+    def _settle(self, estimated, used):
+        if used:
+            with self._lock:
+                self.tokens.adjust(used - estimated)
+
+    async def _backoff(self, error, attempt, priority):
+        """Espera antes de reintentar `error`, o lo relanza si no es transitorio o se agotan los intentos."""
+        reason = _retry_reason(error)
+        if reason is None or attempt >= self.max_retries:
+            raise error
+        # Full jitter: los reintentos de peticiones que fallaron a la vez no vuelven a coincidir.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if reason == "rate_limited":
+            delay = max(delay, _retry_after(error) or 0.0)
+            with self._lock:
+                # El proveedor va por delante de los cubos: se pausa a todos y se vacían.
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                self.requests.drain()
+                self.tokens.drain()
+        self.retries += 1
+        LLM_GATEWAY_RETRIES.inc(priority=priority, reason=reason)
+        console.log(f"[yellow]LLM: {reason} ({error}); reintento {attempt + 1} en {delay:.1f}s.[/yellow]")
+        await asyncio.sleep(delay)
+
+    async def _run(self, priority, tokens, call):
+        for attempt in itertools.count():
+            await self._acquire(priority, tokens)
+            self.calls += 1
+            try:
+                result = await call()
+            except Exception as e:
+                await self._backoff(e, attempt, priority)
+                continue
+            self._settle(tokens, _usage_tokens(result.generations[0].message) if result.generations else None)
+            return result
+
+    async def generate(self, key, priority, tokens, call):
+        """
+        Ejecuta `call` (una corrutina que devuelve un ChatResult) a través de la cola.
+        Si ya hay en vuelo una petición con la misma clave, espera su resultado. Si el
+        llamador que la lanzó se cancela, los que esperaban no heredan la cancelación:
+        uno de ellos vuelve a lanzarla.
+        """
+        coalesced = False
+        while True:
+            with self._lock:
+                shared = self._inflight.get(key)
+                owner = shared is None
+                if owner:
+                    shared = self._inflight[key] = concurrent.futures.Future()
+            if owner:
+                break
+            if not coalesced:
+                coalesced = True
+                self.coalesced += 1
+                LLM_GATEWAY_COALESCED.inc(priority=priority)
+            try:
+                # shield: si este llamador se cancela, la petición compartida sigue.
+                return await asyncio.shield(asyncio.wrap_future(shared))
+            except _OwnerCancelled:
+                continue
+
+        try:
+            result = await self._run(priority, tokens, call)
+        except asyncio.CancelledError:
+            self._release(key, shared)
+            shared.set_exception(_OwnerCancelled())
+            raise
+        except BaseException as e:
+            self._release(key, shared)
+            shared.set_exception(e)
+            raise
+        self._release(key, shared)
+        shared.set_result(result)
+        return result
+
+    def _release(self, key, shared):
+        with self._lock:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+
+    async def stream(self, priority, tokens, open_stream):
+        """
+        Igual que generate para respuestas en streaming (sin agrupar peticiones): solo
+        se reintenta mientras no ha llegado ningún fragmento al llamador.
+        """
+        for attempt in itertools.count():
+            await self._acquire(priority, tokens)
+            self.calls += 1
+            chunks = open_stream()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await self._backoff(e, attempt, priority)
+                continue
+            break
+        used = _usage_tokens(first.message)
+        yield first
+        async for chunk in chunks:
+            used = _usage_tokens(chunk.message) or used
+            yield chunk
+        self._settle(tokens, used)
+
+    def stats(self):
+        with self._lock:
+            queued = {name: sum(entry[2].priority == name for entry in self._queue) for name in PRIORITIES}
+        return {"calls": self.calls, "retries": self.retries, "coalesced": self.coalesced, "queued": queued}
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway():
+    """Gateway compartido por todo el proceso (chat e ingesta)."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    Envuelve un modelo de chat para que todas sus llamadas pasen por el gateway con
+    la prioridad indicada. bind_tools delega el formato de las herramientas en el
+    modelo envuelto, así que sirve para el agente.
+    """
+
+    inner: BaseChatModel
+    priority: str = "interactive"
+    gateway: Any = None
+
+    @property
+    def _llm_type(self):
+        return f"gateway-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self):
+        return self.inner._identifying_params
+
+    @property
+    def model_name(self):
+        return getattr(self.inner, "model_name", None) or type(self.inner).__name__
+
+    def _gateway(self):
+        return self.gateway or get_llm_gateway()
+
+    def _should_stream(self, *, async_api, run_manager=None, **kwargs):
+        # Solo hay streaming asíncrono, y solo si el modelo envuelto lo implementa.
+        return async_api and self.inner._should_stream(async_api=True, run_manager=run_manager, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        # Las herramientas ya formateadas viajan como kwargs hasta el modelo envuelto.
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    def _request_key(self, messages, stop, kwargs):
+        payload = json.dumps(
+            [self.model_name, [m.model_dump() for m in messages], stop, kwargs],
+            default=str, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await self._gateway().generate(
+            self._request_key(messages, stop, kwargs), self.priority,
+            estimate_request_tokens(messages, kwargs.get("max_tokens")),
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Las llamadas síncronas hacen cola igual, en un event loop propio.
+        return asyncio.run(self._gateway().generate(
+            self._request_key(messages, stop, kwargs), self.priority,
+            estimate_request_tokens(messages, kwargs.get("max_tokens")),
+            lambda: asyncio.to_thread(self.inner._generate, messages, stop=stop, run_manager=run_manager, **kwargs),
+        ))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in self._gateway().stream(
+            self.priority, estimate_request_tokens(messages, kwargs.get("max_tokens")),
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+        ):
+            yield chunk
+
+
+def groq_chat_model(model, priority="interactive", **kwargs):
+    """
+    Cliente de Groq para `model`. Con el gateway activo (LLM_GATEWAY), sus llamadas
+    pasan por el gateway compartido con la prioridad indicada y los reintentos son
+    solo del gateway.
+    """
+    if not LLM_GATEWAY:
+        return ChatGroq(model=model, **kwargs)
+    return GatewayChatModel(inner=ChatGroq(model=model, max_retries=0, **kwargs), priority=priority)
@@ -1,32 +1,103 @@
 # src/services/rag_service.py
-from langchain_groq import ChatGroq
+import contextlib
+import functools
+import os
 from src.agents.tools import make_retrieve_context_tool
+from src.agents.retrieval_cache import RetrievalCache
 from src.agents.agent import create_rag_agent
 from src.prompts.rag_prompt import RAG_AGENT_PROMPT
-from src.ingestion.vector_store import load_chroma_store
+from src.ingestion.vector_store import close_store, load_chroma_store
+from src.ingestion.embeddings import get_embeddings_model
+from src.ingestion.doc_store import DocStore
+from src.ingestion.store_versions import STORES_ROOT, current_version, version_dir
+from src.service.answer_cache import SemanticAnswerCache
+from src.service.sessions import session_scope
+from src.service.embedding_batcher import EMBED_BATCHING, EmbeddingBatcher
+from src.service.llm_gateway import get_llm_gateway, groq_chat_model
+from src.ingestion.embedding_cache import embed_queries
+from src.metadata.inverted_index import EntityIndex
+from src.metadata.metadata_store import METADATA_DB_FILE, get_metadata_store
+from src.observability.metrics import llm_callbacks, span
 from rich.console import Console
 
 console = Console()
 
-def load_rag_agent():
+class RagRuntime:
+    """
+    Agente RAG cargado sobre una versión concreta (inmutable) del vector store,
+    junto con sus cachés. Cada versión tiene las suyas, así que un cambio de
+    versión las invalida sin más.
+    """
+
+    def __init__(self, version, store_dir, vectordb, agent_executor, retrieval_cache, answer_cache, llm=None):
+        self.version = version
+        self.store_dir = store_dir
+        self.vectordb = vectordb
+        self.agent_executor = agent_executor
+        self.retrieval_cache = retrieval_cache
+        self.answer_cache = answer_cache
+        # El mismo LLM resume el historial de las sesiones.
+        self.llm = llm
+
+    def warm(self):
+        """Fuerza la carga del encoder y del índice antes de servir tráfico."""
+        self.vectordb.similarity_search("warm-up", k=1)
+
+    def close(self):
+        """Libera los ficheros abiertos de la versión (vector store, textos y metadatos) para poder borrarla."""
+        close_store(self.vectordb)
+        if self.retrieval_cache.doc_store is not None:
+            self.retrieval_cache.doc_store.close()
+        if self.retrieval_cache.meta_store is not None:
+            self.retrieval_cache.meta_store.close()
+
+def load_rag_agent(version=None, stores_root=STORES_ROOT, embeddings=None, llm=None):
     """
     Carga la base de datos vectorial, configura el LLM y las herramientas,
-    y devuelve el agente RAG listo para usarse.
+    y devuelve el agente RAG listo para usarse (por defecto, sobre la versión
+    publicada actualmente). embeddings y llm sustituyen a los modelos por defecto.
     """
-    console.log("Cargando Vector DB desde el servicio...")
-    vectordb = load_chroma_store(persist_path="chroma_db")
-    
+    version = version or current_version(stores_root)
+    if version is None:
+        raise FileNotFoundError("No hay ninguna versión publicada del vector store. Ejecuta /ingest primero.")
+    store_dir = version_dir(version, stores_root)
+
+    console.log(f"Cargando Vector DB (versión {version}) desde el servicio...")
+    with span("load.encoder"):
+        embeddings = embeddings or get_embeddings_model()
+    with span("load.vector_store"):
+        vectordb = load_chroma_store(persist_path=store_dir, embeddings=embeddings)
+
     console.log("Creando herramientas de retrieval...")
-    retrieve_tool = make_retrieve_context_tool(vectordb)
+    # Los embeddings de consultas concurrentes (caché semántica y herramienta) se agrupan en lotes.
+    batcher = EmbeddingBatcher(functools.partial(embed_queries, vectordb.embeddings)) if EMBED_BATCHING else None
+    with span("load.indexes"):
+        meta_store_path = os.path.join(store_dir, METADATA_DB_FILE)
+        meta_store = get_metadata_store(meta_store_path) if os.path.exists(meta_store_path) else None
+        retrieval_cache = RetrievalCache(vectordb, batcher=batcher, doc_store=DocStore(store_dir), meta_store=meta_store)
+        entity_index = EntityIndex.load(store_dir)
+    retrieve_tool = make_retrieve_context_tool(vectordb, cache=retrieval_cache, entity_index=entity_index)
     tools = [retrieve_tool]
 
     console.log("Configurando LLM (llama-3.1-8b-instant)...")
-    llm = ChatGroq(model="llama-3.1-8b-instant", temperature=0.0)
+    with span("load.agent"):
+        llm = llm or groq_chat_model("llama-3.1-8b-instant", priority="interactive", temperature=0.0)
 
-    console.log("Creando agente RAG...")
-    agent_executor = create_rag_agent(llm, tools=tools, prompt=RAG_AGENT_PROMPT)
+        console.log("Creando agente RAG...")
+        agent_executor = create_rag_agent(llm, tools=tools, prompt=RAG_AGENT_PROMPT)
     
-    return agent_executor
+    return RagRuntime(version, store_dir, vectordb, agent_executor, retrieval_cache, SemanticAnswerCache(), llm=llm)
+
+def get_cache_stats(runtime):
+    """Estadísticas de aciertos de las cachés del agente en servicio."""
+    if runtime is None:
+        return {"version": None, "retrieval": None, "answers": None, "llm_gateway": get_llm_gateway().stats()}
+    return {
+        "version": runtime.version,
+        "retrieval": runtime.retrieval_cache.stats(),
+        "answers": runtime.answer_cache.stats(),
+        "llm_gateway": get_llm_gateway().stats(),
+    }
 
 def get_chat_response(agent_executor, query: str) -> str:
     """
@@ -42,4 +113,129 @@ def get_chat_response(agent_executor, query: str) -> str:
         
     except Exception as e:
         console.log(f"❌ Error al invocar el agente: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def _sources_from_artifact(artifact, sources):
+    for doc in artifact or []:
+        # Las fuentes de los alias (mismo pasaje en otros ficheros) también se citan.
+        for source in [doc.metadata.get("source"), *doc.metadata.get("aliases", [])]:
+            if source and source not in sources:
+                sources.append(source)
+    return sources
+
+async def _lookup_cached_answer(runtime, query, session=None):
+    """
+    Busca una respuesta semánticamente equivalente en la caché. Devuelve
+    (respuesta_cacheada, embedding); el embedding se reutiliza para guardar la respuesta.
+    Con historial, la respuesta depende de la conversación y la caché no se usa.
+    """
+    if session is not None and not session.is_new:
+        return None, None
+    # El embedding es trabajo de CPU: se calcula fuera del event loop (agrupado con otras consultas).
+    vector = await runtime.retrieval_cache.aembed_query(query)
+    return runtime.answer_cache.lookup(vector, runtime.version), vector
+
+def _session_turn(runtime, session):
+    """Serializa los turnos de una sesión y la asocia al turno (herramienta de retrieval incluida)."""
+    if session is None:
+        return contextlib.nullcontext()
+    session.sync_version(runtime.version)
+    return session.lock
+
+def _finish_turn(runtime, session, vector, query, answer, sources, sessions):
+    # Una respuesta vacía no se cachea: se serviría a todas las consultas parecidas.
+    if vector is not None and answer:
+        runtime.answer_cache.put(vector, answer, sources, runtime.version)
+    if session is not None:
+        session.add_turn(query, answer)
+        if sessions is not None and runtime.llm is not None:
+            sessions.schedule_compaction(session, runtime.llm)
+
+async def aget_chat_answer(runtime, query: str, session=None, sessions=None) -> dict:
+    """
+    Versión asíncrona de get_chat_response: no bloquea el event loop mientras dura
+    la llamada al LLM. Si la caché semántica tiene una consulta equivalente, se
+    devuelve su respuesta sin llamar al agente.
+    Con una sesión (ChatSession) el agente recibe el historial acotado de la
+    conversación, y `sessions` (SessionStore) compacta en segundo plano lo que no cabe.
+    Devuelve {"response": ..., "sources": [...], "cached": bool}.
+    """
+    async with _session_turn(runtime, session):
+        cached, vector = await _lookup_cached_answer(runtime, query, session)
+        if cached is not None:
+            console.log("⚡ Respuesta servida desde la caché semántica.")
+            answer, sources = cached
+            _finish_turn(runtime, session, None, query, answer, sources, sessions)
+            return {"response": answer, "sources": sources, "cached": True}
+
+        messages = session.build_messages(query) if session is not None else [("user", query)]
+        console.log("Invocando agente (async) con la consulta...")
+        try:
+            with span("agent"), session_scope(session):
+                response = await runtime.agent_executor.ainvoke(
+                    {"messages": messages}, config={"callbacks": llm_callbacks("agent")}
+                )
+        except Exception as e:
+            console.log(f"❌ Error al invocar el agente: {e}")
+            raise
+
+        answer = response["messages"][-1].content
+        sources = []
+        for message in response["messages"]:
+            _sources_from_artifact(getattr(message, "artifact", None), sources)
+        _finish_turn(runtime, session, vector, query, answer, sources, sessions)
+        return {"response": answer, "sources": sources, "cached": False}
+
+async def astream_chat_response(runtime, query: str, session=None, sessions=None):
+    """
+    Genera los eventos de una respuesta en streaming:
+    - {"type": "token", "content": ...} por cada token del LLM,
+    - {"type": "tool_start" | "tool_end", ...} por cada llamada a herramienta,
+    - {"type": "done", "response": ..., "sources": [...], "cached": bool} al final.
+    Un acierto en la caché semántica se emite como un único token.
+    La sesión se trata igual que en aget_chat_answer.
+    """
+    async with _session_turn(runtime, session):
+        cached, vector = await _lookup_cached_answer(runtime, query, session)
+        if cached is not None:
+            console.log("⚡ Respuesta servida desde la caché semántica.")
+            answer, sources = cached
+            _finish_turn(runtime, session, None, query, answer, sources, sessions)
+            yield {"type": "token", "content": answer}
+            yield {"type": "done", "response": answer, "sources": sources, "cached": True}
+            return
+
+        messages = session.build_messages(query) if session is not None else [("user", query)]
+        console.log("Invocando agente (streaming) con la consulta...")
+        answer = []
+        sources = []
+        events = runtime.agent_executor.astream_events(
+            {"messages": messages}, config={"callbacks": llm_callbacks("agent")}, version="v2"
+        )
+        with span("agent"), session_scope(session):
+            async for event in events:
+                kind = event["event"]
+                if kind == "on_chat_model_start":
+                    # Solo cuenta como respuesta el texto de la última llamada al LLM.
+                    answer = []
+                elif kind == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        answer.append(content)
+                        yield {"type": "token", "content": content}
+                elif kind == "on_chat_model_end" and not answer:
+                    # Modelos (o pasos) que no emiten tokens: la respuesta llega entera al final.
+                    content = getattr(event["data"].get("output"), "content", None)
+                    if content and isinstance(content, str):
+                        answer.append(content)
+                        yield {"type": "token", "content": content}
+                elif kind == "on_tool_start":
+                    yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+                elif kind == "on_tool_end":
+                    output = event["data"].get("output")
+                    _sources_from_artifact(getattr(output, "artifact", None), sources)
+                    yield {"type": "tool_end", "name": event["name"], "output": str(getattr(output, "content", output))}
+
+        answer = "".join(answer)
+        _finish_turn(runtime, session, vector, query, answer, sources, sessions)
+        yield {"type": "done", "response": answer, "sources": sources, "cached": False}
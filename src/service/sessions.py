@@ -0,0 +1,196 @@
+# src/service/sessions.py
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from rich.console import Console
+from src.agents.context_builder import build_context, estimate_tokens
+from src.agents.retrieval_cache import normalize_query
+from src.observability.metrics import llm_callbacks, span
+
+console = Console()
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "1000"))
+# Presupuestos (tokens estimados) de cada parte del prompt que aporta la sesión.
+SESSION_HISTORY_TOKEN_BUDGET = int(os.environ.get("SESSION_HISTORY_TOKEN_BUDGET", "1500"))
+SESSION_SUMMARY_TOKEN_BUDGET = int(os.environ.get("SESSION_SUMMARY_TOKEN_BUDGET", "300"))
+SESSION_CONTEXT_TOKEN_BUDGET = int(os.environ.get("SESSION_CONTEXT_TOKEN_BUDGET", "1000"))
+# Recuperaciones recientes que se guardan por sesión.
+SESSION_RETRIEVALS = int(os.environ.get("SESSION_RETRIEVALS", "8"))
+
+_current_session = contextvars.ContextVar("chat_session", default=None)
+
+
+def current_session():
+    """Sesión del turno en curso (la fija rag_service), o None fuera de una sesión."""
+    return _current_session.get()
+
+
+@contextlib.contextmanager
+def session_scope(session):
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+
+
+def _turn_tokens(turn):
+    return estimate_tokens(turn[0]) + estimate_tokens(turn[1])
+
+
+class ChatSession:
+    """
+    Conversación de un cliente: resumen acumulado de los turnos antiguos, turnos
+    recientes sin resumir y las últimas recuperaciones (consulta -> contexto y
+    documentos), que se reutilizan en las preguntas de seguimiento.
+    Las recuperaciones dependen de la versión del store y se descartan al cambiar.
+    """
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.summary = ""
+        self.turns = []
+        self.retrievals = OrderedDict()
+        self.version = None
+        self.last_used = time.monotonic()
+        # Serializa los turnos (y la compactación) de una misma sesión.
+        self.lock = asyncio.Lock()
+
+    @property
+    def is_new(self):
+        return not self.turns and not self.summary
+
+    def sync_version(self, version):
+        if version != self.version:
+            self.version = version
+            self.retrievals.clear()
+
+    def cached_retrieval(self, query):
+        entry = self.retrievals.get(normalize_query(query))
+        if entry is not None:
+            self.retrievals.move_to_end(normalize_query(query))
+        return entry
+
+    def remember_retrieval(self, query, context, docs):
+        self.retrievals[normalize_query(query)] = (context, docs)
+        self.retrievals.move_to_end(normalize_query(query))
+        while len(self.retrievals) > SESSION_RETRIEVALS:
+            self.retrievals.popitem(last=False)
+
+    def recent_turns(self):
+        """Turnos más recientes que caben en el presupuesto del historial."""
+        selected, used = [], 0
+        for turn in reversed(self.turns):
+            used += _turn_tokens(turn)
+            if used > SESSION_HISTORY_TOKEN_BUDGET:
+                break
+            selected.append(turn)
+        return selected[::-1]
+
+    def overflow_turns(self):
+        """Turnos que ya no caben en el historial y deben pasar al resumen."""
+        return self.turns[:len(self.turns) - len(self.recent_turns())]
+
+    def build_messages(self, query):
+        """
+        Mensajes para el agente: resumen y pasajes ya recuperados (si los hay), los
+        turnos recientes y la consulta. El tamaño está acotado por los presupuestos,
+        sea cual sea la longitud de la conversación.
+        """
+        messages = []
+        # Las recuperaciones más recientes primero; build_context descarta los chunks repetidos.
+        docs = [doc for _, used in reversed(self.retrievals.values()) for doc in used]
+        passages, _ = build_context(docs, SESSION_CONTEXT_TOKEN_BUDGET) if docs else ("", [])
+        if self.summary or passages:
+            # Import diferido: los prompts cargan LangChain, que el servidor no necesita para arrancar.
+            from src.prompts.session_prompt import CONVERSATION_CONTEXT_PROMPT
+            messages.append(("system", CONVERSATION_CONTEXT_PROMPT.format(
+                summary=self.summary or "-", passages=passages or "-",
+            )))
+        for question, answer in self.recent_turns():
+            messages.extend([("user", question), ("assistant", answer)])
+        messages.append(("user", query))
+        return messages
+
+    def add_turn(self, query, answer):
+        self.turns.append((query, answer))
+        self.last_used = time.monotonic()
+
+    async def compact(self, llm):
+        """Resume con el LLM los turnos que ya no caben en el historial."""
+        async with self.lock:
+            overflow = self.overflow_turns()
+            if not overflow:
+                return
+            turns = "\n".join(f"Usuario: {q}\nAsistente: {a}" for q, a in overflow)
+            summary = ""
+            from src.prompts.session_prompt import SESSION_SUMMARY_PROMPT
+            try:
+                with span("session_summary"):
+                    result = await llm.ainvoke(
+                        SESSION_SUMMARY_PROMPT.format(
+                            summary=self.summary or "-", turns=turns,
+                            max_words=SESSION_SUMMARY_TOKEN_BUDGET * 3 // 4,
+                        ),
+                        config={"callbacks": llm_callbacks("session_summary")},
+                    )
+                summary = getattr(result, "content", result)
+            except Exception as e:
+                console.log(f"[red]No se pudo resumir la sesión {self.id}:[/red] {e}")
+            if not isinstance(summary, str) or not summary.strip():
+                # Sin LLM disponible se conservan al menos las preguntas.
+                summary = "\n".join([self.summary] + [f"Usuario: {q}" for q, _ in overflow]).strip()
+            # El resumen también está acotado: se conserva lo más reciente.
+            self.summary = summary.strip()[-SESSION_SUMMARY_TOKEN_BUDGET * 4:]
+            del self.turns[:len(overflow)]
+
+
+class SessionStore:
+    """Sesiones en memoria, con caducidad por inactividad y expulsión LRU."""
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # Referencias a las compactaciones en curso para que no las recoja el GC.
+        self._tasks = set()
+
+    def get(self, session_id=None):
+        """Devuelve la sesión `session_id`, o una nueva si no existe o ha caducado."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and now - session.last_used > self.ttl:
+                del self._sessions[session_id]
+                session = None
+            if session is None:
+                session = ChatSession(session_id or uuid.uuid4().hex)
+                self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            session.last_used = now
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def schedule_compaction(self, session, llm):
+        """Compacta en segundo plano: la respuesta no espera al resumen."""
+        if not session.overflow_turns():
+            return
+        task = asyncio.ensure_future(session.compact(llm))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,29 @@
+from langchain_core.documents import Document
+
+from src.agents.context_builder import merge_spans
+
+
+def _chunk(text, start_index, page, doc_id=None):
+    metadata = {"source": "data/ley.pdf", "page": page, "start_index": start_index}
+    if doc_id is not None:
+        metadata["doc_id"] = doc_id
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_pages_of_one_pdf_are_not_merged():
+    # Mismo fichero y offsets solapados, pero cada página tiene su propio origen de coordenadas.
+    docs = [_chunk("Plazo de treinta días.", 10, page=0), _chunk("Uso y sanciones.", 12, page=4)]
+    spans = merge_spans(docs)
+    assert [span.text for span in spans] == ["Plazo de treinta días.", "Uso y sanciones."]
+
+
+def test_pages_are_keyed_by_doc_id_when_present():
+    docs = [_chunk("Plazo de treinta días.", 10, page=0, doc_id="a"),
+            _chunk("Uso y sanciones.", 12, page=0, doc_id="b")]
+    assert len(merge_spans(docs)) == 2
+
+
+def test_overlapping_chunks_of_one_page_are_merged():
+    docs = [_chunk("Plazo de treinta días", 0, page=2), _chunk("treinta días hábiles.", 9, page=2)]
+    spans = merge_spans(docs)
+    assert [span.text for span in spans] == ["Plazo de treinta días hábiles."]